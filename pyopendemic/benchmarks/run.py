@@ -0,0 +1,349 @@
+"""Benchmarks of the modelling and data hot paths.
+
+Everything runs offline, on synthetic series and on the data bundled with
+the repository. For each case the script reports the best wall time over a
+few runs and the peak memory allocated by a separate run (via tracemalloc).
+
+Run from the pyopendemic folder:
+
+    python benchmarks/run.py                            # quick scale
+    python benchmarks/run.py --scale full --save baseline.json
+    python benchmarks/run.py --scale full --compare baseline.json
+
+With `--compare` the exit status is 1 if any case is slower (or uses more
+memory) than the baseline by more than the tolerance.
+"""
+import argparse
+import json
+import os
+import platform
+import re
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from typing import Callable, List, Tuple
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import opendemic.modelling as odm  # noqa: E402
+from opendemic.data import county_codes  # noqa: E402
+from opendemic.data import RegionPanel  # noqa: E402
+from opendemic.data import USARegionData  # noqa: E402
+from opendemic.data import cache  # noqa: E402
+from opendemic.data import usa  # noqa: E402
+from opendemic.data.core import _smooth_new_cases  # noqa: E402
+from opendemic.data.usa import REGIONS  # noqa: E402
+from opendemic.modelling import systrom  # noqa: E402
+
+ROOT = Path(__file__).resolve().parents[1]
+DATA = ROOT.parent / 'data'
+
+_BENCHMARKS = []
+_FASTER = {}
+
+
+def benchmark(quick: List[dict], full: List[dict], faster: str = None):
+    """Register a benchmark.
+
+    The decorated function receives the parameters of a case and returns the
+    callable to measure, or None if the case cannot run (e.g. missing data).
+    If `faster` is the name of a boolean parameter, each case with that
+    parameter True must be faster than the same case with it False.
+    """
+    def decorator(setup: Callable):
+        _BENCHMARKS.append((setup.__name__, setup, {'quick': quick,
+                                                    'full': full}))
+        if faster is not None:
+            _FASTER[setup.__name__] = faster
+        return setup
+    return decorator
+
+
+def _dates(days: int) -> list:
+    return [datetime(2020, 3, 1) + timedelta(days=d) for d in range(days)]
+
+
+def _new_cases(nregions: int, days: int, seed: int = 0) -> np.ndarray:
+    # waves of different size and timing, one row per region
+    rng = np.random.default_rng(seed)
+    t = np.arange(days)
+    scale = rng.lognormal(3, 1, (nregions, 1))
+    peak = rng.uniform(0.2, 0.8, (nregions, 1)) * days
+    width = rng.uniform(0.1, 0.3, (nregions, 1)) * days
+    lam = scale * np.exp(-0.5 * ((t - peak) / width) ** 2) + 5
+    return rng.poisson(lam).astype(float)
+
+
+def _cases(nregions: int, days: int, seed: int = 0) -> np.ndarray:
+    return np.cumsum(_new_cases(nregions, days, seed), axis=1) + 20
+
+
+def _smoothed(nregions: int, days: int) -> np.ndarray:
+    # model input, i.e. RegionData.new_cases without the trimming
+    return _smooth_new_cases(_cases(nregions, days).astype(np.float32))
+
+
+@benchmark(quick=[{'days': 60, 'engine': 'banded'},
+                  {'days': 365, 'engine': 'banded'},
+                  {'days': 60, 'engine': 'dense'}],
+           full=[{'days': d, 'engine': e} for d in (60, 365, 1000)
+                 for e in ('dense', 'banded', 'convolution')])
+def get_posteriors(days: int, engine: str):
+    ts = _smoothed(1, days)[0]
+    return lambda: systrom.get_posteriors(ts, engine=engine)
+
+
+@benchmark(quick=[{'rows': 1}, {'rows': 365}],
+           full=[{'rows': 1}, {'rows': 365}, {'rows': 3300}])
+def high_density_interval(rows: int):
+    post, _ = systrom.get_posteriors(_smoothed(1, 60)[0])
+    pmfs = post[np.arange(rows) % post.shape[0]]
+    if rows == 1:
+        return lambda: systrom.high_density_interval(pmfs[0])
+    return lambda: systrom.high_density_intervals(pmfs)
+
+
+@benchmark(quick=[{'days': 60}, {'days': 1000}],
+           full=[{'days': 60}, {'days': 365}, {'days': 1000}])
+def compute_rt(days: int):
+    ts = _smoothed(1, days)[0]
+    return lambda: odm.compute_rt(ts)
+
+
+@benchmark(quick=[{'regions': 100, 'days': 60, 'batch': b}
+                  for b in (False, True)],
+           full=[{'regions': r, 'days': 60, 'batch': b}
+                 for r in (20, 100, 3300) for b in (False, True)],
+           faster='batch')
+def compute_rt_batch(regions: int, days: int, batch: bool):
+    # the batched filter against a loop over the regions
+    ts = _smoothed(regions, days)
+    if batch:
+        return lambda: odm.compute_rt_batch(ts)
+    return lambda: [odm.compute_rt(row) for row in ts]
+
+
+@benchmark(quick=[{'regions': 3, 'processes': 1}],
+           full=[{'regions': 10, 'processes': 1},
+                 {'regions': 300, 'processes': 1},
+                 {'regions': 300, 'processes': None}])
+def sigma_update(regions: int, processes: int):
+    days = 60
+    data = USARegionData.from_arrays(range(regions), range(regions),
+                                     _dates(days), _cases(regions, days))
+    return lambda: odm.sigma_update(data, processes=processes)
+
+
+@benchmark(quick=[{'regions': 100, 'batch': False},
+                  {'regions': 3300, 'batch': True}],
+           full=[{'regions': r, 'batch': b} for r in (100, 3300)
+                 for b in (False, True)])
+def region_data(regions: int, batch: bool):
+    days = 75
+    dates = _dates(days)
+    cases = _cases(regions, days).astype(np.float32)
+    if batch:
+        return lambda: USARegionData.from_arrays(range(regions),
+                                                 range(regions), dates, cases)
+    return lambda: [USARegionData(i, i, dates, c) for i, c in
+                    enumerate(cases)]
+
+
+@benchmark(quick=[{}], full=[{}])
+def jhu_panel():
+    path = DATA / 'time_series_cases.csv'
+    if not path.is_file():
+        return None
+    return lambda: RegionPanel.from_jhu_csv(path).regions()
+
+
+def _nyt_csv(path: str, fips: np.ndarray, days: int):
+    # same layout of the NYT database, one row per county and day
+    dates = pd.date_range('2020-03-01', periods=days).strftime('%Y-%m-%d')
+    pd.DataFrame({
+        'date': np.repeat(dates, fips.size),
+        'county': 'County', 'state': 'State',
+        'fips': np.tile(fips, days),
+        'cases': _cases(fips.size, days).T.ravel().astype(int),
+        'deaths': 0}).to_csv(path, index=False)
+
+
+def _covid_tracking_json(path: str, states: list, days: int):
+    # same layout of the Covid Tracking Project API
+    dates = pd.date_range('2020-03-01', periods=days).strftime('%Y%m%d')
+    pd.DataFrame({
+        'date': np.repeat(dates.astype(int), len(states)),
+        'state': np.tile(states, days),
+        'positive': _cases(len(states), days).T.ravel().astype(int),
+    }).to_json(path, orient='records')
+
+
+@benchmark(quick=[{'counties': 300, 'days': 60}],
+           full=[{'counties': 300, 'days': 60},
+                 {'counties': 3000, 'days': 120}])
+def fetch_many(counties: int, days: int):
+    # sources written to a temporary folder, read without the cache
+    tmp = TemporaryDirectory()
+    nyt = os.path.join(tmp.name, 'us-counties.csv')
+    ctp = os.path.join(tmp.name, 'daily.json')
+    codes = county_codes()[:counties]
+    _nyt_csv(nyt, codes, days)
+    _covid_tracking_json(ctp, REGIONS[1:], days)
+
+    def run():
+        previous = cache.configure(enabled=False)
+        urls = usa.NYT_URL, usa.COVID_TRACKING_PROJECT_URL
+        usa.NYT_URL = Path(nyt).as_uri()
+        usa.COVID_TRACKING_PROJECT_URL = Path(ctp).as_uri()
+        try:
+            USARegionData.fetch_many(states=REGIONS[1:], counties=codes)
+        finally:
+            usa.NYT_URL, usa.COVID_TRACKING_PROJECT_URL = urls
+            cache.configure(**previous)
+            run.tmp = tmp  # the folder lives as long as the benchmark
+    return run
+
+
+@benchmark(quick=[{'module': 'opendemic'}],
+           full=[{'module': 'opendemic'}, {'module': 'opendemic.modelling'}])
+def import_time(module: str):
+    # a fresh interpreter per run, i.e. the startup time of the scripts
+    command = [sys.executable, '-c', f'import {module}']
+    return lambda: subprocess.run(command, cwd=ROOT, check=True)
+
+
+def measure(func: Callable, repeat: int, max_time: float
+            ) -> Tuple[float, int]:
+    """Best wall time over `repeat` runs, or fewer if they take more than
+    `max_time` seconds, and peak traced memory of one run, in bytes."""
+    func()  # warm-up, e.g. models cached by get_model
+    times = []
+    start = time.perf_counter()
+    while not times or (len(times) < repeat and
+                        time.perf_counter() - start < max_time):
+        t0 = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - t0)
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return min(times), peak
+
+
+def _case_name(name: str, params: dict) -> str:
+    args = ','.join(f'{k}={v}' for k, v in params.items())
+    return f'{name}[{args}]' if args else name
+
+
+def run(scale: str, pattern: str = None, repeat: int = 5,
+        max_time: float = 2.) -> dict:
+    results = {}
+    for name, setup, grids in _BENCHMARKS:
+        for params in grids[scale]:
+            case = _case_name(name, params)
+            if pattern is not None and not re.search(pattern, case):
+                continue
+            func = setup(**params)
+            if func is None:
+                print(f'{case:<50} skipped', file=sys.stderr)
+                continue
+            seconds, peak = measure(func, repeat, max_time)
+            results[case] = {'time': seconds, 'peak': peak}
+            print(f'{case:<50} {seconds * 1e3:>10.2f} ms '
+                  f'{peak / 2 ** 20:>10.2f} MiB', flush=True)
+    return results
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> List[str]:
+    """Print the ratios to the baseline and return the regressed cases."""
+    regressions = []
+    print(f'\n{"case":<50} {"time":>10} {"memory":>10}')
+    for case, res in results.items():
+        base = baseline.get(case)
+        if base is None:
+            continue
+        time_ratio = res['time'] / base['time']
+        mem_ratio = res['peak'] / max(base['peak'], 1)
+        flag = ''
+        if time_ratio > 1 + tolerance or mem_ratio > 1 + tolerance:
+            flag = '  REGRESSION'
+            regressions.append(case)
+        print(f'{case:<50} {time_ratio:>9.2f}x {mem_ratio:>9.2f}x{flag}')
+    return regressions
+
+
+def check_faster(results: dict) -> List[str]:
+    """Print the speedups of the cases registered with `faster` and return
+    the ones that are not faster than their reference."""
+    slower = []
+    for name, setup, grids in _BENCHMARKS:
+        param = _FASTER.get(name)
+        if param is None:
+            continue
+        cases = {_case_name(name, params): params
+                 for params in grids['quick'] + grids['full']}
+        for case, params in cases.items():
+            if not params[param]:
+                continue
+            reference = _case_name(name, {**params, param: False})
+            if case not in results or reference not in results:
+                continue
+            speedup = results[reference]['time'] / results[case]['time']
+            flag = ''
+            if speedup <= 1:
+                flag = '  NOT FASTER'
+                slower.append(case)
+            print(f'{case:<50} {speedup:>9.2f}x faster{flag}')
+    return sorted(set(slower))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scale', choices=['quick', 'full'],
+                        default='quick',
+                        help='Size of the cases. Default: quick.')
+    parser.add_argument('-k', metavar='<regex>', dest='pattern',
+                        help='Run only the cases whose name matches.')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='Maximum number of timed runs, fewer if they '
+                             'take more than 2 seconds. Default: 5.')
+    parser.add_argument('--save', metavar='<path>',
+                        help='Save the results as a json baseline.')
+    parser.add_argument('--compare', metavar='<path>',
+                        help='Compare the results with a json baseline.')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='Relative slowdown (or memory growth) reported '
+                             'as a regression. Default: 0.2.')
+    args = parser.parse_args()
+
+    results = run(args.scale, args.pattern, args.repeat)
+    failed = bool(check_faster(results))
+
+    if args.save is not None:
+        with open(args.save, 'w') as f:
+            json.dump({'machine': {'python': platform.python_version(),
+                                   'numpy': np.__version__,
+                                   'platform': platform.platform()},
+                       'scale': args.scale, 'results': results}, f,
+                      indent=2)
+
+    if args.compare is not None:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+        failed |= bool(compare(results, baseline, args.tolerance))
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
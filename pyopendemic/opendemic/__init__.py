@@ -1,2 +1,3 @@
 import opendemic.data
-import opendemic.modelling
\ No newline at end of file
+import opendemic.modelling
+import opendemic.profiling
@@ -0,0 +1,28 @@
+# Deferred import of the heavy dependencies (pandas and the scipy
+# subpackages), which take most of the time of `import opendemic`. A module
+# is actually imported the first time one of its attributes is accessed,
+# hence code that never uses it (e.g. a worker process that only runs the
+# filter on arrays) never pays for it.
+import importlib
+import sys
+import types
+
+
+class _LazyModule(types.ModuleType):
+    def __getattr__(self, attr: str):
+        module = importlib.import_module(self.__name__)
+        # later lookups find the attributes without calling __getattr__
+        self.__dict__.update(module.__dict__)
+        return getattr(module, attr)
+
+    def __repr__(self) -> str:
+        return f'<lazy module {self.__name__!r}>'
+
+
+def lazy_import(name: str) -> types.ModuleType:
+    """Module `name`, imported on first attribute access unless it was
+    already imported."""
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    return _LazyModule(name)
@@ -1,4 +1,11 @@
+from .fips import county_codes
+from .fips import fips2name
+from .fips import fips2names
+from .fips import fips2state
+from .fips import fips_is_known
+from .fips import name2fips
 from .italy import REGIONS as ALLOWED_REGIONS_ITALY
 from .italy import RegionData as ItalyRegionData
+from .panel import RegionPanel
 from .usa import REGIONS as ALLOWED_REGIONS_USA
 from .usa import RegionData as USARegionData
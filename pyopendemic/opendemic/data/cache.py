@@ -0,0 +1,149 @@
+# Local on-disk cache of the remote sources. Each source is stored already
+# parsed, keyed by its URL and by the date it was downloaded, so that the
+# same file is downloaded at most once per TTL. Sources are read through the
+# cache by `opendemic.data.download.read` and `read_all`.
+from __future__ import annotations
+
+import hashlib
+import logging
+import os
+import time
+from datetime import date
+from glob import glob
+from importlib.util import find_spec
+from typing import Union
+
+from .._lazy import lazy_import
+from ..profiling import count
+from ..profiling import span
+
+pd = lazy_import('pandas')
+
+# Parquet is columnar and fast to read, but it requires an optional
+# dependency. Pickled DataFrames are used otherwise.
+_FORMAT = 'parquet' if find_spec('pyarrow') is not None else 'pkl'
+
+_CONFIG = {
+    'directory': os.environ.get(
+        'OPENDEMIC_CACHE_DIR',
+        os.path.join(os.path.expanduser('~'), '.cache', 'opendemic')),
+    'ttl': float(os.environ.get('OPENDEMIC_CACHE_TTL', 6 * 3600)),
+    'offline': os.environ.get('OPENDEMIC_OFFLINE', '0') not in ('', '0'),
+    'enabled': os.environ.get('OPENDEMIC_NO_CACHE', '0') in ('', '0'),
+}
+
+
+class CacheMiss(LookupError):
+    """Raised in offline mode when a source is not in the cache."""
+    pass
+
+
+def configure(directory: str = None, ttl: float = None, offline: bool = None,
+              enabled: bool = None) -> dict:
+    """Configure the cache. Arguments left to None are not changed.
+
+    The initial configuration can also be set via the environment variables
+    OPENDEMIC_CACHE_DIR, OPENDEMIC_CACHE_TTL, OPENDEMIC_OFFLINE and
+    OPENDEMIC_NO_CACHE.
+
+    Args:
+        directory: str
+            Directory of the cache. Default: ~/.cache/opendemic
+        ttl: float
+            Time to live of the cached sources in seconds. Default: 6 hours.
+        offline: bool
+            If True, sources are served only from the cache, regardless of
+            their age, and nothing is downloaded. Default: False.
+        enabled: bool
+            If False, sources are always downloaded and never stored.
+            Default: True.
+    Returns:
+        dict with the previous configuration, which can be restored with
+        `configure(**previous)`.
+    """
+    previous = dict(_CONFIG)
+    for key, value in [('directory', directory), ('ttl', ttl),
+                       ('offline', offline), ('enabled', enabled)]:
+        if value is not None:
+            _CONFIG[key] = value
+    return previous
+
+
+def get_config() -> dict:
+    """Current configuration of the cache. See `configure`."""
+    return dict(_CONFIG)
+
+
+def _key(url: str) -> str:
+    return hashlib.sha1(url.encode('utf-8')).hexdigest()[:20]
+
+
+def _entries(url: str) -> list:
+    # cached files of the url, the most recent first
+    pattern = os.path.join(_CONFIG['directory'], f'{_key(url)}-*.{_FORMAT}')
+    return sorted(glob(pattern), key=os.path.getmtime, reverse=True)
+
+
+def _load(path: str) -> pd.DataFrame:
+    if _FORMAT == 'parquet':
+        return pd.read_parquet(path)
+    return pd.read_pickle(path)
+
+
+def store(df: pd.DataFrame, url: str):
+    """Store the parsed source `url`, replacing its previous copies. Nothing
+    is stored if the cache is disabled."""
+    if not _CONFIG['enabled']:
+        return
+    directory = _CONFIG['directory']
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory,
+                        f'{_key(url)}-{date.today():%Y%m%d}.{_FORMAT}')
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with span('data.cache_store'):
+        if _FORMAT == 'parquet':
+            df.to_parquet(tmp)
+        else:
+            df.to_pickle(tmp)
+        # atomic, concurrent readers never see partial files
+        os.replace(tmp, path)
+        for old in _entries(url):
+            if old != path:
+                os.remove(old)
+
+
+def lookup(url: str) -> Union[pd.DataFrame, None]:
+    """Cached copy of the source `url`, if it is still valid.
+
+    Return:
+        pd.DataFrame with the parsed source, or None if the source has to be
+        downloaded, i.e. it is not cached, its copy is older than the TTL or
+        the cache is disabled.
+    Raises:
+        CacheMiss: in offline mode, if the source is not in the cache.
+    """
+    if not _CONFIG['enabled']:
+        return None
+    entries = _entries(url)
+    if entries:
+        age = time.time() - os.path.getmtime(entries[0])
+        if _CONFIG['offline'] or age <= _CONFIG['ttl']:
+            logging.debug(f'Reading {url} from the cache ({age:.0f} s old).')
+            count('data.cache_hits')
+            with span('data.cache_load'):
+                return _load(entries[0])
+    if _CONFIG['offline']:
+        raise CacheMiss(f'{url} is not in the cache at '
+                        f"{_CONFIG['directory']} and offline mode is on.")
+    count('data.cache_misses')
+    return None
+
+
+def clear(url: str = None):
+    """Remove the cached copies of `url`, or the whole cache if None."""
+    if url is not None:
+        entries = _entries(url)
+    else:
+        entries = glob(os.path.join(_CONFIG['directory'], f'*-*.{_FORMAT}'))
+    for path in entries:
+        os.remove(path)
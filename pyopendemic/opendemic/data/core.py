@@ -1,61 +1,209 @@
+from __future__ import annotations
+
 import logging
 from abc import ABC
-from typing import Iterable, Sized, Union
+from typing import Iterable, Sized, Tuple, Union
 
 import numpy as np
-import pandas as pd
-from scipy.ndimage import gaussian_filter1d
+
+from .._lazy import lazy_import
+from ..profiling import count
+from ..profiling import span
+from ..profiling import timed
+
+pd = lazy_import('pandas')
+ndimage = lazy_import('scipy.ndimage')
 
 ArrayType = Union[Iterable, Sized]  # Intersection does not yet exist
 
 
+@timed('data.aggregate')
+def aggregate_by_date(df: pd.DataFrame, date_column: str, value_column: str,
+                      region_column: str = None, date_format: str = None
+                      ) -> pd.DataFrame:
+    """Sum the values reported in the same date for each region.
+
+    Missing values are counted as zero, hence a date with only missing values
+    has total zero. Rows with a missing region are discarded.
+
+    Args:
+        df: pd.DataFrame
+            Data in long format, i.e. one row per report.
+        date_column: str
+            Column with the dates of the reports.
+        value_column: str
+            Column with the values to aggregate.
+        region_column: str
+            Column with the identifier of the region. If None, all the rows
+            are aggregated together in a single column named `value_column`.
+        date_format: str
+            Format of the dates, passed to `pd.to_datetime`. The dates are
+            parsed once per unique value.
+    Return:
+        pd.DataFrame with one row per date, sorted chronologically, and one
+        column per region. Dates in which a region has no report are NaN.
+    """
+    keys = [date_column] if region_column is None else [date_column,
+                                                        region_column]
+    table = df.groupby(keys)[value_column].sum()
+    if region_column is None:
+        table = table.to_frame()
+    else:
+        table = table.unstack(region_column)
+    table.index = pd.to_datetime(table.index.astype(str), format=date_format)
+    return table.sort_index()
+
+
+def region_series(table: pd.DataFrame, region) -> Tuple[np.ndarray,
+                                                        np.ndarray]:
+    """Dates and values of a region from the output of `aggregate_by_date`.
+
+    Return:
+        Tuple with the days (np.datetime64) in which the region has reports
+        and the corresponding values.
+    """
+    column = table[region].dropna()
+    return _as_days(column.index.to_numpy()), column.to_numpy(dtype=float)
+
+
+def _as_days(dates: ArrayType) -> np.ndarray:
+    # datetime64[D] array, the time of the day is discarded
+    return np.asarray(dates, dtype='datetime64[D]')
+
+
+def _readonly(array: np.ndarray) -> np.ndarray:
+    # read-only view, the array it is taken from is still writeable
+    view = array.view()
+    view.flags.writeable = False
+    return view
+
+
+def _start_indices(cases: np.ndarray) -> np.ndarray:
+    # Discard all the data until non-zero new cases are consistently
+    # reported, i.e. start after the last day with less than 15 new cases
+    # that precedes the first day with at least 15.
+    # If more than 20% of the data points are discarded, start at day
+    # 20% + 1
+    # TODO: do we really want to decide the biggest chunk we can cut?
+    portion = 0.2  # if you change this, change also the comment above
+    nregions, npoints = cases.shape
+    if npoints < 2:
+        return np.zeros(nregions, dtype=int)
+    reported = ~(np.diff(cases, axis=1) < 15)  # NaN-s stop the trimming too
+    starts = np.where(reported.any(axis=1), reported.argmax(axis=1),
+                      npoints - 1)
+    tolerable_crop = int(np.ceil(portion * npoints))
+    return np.minimum(starts, tolerable_crop)
+
+
+def _smooth_new_cases(cases: np.ndarray) -> np.ndarray:
+    # rounded gaussian filter of the daily increments of each row, preceded
+    # by the first value of the row
+    new_cases = np.empty_like(cases)
+    new_cases[:, 0] = cases[:, 0]
+    new_cases[:, 1:] = np.round(
+        ndimage.gaussian_filter1d(np.diff(cases, axis=1), 3, axis=1))
+    return new_cases
+
+
 class AbstractRegionData(ABC):
+    # Thousands of regions can be held in memory, e.g. by a dashboard. The
+    # slots avoid a __dict__ per object; subclasses must declare
+    # `__slots__ = ()` as well.
+    __slots__ = ('_name', '_code', '_dates', '_cases', '_smoothed_new_cases',
+                 '_asdf')
+
     def __init__(self, name: str, code: str, dates: ArrayType,
                  cases: ArrayType):
         """Initiate a RegionData """
         self._name = str(name)
         self._code = str(code)
 
+        dates = _as_days(dates)
         if len(dates) != np.unique(dates).size:
             raise ValueError('Values of `dates` are not unique.')
         if len(dates) != len(cases):
             raise ValueError('`dates` and `cases` must have the same length.')
 
         cases = np.asarray(cases, dtype=np.float32)
-
-        # discard all the data until non-zero new cases are consistently
-        # reported
-        diffcases = np.diff(cases)
-        idx_start = 0
-        for i, v in enumerate(diffcases):
-            if v < 15:
-                idx_start = i + 1
-            else:
-                break
-
-        # If more than 20% of the data points are discarded, start at day
-        # 20% + 1
-        # TODO: do we really want to decide the biggest chunk we can cut?
-        portion = 0.2  # if you change this, change also the comment above
-        tolerable_crop = np.ceil(portion * cases.size)
-        if idx_start > tolerable_crop:
-            idx_start = int(np.ceil(tolerable_crop))
+        with span('data.preprocess'):
+            idx_start = int(_start_indices(cases[None, :])[0])
+            self._cases = _readonly(cases[idx_start:])
+            self._smoothed_new_cases = _readonly(_smooth_new_cases(
+                self._cases[None, :])[0])
+        count('data.regions')
         logging.debug(f'Ignoring the first {idx_start} data points as they\'re '
                       f'zero-report days.')
 
-        self._cases = cases[idx_start:]
+        self._dates = _readonly(dates[idx_start:])
+        self._asdf = None
+
+    @classmethod
+    def from_arrays(cls, names: ArrayType, codes: ArrayType, dates: ArrayType,
+                    cases: np.ndarray) -> list:
+        """Build many regions sharing the same dates at once.
+
+        The result is identical to calling the constructor on each row of
+        `cases`, but the trimming of the leading days and the smoothing are
+        computed for all the regions together. The `cases` of each region
+        are read-only views of the rows of `cases` if it is already float32,
+        and their dates are views of `dates`.
 
-        new_cases = np.round(gaussian_filter1d(np.diff(self._cases), 3))
-        self._smoothed_new_cases = np.insert(new_cases, 0, self._cases[0])
+        Args:
+            names: array-like of str
+                Name of each region.
+            codes: array-like of str
+                Identification code of each region.
+            dates: array-like
+                Dates of the columns of `cases`, common to all the regions.
+            cases: np.ndarray
+                Time series of the number of cases, one row per region.
+        Return:
+            list with one instantiated object per row of `cases`.
+        """
+        cases = np.asarray(cases, dtype=np.float32)
+        dates = _as_days(dates)
+        if cases.ndim != 2:
+            raise ValueError('`cases` must be a 2d array.')
+        if not len(names) == len(codes) == cases.shape[0]:
+            raise ValueError('`names`, `codes` and `cases` must have the same '
+                             'number of regions.')
+        if len(dates) != np.unique(dates).size:
+            raise ValueError('Values of `dates` are not unique.')
+        if len(dates) != cases.shape[1]:
+            raise ValueError('`dates` and `cases` must have the same length.')
+        dates = _readonly(dates)
 
-        dates = np.asarray(dates)
-        self._dates = dates[idx_start:]
+        count('data.regions', cases.shape[0])
+        with span('data.preprocess'):
+            starts = _start_indices(cases)
+            regions = [None] * cases.shape[0]
+            # regions with the same start are smoothed together
+            for start in np.unique(starts):
+                rows = np.flatnonzero(starts == start)
+                new_cases = _readonly(_smooth_new_cases(cases[rows, start:]))
+                for row, smoothed in zip(rows, new_cases):
+                    region = cls.__new__(cls)
+                    region._name = str(names[row])
+                    region._code = str(codes[row])
+                    region._cases = _readonly(cases[row, start:])
+                    region._smoothed_new_cases = smoothed
+                    region._dates = dates[start:]
+                    region._asdf = None
+                    regions[row] = region
+        if starts.size:
+            logging.debug(f'Ignoring on average the first '
+                          f'{starts.mean():.1f} data points as they\'re '
+                          f'zero-report days.')
+        return regions
 
     @property
     def asdf(self) -> pd.DataFrame:
         """Return data AS a pandas DataFrame object.
 
-        It creates a new DataFrame with copied data every time this is called.
+        The DataFrame is built on the first call and returned by the later
+        ones. Its columns share the memory of `cases` and `new_cases`, hence
+        they are read-only: use `asdf.copy()` to modify them.
 
         Index: dates
         Columns:
@@ -65,12 +213,15 @@ class AbstractRegionData(ABC):
                 smoothing procedure.
 
         """
-        frame = {'cases': self.cases, 'new_cases': self.new_cases}
-        return pd.DataFrame(frame, index=list(self.dates), copy=True)
+        if self._asdf is None:
+            frame = {'cases': self.cases, 'new_cases': self.new_cases}
+            index = pd.DatetimeIndex(self.dates)
+            self._asdf = pd.DataFrame(frame, index=index, copy=False)
+        return self._asdf
 
     @property
     def cases(self) -> np.ndarray:
-        """Time series of the number of cases in the region."""
+        """Time series of the number of cases in the region (read-only)."""
         return self._cases
 
     @property
@@ -80,7 +231,7 @@ class AbstractRegionData(ABC):
 
     @property
     def dates(self) -> np.ndarray:
-        """Dates at which the cases are reported."""
+        """Days (np.datetime64) at which the cases are reported (read-only)."""
         return self._dates
 
     @property
@@ -0,0 +1,287 @@
+# Concurrent download of the remote sources. The sources are downloaded by a
+# pool of threads over persistent HTTP connections, with a timeout on every
+# request and retries with exponential backoff on transient failures, then
+# parsed and stored in the cache (see `opendemic.data.cache`).
+#
+# Only the standard library is used: http.client keeps the connections
+# alive, hence the many files served by the same host (e.g. the daily files
+# of a repository) share a few TCP/TLS handshakes.
+from __future__ import annotations
+
+import gzip
+import http.client
+import io
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, Tuple, Union
+from urllib.parse import urljoin, urlsplit
+from urllib.request import url2pathname
+
+from .._lazy import lazy_import
+from ..profiling import count
+from ..profiling import span
+from . import cache
+
+pd = lazy_import('pandas')
+
+DEFAULT_WORKERS = 8
+DEFAULT_TIMEOUT = 30.
+DEFAULT_RETRIES = 3
+DEFAULT_BACKOFF = 0.5
+
+_MAX_REDIRECTS = 5
+# transient failures, worth a retry
+_RETRY_STATUS = {408, 429, 500, 502, 503, 504}
+_REDIRECT_STATUS = {301, 302, 303, 307, 308}
+
+
+class DownloadError(IOError):
+    """Raised when a source cannot be downloaded, e.g. it does not exist or
+    the retries are exhausted."""
+    pass
+
+
+class _TransientError(Exception):
+    def __init__(self, message: str, retry_after: float = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class ConnectionPool:
+    """Thread-safe pool of persistent HTTP(S) connections, at most
+    `maxsize` idle connections per host."""
+
+    def __init__(self, maxsize: int = DEFAULT_WORKERS,
+                 timeout: float = DEFAULT_TIMEOUT):
+        self._maxsize = maxsize
+        self._timeout = timeout
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def _queue(self, key: tuple) -> queue.LifoQueue:
+        with self._lock:
+            return self._idle.setdefault(key, queue.LifoQueue(self._maxsize))
+
+    def get(self, url: str, headers: Dict[str, str] = None
+            ) -> Tuple[int, Dict[str, str], bytes]:
+        """Send a GET request and read the whole response.
+
+        Return:
+            Tuple with the status, the headers (lower case names) and the
+            body of the response.
+        """
+        parts = urlsplit(url)
+        if parts.scheme not in ('http', 'https'):
+            raise ValueError(f'Unsupported scheme in {url}.')
+        key = (parts.scheme, parts.hostname, parts.port)
+        path = parts.path or '/'
+        if parts.query:
+            path = f'{path}?{parts.query}'
+
+        idle = self._queue(key)
+        try:
+            conn, reused = idle.get_nowait(), True
+        except queue.Empty:
+            conn, reused = self._connect(*key), False
+        try:
+            conn.request('GET', path, headers=headers or {})
+            response = conn.getresponse()
+            body = response.read()
+        except (http.client.RemoteDisconnected, ConnectionResetError,
+                BrokenPipeError):
+            conn.close()
+            if not reused:
+                raise
+            # the server closed the idle connection, not a failure
+            return self.get(url, headers)
+        except BaseException:
+            conn.close()
+            raise
+
+        if response.will_close:
+            conn.close()
+        else:
+            try:
+                idle.put_nowait(conn)
+            except queue.Full:
+                conn.close()
+        return response.status, {k.lower(): v for k, v in
+                                 response.getheaders()}, body
+
+    def _connect(self, scheme: str, host: str, port: int
+                 ) -> http.client.HTTPConnection:
+        count('data.http_connections')
+        if scheme == 'https':
+            return http.client.HTTPSConnection(host, port,
+                                               timeout=self._timeout)
+        return http.client.HTTPConnection(host, port, timeout=self._timeout)
+
+    def close(self):
+        """Close the idle connections."""
+        with self._lock:
+            queues, self._idle = list(self._idle.values()), {}
+        for q in queues:
+            while True:
+                try:
+                    q.get_nowait().close()
+                except queue.Empty:
+                    break
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+
+def _retry_after(headers: Dict[str, str]) -> Union[float, None]:
+    try:
+        return float(headers['retry-after'])
+    except (KeyError, ValueError):
+        return None
+
+
+def _get(url: str, pool: ConnectionPool) -> bytes:
+    for _ in range(_MAX_REDIRECTS + 1):
+        status, headers, body = pool.get(url, {'Accept-Encoding': 'gzip'})
+        if status in _REDIRECT_STATUS and 'location' in headers:
+            url = urljoin(url, headers['location'])
+            continue
+        if status in _RETRY_STATUS:
+            raise _TransientError(f'HTTP {status} from {url}.',
+                                  _retry_after(headers))
+        if status >= 400:
+            raise DownloadError(f'HTTP {status} from {url}.')
+        if headers.get('content-encoding') == 'gzip':
+            body = gzip.decompress(body)
+        return body
+    raise DownloadError(f'Too many redirects from {url}.')
+
+
+def fetch(url: str, pool: ConnectionPool = None,
+          retries: int = DEFAULT_RETRIES,
+          backoff: float = DEFAULT_BACKOFF) -> bytes:
+    """Download the content of a URL.
+
+    Local paths and file:// URLs are read from disk.
+
+    Args:
+        url: str
+            Location of the source.
+        pool: ConnectionPool
+            Connections to reuse. If None, a connection is opened for this
+            request only.
+        retries: int
+            Number of retries after a timeout, a connection error or a
+            transient HTTP status (e.g. 503 or 429).
+        backoff: float
+            Seconds before the first retry, doubled at each retry. A
+            Retry-After header sent by the server takes precedence.
+    Return:
+        bytes with the content, decompressed if sent with gzip encoding.
+    Raises:
+        DownloadError: if the source does not exist or all the retries
+            failed.
+    """
+    parts = urlsplit(url)
+    if parts.scheme in ('', 'file'):
+        path = url2pathname(parts.path) if parts.scheme else url
+        try:
+            with open(path, 'rb') as f:
+                return f.read()
+        except OSError as e:
+            raise DownloadError(f'Cannot read {url}: {e}') from e
+
+    if pool is None:
+        with ConnectionPool(1) as pool:
+            return fetch(url, pool, retries, backoff)
+
+    for attempt in range(retries + 1):
+        try:
+            with span('data.download'):
+                return _get(url, pool)
+        except DownloadError:
+            raise
+        except (_TransientError, http.client.HTTPException, OSError) as e:
+            if attempt == retries:
+                raise DownloadError(f'Cannot download {url} after '
+                                    f'{retries + 1} attempts: {e}') from e
+            delay = getattr(e, 'retry_after', None)
+            if delay is None:
+                delay = backoff * 2 ** attempt
+            logging.debug(f'Retrying {url} in {delay:.1f} s: {e}')
+            count('data.download_retries')
+            time.sleep(delay)
+
+
+def fetch_all(urls: Iterable[str], max_workers: int = DEFAULT_WORKERS,
+              timeout: float = DEFAULT_TIMEOUT,
+              retries: int = DEFAULT_RETRIES,
+              backoff: float = DEFAULT_BACKOFF) -> Dict[str, bytes]:
+    """Download many URLs concurrently over pooled connections.
+
+    Args:
+        urls: iterable of str
+            Locations of the sources. Duplicates are downloaded once.
+        max_workers: int
+            Maximum number of concurrent downloads, which is also the maximum
+            number of connections kept alive per host.
+        timeout: float
+            Timeout in seconds of the connection and of each read.
+        retries, backoff:
+            See `fetch`.
+    Return:
+        dict mapping each URL to its content, in the order of `urls`.
+    Raises:
+        DownloadError: if any source cannot be downloaded.
+    """
+    urls = list(dict.fromkeys(urls))
+    if not urls:
+        return {}
+    with ConnectionPool(max_workers, timeout) as pool, \
+            ThreadPoolExecutor(min(max_workers, len(urls))) as executor:
+        contents = executor.map(
+            lambda url: fetch(url, pool, retries, backoff), urls)
+        return dict(zip(urls, contents))
+
+
+def read(url: str, reader: Callable[..., pd.DataFrame], **kwargs
+         ) -> pd.DataFrame:
+    """Read a single source through the cache, see `read_all`."""
+    return read_all({url: reader}, **kwargs)[url]
+
+
+def read_all(sources: Dict[str, Callable[..., pd.DataFrame]],
+             **kwargs) -> Dict[str, pd.DataFrame]:
+    """Read many sources through the cache, downloading the missing ones
+    concurrently.
+
+    Args:
+        sources: dict
+            Maps the URL of each source to the function that parses it, e.g.
+            pd.read_csv. The function is called with a binary file object.
+        **kwargs:
+            Passed to `fetch_all`, e.g. `max_workers` or `timeout`.
+    Return:
+        dict mapping each URL to its parsed source, in the order of
+        `sources`.
+    Raises:
+        CacheMiss: in offline mode, if a source is not in the cache.
+        DownloadError: if a source cannot be downloaded.
+    """
+    frames = {url: cache.lookup(url) for url in sources}
+    missing = [url for url, df in frames.items() if df is None]
+    if missing:
+        logging.debug(f'Downloading {len(missing)} sources.')
+        contents = fetch_all(missing, **kwargs)
+        for url in missing:
+            with span('data.parse'):
+                df = sources[url](io.BytesIO(contents.pop(url)))
+            cache.store(df, url)
+            frames[url] = df
+    return frames
+
@@ -0,0 +1,95 @@
+# Offline index of the US FIPS codes of states and counties. The index is
+# read from the csv bundled with the package the first time it is needed.
+# The csv was built from the county list of the JHU time series in
+# data/time_series_cases.csv of the opendemic repository (counties with a
+# FIPS code below 80000, plus one row per state with code state * 1000).
+import csv
+import os
+from typing import Iterable, Tuple, Union
+
+import numpy as np
+
+_FIPS_CSV = os.path.join(os.path.dirname(__file__), 'fips.csv')
+
+_INDEX = None
+
+
+class _FipsIndex:
+    def __init__(self, path: str):
+        with open(path, newline='') as f:
+            rows = [(int(r['fips']), r['name'], r['state'])
+                    for r in csv.DictReader(f)]
+        rows.sort()
+        self.codes = np.asarray([r[0] for r in rows])
+        self.names = np.asarray([r[1] for r in rows])
+        self.states = np.asarray([r[2] for r in rows])
+        self.by_code = {r[0]: (r[1], r[2]) for r in rows}
+        # states share the name with some of their counties, e.g. New York
+        self.by_name = {(r[1].lower(), r[2]): r[0] for r in rows
+                        if r[0] % 1000}
+
+
+def _index() -> _FipsIndex:
+    global _INDEX
+    if _INDEX is None:
+        _INDEX = _FipsIndex(_FIPS_CSV)
+    return _INDEX
+
+
+def _lookup(fips: Union[str, int, float]) -> Tuple[str, str]:
+    try:
+        return _index().by_code[int(fips)]
+    except KeyError:
+        raise ValueError(f'Unknown FIPS code {fips}.')
+
+
+def fips2name(fips: Union[str, int, float]) -> str:
+    """Name of a county (or state) and code of its state, e.g.
+    'Suffolk, NY' for 36103."""
+    name, state = _lookup(fips)
+    return f'{name}, {state}'
+
+
+def fips2state(fips: Union[str, int, float]) -> str:
+    """Code of the state of a county, e.g. 'NY' for 36103."""
+    return _lookup(fips)[1]
+
+
+def county_codes() -> np.ndarray:
+    """FIPS codes of all the counties in the index, sorted."""
+    codes = _index().codes
+    return codes[codes % 1000 != 0]
+
+
+def fips_is_known(fips: Union[str, int, float]) -> bool:
+    """Whether the FIPS code is in the index."""
+    return int(fips) in _index().by_code
+
+
+def fips2names(fips: Iterable[Union[str, int, float]]) -> np.ndarray:
+    """Vectorized version of `fips2name`.
+
+    Raises:
+        ValueError: if any of the codes is unknown.
+    """
+    index = _index()
+    fips = np.asarray(fips, dtype=float).astype(int).ravel()
+    pos = np.searchsorted(index.codes, fips)
+    pos = np.minimum(pos, index.codes.size - 1)
+    unknown = index.codes[pos] != fips
+    if np.any(unknown):
+        raise ValueError(f'Unknown FIPS codes {fips[unknown].tolist()}.')
+    return np.char.add(np.char.add(index.names[pos], ', '), index.states[pos])
+
+
+def name2fips(name: str, state: str) -> int:
+    """FIPS code of a county given its name and the code of its state, e.g.
+    36103 for ('Suffolk', 'NY'). The name is case insensitive.
+
+    Raises:
+        ValueError: if the county is unknown.
+    """
+    try:
+        return _index().by_name[(name.lower(), state.upper())]
+    except KeyError:
+        raise ValueError(f'Unknown county {name}, {state}.')
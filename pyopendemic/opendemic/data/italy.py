@@ -1,10 +1,20 @@
-from datetime import datetime
-from typing import Tuple
+from __future__ import annotations
+
+from typing import Callable, Dict, Iterable, Tuple
 
 import numpy as np
-import pandas as pd
 
+from .._lazy import lazy_import
+from . import download
 from .core import AbstractRegionData
+from .core import aggregate_by_date
+from .core import region_series
+
+pd = lazy_import('pandas')
+
+PROTEZIONE_CIVILE_URL = 'https://raw.githubusercontent.com/pcm-dpc/' \
+                        'COVID-19/master/dati-regioni/' \
+                        'dpc-covid19-ita-regioni.csv'
 
 NAME2CODE = {
     'Italia': 0,
@@ -32,6 +42,21 @@ NAME2CODE = {
 
 REGIONS = list(NAME2CODE.keys())
 
+_DATE_FORMAT = '%Y-%m-%dT%H:%M:%S'
+
+
+def sources() -> Dict[str, Callable[..., pd.DataFrame]]:
+    """Sources of the Italian data and their parsers, see
+    `opendemic.data.download.read_all`."""
+    return {PROTEZIONE_CIVILE_URL: pd.read_csv}
+
+
+def _check_region(region: str):
+    if region.upper() not in [r.upper() for r in REGIONS]:
+        raise ValueError(f"'{region}' is not an available region. See "
+                         f"opendemic.data.italy.REGIONS for a list of allowed "
+                         f"regions.")
+
 
 def fetch_protezione_civile(region: str = 'Italia') -> Tuple[str, str,
                                                              np.ndarray,
@@ -49,36 +74,27 @@ def fetch_protezione_civile(region: str = 'Italia') -> Tuple[str, str,
         Tuple with the 4 elements that are necessary to instantiate RegionData
         in the right order.
     """
-    if region.upper() not in [r.upper() for r in REGIONS]:
-        raise ValueError(f"'{region}' is not an available region. See "
-                         f"opendemic.data.italy.REGIONS for a list of allowed "
-                         f"regions.")
+    _check_region(region)
 
-    address = 'https://raw.githubusercontent.com/pcm-dpc/COVID-19/master/' \
-              'dati-regioni/dpc-covid19-ita-regioni.csv'
-    df = pd.read_csv(address)
+    df = download.read(PROTEZIONE_CIVILE_URL, pd.read_csv)
 
     if region != 'Italia':
         df = df[df['denominazione_regione'] == region]
-    dates = np.unique(df['data'].to_numpy())
-    cases = np.zeros(len(dates))
-    for k, d in enumerate(dates):
-        # aggregate the data of each state
-        c = df[df['data'] == d]['totale_positivi'].to_numpy()
-        c[np.isnan(c)] = 0
-        cases[k] = np.sum(c)  # this accounts for multiple reports in the same day
+
+    # this accounts for multiple reports in the same day
+    table = aggregate_by_date(df, 'data', 'totale_positivi',
+                              date_format=_DATE_FORMAT)
+    dates, cases = region_series(table, 'totale_positivi')
 
     code = NAME2CODE.get(region)
     name = region
 
-    # convert dates to python standard format
-    dates = [datetime.strptime(str(d), '%Y-%m-%dT%H:%M:%S') for d in dates]
-    dates = np.asarray(dates)
-
     return name, code, dates, cases
 
 
 class RegionData(AbstractRegionData):
+    __slots__ = ()
+
     @classmethod
     def fetch(cls, region: str = 'Italia'):
         """Fetch data from Protezione Civile.
@@ -94,3 +110,52 @@ class RegionData(AbstractRegionData):
           opendemic.data.italy.RegionData instantiated object.
         """
         return cls(*fetch_protezione_civile(region))
+
+    @classmethod
+    def fetch_many(cls, regions: Iterable[str] = None,
+                   frames: Dict[str, pd.DataFrame] = None,
+                   **kwargs) -> Dict[str, 'RegionData']:
+        """Fetch data of many regions at once from Protezione Civile.
+
+        The source is downloaded once and aggregated for all the regions with
+        a single groupby.
+
+        Args:
+            regions: iterable of str
+                Region names (e.g. 'Lombardia' or 'Italia' for the whole
+                Italy). If None, all the regions in
+                `opendemic.data.italy.REGIONS` are fetched.
+            frames: dict
+                Sources already read, keyed by URL, e.g. by
+                `opendemic.data.download.read_all(sources())`. The missing
+                ones are read through the cache.
+            **kwargs:
+                Passed to `opendemic.data.download.fetch_all`, e.g.
+                `timeout`.
+        Return:
+            dict mapping the name of each region to its
+            opendemic.data.italy.RegionData instantiated object.
+        Raises:
+            ValueError: if a region is not available or has no data.
+        """
+        regions = REGIONS if regions is None else list(regions)
+        for r in regions:
+            _check_region(r)
+
+        frames = frames or {}
+        if PROTEZIONE_CIVILE_URL in frames:
+            df = frames[PROTEZIONE_CIVILE_URL]
+        else:
+            df = download.read(PROTEZIONE_CIVILE_URL, pd.read_csv, **kwargs)
+        table = aggregate_by_date(df, 'data', 'totale_positivi',
+                                  'denominazione_regione', _DATE_FORMAT)
+        table['Italia'] = aggregate_by_date(
+            df, 'data', 'totale_positivi',
+            date_format=_DATE_FORMAT)['totale_positivi']
+
+        data = {}
+        for r in regions:
+            if r not in table.columns:
+                raise ValueError(f'No data available for region {r}.')
+            data[r] = cls(r, NAME2CODE.get(r), *region_series(table, r))
+        return data
@@ -0,0 +1,330 @@
+from __future__ import annotations
+
+import os
+from datetime import datetime
+from typing import Dict, Iterable, Iterator, List, Tuple, Type, Union
+
+import numpy as np
+
+from .._lazy import lazy_import
+from ..profiling import timed
+from .core import AbstractRegionData
+from .usa import _CODE2NAME
+from .usa import RegionData as USARegionData
+
+pd = lazy_import('pandas')
+sparse = lazy_import('scipy.sparse')
+
+META_COLUMNS = ['UID', 'FIPS', 'Admin2', 'Province_State', 'Lat', 'Long_',
+                'Population']
+
+_VALUES = 'values.npy'
+_DATES = 'dates.npy'
+_META = 'meta.csv'
+
+LEVELS = ('state', 'national')
+
+# Province_State of the JHU series -> code of the state
+_STATE_CODES = {name.lower(): code for code, name in _CODE2NAME.items()}
+_STATE_CODES['virgin islands'] = 'VI'
+
+
+class RegionPanel:
+    """Time series of many regions held as one (regions x days) array.
+
+    Indexing a panel returns RegionData objects whose `cases` are views of
+    the panel array, i.e. no data is copied. Panels can be converted once to a
+    directory of binary files that is then memory-mapped, hence opening it
+    costs a few milliseconds regardless of the number of regions.
+    """
+
+    def __init__(self, meta: pd.DataFrame, dates: np.ndarray,
+                 values: np.ndarray,
+                 region_class: Type[AbstractRegionData] = USARegionData):
+        """Initiate a RegionPanel.
+
+        Args:
+            meta: pd.DataFrame
+                One row per region with the columns in
+                `opendemic.data.panel.META_COLUMNS`.
+            dates: np.ndarray
+                Dates of the columns of `values`.
+            values: np.ndarray
+                Cumulative number of cases with one row per region and one
+                column per date.
+            region_class: type
+                Subclass of AbstractRegionData returned when indexing the
+                panel. Default: opendemic.data.USARegionData.
+        """
+        values = np.asanyarray(values)
+        if values.ndim != 2:
+            raise ValueError('`values` must be a 2d array.')
+        if values.shape != (len(meta), len(dates)):
+            raise ValueError('`values` must have one row per region and one '
+                             'column per date.')
+        # float32 is the dtype of RegionData.cases: views instead of copies
+        if values.dtype != np.float32:
+            values = values.astype(np.float32)
+
+        self._meta = meta.reset_index(drop=True)
+        self._dates = np.asarray(dates, dtype='datetime64[D]')
+        self._values = values
+        self._region_class = region_class
+
+        fips = self._meta['FIPS']
+        self._codes = np.where(
+            fips.notna(),
+            fips.fillna(0).astype(np.int64).astype(str).str.zfill(5),
+            self._meta['UID'].astype(str))
+        self._names = np.where(
+            self._meta['Admin2'].notna(),
+            self._meta['Admin2'].astype(str) + ', ' +
+            self._meta['Province_State'].astype(str),
+            self._meta['Province_State'].astype(str))
+        self._positions = None
+
+    @property
+    def codes(self) -> np.ndarray:
+        """Code of each region: the 5-digits FIPS if available, otherwise the
+        UID."""
+        return self._codes
+
+    @property
+    def dates(self) -> np.ndarray:
+        """Days (np.datetime64) of the columns of the panel."""
+        return self._dates
+
+    @property
+    def meta(self) -> pd.DataFrame:
+        """Metadata of the regions, one row per region."""
+        return self._meta
+
+    @property
+    def names(self) -> np.ndarray:
+        """Name of each region."""
+        return self._names
+
+    @property
+    def values(self) -> np.ndarray:
+        """Cumulative number of cases, one row per region."""
+        return self._values
+
+    def index(self, code: Union[str, int]) -> int:
+        """Position of the region with the given code.
+
+        Raises:
+            KeyError: if no region has the given code.
+        """
+        if self._positions is None:
+            self._positions = {c: i for i, c in enumerate(self._codes)}
+        code = str(code)
+        if code not in self._positions and code.isdigit():
+            code = code.zfill(5)
+        return self._positions[code]
+
+    def region(self, code: Union[str, int]) -> AbstractRegionData:
+        """RegionData of the region with the given code. See `index`."""
+        return self[self.index(code)]
+
+    def __getitem__(self, i: int) -> AbstractRegionData:
+        return self._region_class(self._names[i], self._codes[i], self._dates,
+                                  self._values[i])
+
+    def __iter__(self) -> Iterator[AbstractRegionData]:
+        return iter(self.regions())
+
+    def regions(self) -> List[AbstractRegionData]:
+        """RegionData of all the regions, built in a single batch. See
+        `AbstractRegionData.from_arrays`."""
+        return self._region_class.from_arrays(self._names, self._codes,
+                                              self._dates, self._values)
+
+    def aggregation_matrix(self, levels: Iterable[str] = LEVELS,
+                           groups: Dict[str, Iterable[Union[str, int]]] = None
+                           ) -> Tuple[sparse.csr_matrix, np.ndarray,
+                                      np.ndarray]:
+        """Sparse matrix that sums the regions of the panel into groups.
+
+        Args:
+            levels: iterable of str
+                Predefined groupings: 'state' sums the regions of each state
+                (by the Province_State column, hence including e.g. the
+                'Unassigned' rows), 'national' sums all the regions.
+            groups: dict
+                Custom groupings, e.g. metro areas, mapping the name of each
+                group to the codes of its regions.
+        Return:
+            Tuple with the (groups x regions) matrix of ones and zeros and
+            the codes and names of the groups, in the order of the rows: the
+            states (e.g. 'NY') sorted by code, 'US', then the custom groups,
+            whose code is their name.
+        Raises:
+            ValueError: if a level is unknown or a group has an unknown code.
+        """
+        levels = list(levels)
+        unknown = set(levels) - set(LEVELS)
+        if unknown:
+            raise ValueError(f'Unknown levels {sorted(unknown)}. See '
+                             f'opendemic.data.panel.LEVELS.')
+        rows, cols, codes, names = [], [], [], []
+
+        if 'state' in levels:
+            states = self._meta['Province_State'].astype(str).str.lower()
+            states = states.map(_STATE_CODES).to_numpy()
+            # e.g. the cruise ships are not part of any state
+            known = np.flatnonzero(pd.notna(states))
+            state_codes = sorted(set(states[known]))
+            position = {code: i for i, code in enumerate(state_codes)}
+            rows.append(np.array([position[s] for s in states[known]],
+                                 dtype=np.int64))
+            cols.append(known)
+            codes += state_codes
+            names += [_CODE2NAME[s] for s in state_codes]
+
+        if 'national' in levels:
+            rows.append(np.full(len(self), len(codes), dtype=np.int64))
+            cols.append(np.arange(len(self)))
+            codes.append('US')
+            names.append(_CODE2NAME['US'])
+
+        for name, members in (groups or {}).items():
+            try:
+                members = sorted({self.index(c) for c in members})
+            except KeyError as e:
+                raise ValueError(f'Unknown code {e} in group {name}.') \
+                    from None
+            rows.append(np.full(len(members), len(codes), dtype=np.int64))
+            cols.append(np.asarray(members, dtype=np.int64))
+            codes.append(str(name))
+            names.append(str(name))
+
+        rows = np.concatenate(rows) if rows else np.empty(0, np.int64)
+        cols = np.concatenate(cols) if cols else np.empty(0, np.int64)
+        matrix = sparse.csr_matrix(
+            (np.ones(rows.size, dtype=np.float32), (rows, cols)),
+            shape=(len(codes), len(self)))
+        return matrix, np.asarray(codes), np.asarray(names)
+
+    @timed('data.aggregate_panel')
+    def aggregate(self, levels: Iterable[str] = LEVELS,
+                  groups: Dict[str, Iterable[Union[str, int]]] = None
+                  ) -> Dict[str, AbstractRegionData]:
+        """Series of states, of the whole country and of custom groups of
+        regions, summed from the regions of the panel with a single sparse
+        product, i.e. without downloading other sources.
+
+            >>> panel = RegionPanel.load_jhu('data/time_series_cases.csv')
+            >>> levels = panel.aggregate(groups={'NYC': nyc_fips})
+            >>> compute_rt_many(levels.values())
+
+        Args:
+            levels, groups:
+                See `aggregation_matrix`.
+        Return:
+            dict mapping the code of each group to its RegionData, built in
+            a single batch. Values missing in a region make its groups
+            missing at the same dates.
+        """
+        matrix, codes, names = self.aggregation_matrix(levels, groups)
+        cases = matrix @ np.asarray(self._values)
+        regions = self._region_class.from_arrays(names, codes, self._dates,
+                                                 cases)
+        return dict(zip(codes.tolist(), regions))
+
+    def __len__(self) -> int:
+        return self._values.shape[0]
+
+    def __repr__(self) -> str:
+        return (f'RegionPanel: {len(self)} regions, {len(self._dates)} dates '
+                f'from {self._dates[0]} to {self._dates[-1]}.')
+
+    @classmethod
+    @timed('data.parse_jhu')
+    def from_jhu_csv(cls, path: str, population: str = None, **kwargs
+                     ) -> 'RegionPanel':
+        """Read a JHU CSSE time series in wide format, e.g.
+        data/time_series_cases.csv.
+
+        Args:
+            path: str
+                Path or URL of the csv.
+            population: str
+                Path or URL of a JHU csv with the 'Population' column (e.g.
+                data/time_series_deaths.csv), used when `path` does not
+                have it. Rows are matched by UID.
+            **kwargs:
+                Passed to the constructor.
+        Return:
+            RegionPanel instance.
+        """
+        df = pd.read_csv(path)
+        datecols = [c for c in df.columns if _is_jhu_date(c)]
+        if 'Population' not in df.columns:
+            if population is not None:
+                pop = pd.read_csv(population, usecols=['UID', 'Population'])
+                df = df.merge(pop, on='UID', how='left')
+            else:
+                df['Population'] = np.nan
+        meta = df[META_COLUMNS].copy()
+        values = np.ascontiguousarray(df[datecols].to_numpy(np.float32))
+        dates = pd.to_datetime(datecols, format='%m/%d/%y').to_numpy()
+        return cls(meta, dates, values, **kwargs)
+
+    def to_memmap(self, directory: str):
+        """Save the panel in `directory`, to be opened with `open`."""
+        os.makedirs(directory, exist_ok=True)
+        np.save(os.path.join(directory, _VALUES), self._values)
+        np.save(os.path.join(directory, _DATES), self._dates)
+        self._meta.to_csv(os.path.join(directory, _META), index=False)
+
+    @classmethod
+    def open(cls, directory: str, **kwargs) -> 'RegionPanel':
+        """Open a panel saved with `to_memmap`. The values are memory-mapped
+        read-only, hence they are read from disk only when accessed.
+
+        Args:
+            directory: str
+                Directory passed to `to_memmap`.
+            **kwargs:
+                Passed to the constructor.
+        Return:
+            RegionPanel instance.
+        """
+        values = np.load(os.path.join(directory, _VALUES), mmap_mode='r')
+        dates = np.load(os.path.join(directory, _DATES))
+        meta = pd.read_csv(os.path.join(directory, _META))
+        return cls(meta, dates, values, **kwargs)
+
+    @classmethod
+    def load_jhu(cls, path: str, directory: str = None, **kwargs
+                 ) -> 'RegionPanel':
+        """Open the memory-mapped version of a JHU csv, converting it first if
+        it does not exist or if it is older than the csv.
+
+        Args:
+            path: str
+                Path of the csv.
+            directory: str
+                Directory of the memory-mapped version. Default: `path`
+                without extension, followed by '.panel'.
+            **kwargs:
+                Passed to `from_jhu_csv`.
+        Return:
+            RegionPanel instance.
+        """
+        if directory is None:
+            directory = os.path.splitext(path)[0] + '.panel'
+        values = os.path.join(directory, _VALUES)
+        if not os.path.isfile(values) or \
+                os.path.getmtime(values) < os.path.getmtime(path):
+            cls.from_jhu_csv(path, **kwargs).to_memmap(directory)
+        region_class = kwargs.get('region_class', USARegionData)
+        return cls.open(directory, region_class=region_class)
+
+
+def _is_jhu_date(column: str) -> bool:
+    try:
+        datetime.strptime(column, '%m/%d/%y')
+    except ValueError:
+        return False
+    return True
@@ -1,11 +1,25 @@
+from __future__ import annotations
+
 from datetime import date
-from datetime import datetime
-from typing import Tuple, Union
+from typing import Callable, Dict, Iterable, Tuple, Union
 
 import numpy as np
-import pandas as pd
 
+from .._lazy import lazy_import
+from . import download
 from .core import AbstractRegionData
+from .core import aggregate_by_date
+from .core import region_series
+from .fips import fips2name
+from .fips import fips2names
+from .fips import fips_is_known
+
+pd = lazy_import('pandas')
+
+COVID_TRACKING_PROJECT_URL = 'https://covidtracking.com/api/v1/states/' \
+                             'daily.json'
+NYT_URL = 'https://raw.githubusercontent.com/nytimes/covid-19-data/master/' \
+          'us-counties.csv'
 
 _CODE2NAME = {
     'US': 'United States of America',
@@ -69,13 +83,26 @@ _CODE2NAME = {
 REGIONS = list(_CODE2NAME.keys())
 
 
-def fips2name(fips: Union[str, int, float]) -> str:
-    # TODO: we've got to upload this csv to our server in order to make sure it
-    #       does not magically disappear
-    df_fips = pd.read_csv('https://raw.githubusercontent.com/kjhealy/'
-                          'fips-codes/master/state_and_county_fips_master.csv')
-    myfips = df_fips[df_fips['fips'] == int(fips)]
-    return f"{myfips['name'].values[0]}, {myfips['state'].values[0]}"
+def sources() -> Dict[str, Callable[..., pd.DataFrame]]:
+    """Sources of the USA data and their parsers, see
+    `opendemic.data.download.read_all`."""
+    return {COVID_TRACKING_PROJECT_URL: pd.read_json, NYT_URL: pd.read_csv}
+
+
+def _check_state(state: str) -> str:
+    if state.upper() not in _CODE2NAME.keys():
+        raise ValueError(f"'{state}' is not an available region. See "
+                         f"opendemic.data.usa.REGIONS for a list of allowed "
+                         f"regions.")
+    return state.upper()
+
+
+def _aggregate_covid_tracking_project(df: pd.DataFrame) -> pd.DataFrame:
+    # one column per state, plus the whole USA
+    table = aggregate_by_date(df, 'date', 'positive', 'state', '%Y%m%d')
+    us = aggregate_by_date(df, 'date', 'positive', date_format='%Y%m%d')
+    table['US'] = us['positive']
+    return table
 
 
 def fetch_covid_tracking_project(state: str = 'US') -> Tuple[str, str,
@@ -92,40 +119,33 @@ def fetch_covid_tracking_project(state: str = 'US') -> Tuple[str, str,
         Tuple with the 4 elements that are necessary to instantiate RegionData
         in the right order.
     """
-    if state.upper() not in _CODE2NAME.keys():
-        raise ValueError(f"'{state}' is not an available region. See "
-                         f"opendemic.data.usa.REGIONS for a list of allowed "
-                         f"regions.")
+    state = _check_state(state)
 
-    df = pd.read_json('https://covidtracking.com/api/v1/states/daily.json')
-
-    state = state.upper()
+    df = download.read(COVID_TRACKING_PROJECT_URL, pd.read_json)
     if state != 'US':
         df = df[df['state'] == state]
 
-    dates = np.unique(df['date'].to_numpy())  # ensures chronological order
+    # accounts for multiple reports in the same day
+    table = aggregate_by_date(df, 'date', 'positive', date_format='%Y%m%d')
+    dates, cases = region_series(table, 'positive')
 
-    cases = np.zeros(len(dates))
-    for k, d in enumerate(dates):
-        # aggregate the data of each date
-        c = df[df['date'] == d]['positive'].to_numpy()
-        c[np.isnan(c)] = 0
-        cases[k] = np.sum(c)  # accounts for multiple reports in the same day
+    return _CODE2NAME.get(state), state, dates, cases
 
-    code = state
-    name = _CODE2NAME.get(code)
 
-    # convert dates to python standard format
-    dates = np.asarray([datetime.strptime(str(d), '%Y%m%d') for d in dates])
+def _aggregate_nyt(df: pd.DataFrame) -> pd.DataFrame:
+    table = aggregate_by_date(df, 'date', 'cases', 'fips', '%Y-%m-%d')
 
-    return name, code, dates, cases
+    # The NYT updates the database many times during a day. We want to rely
+    # only on complete daily data, therefore we discard any data uploaded in the
+    # same day of the query.
+    table = table[table.index.date != date.today()]
+    table.columns = table.columns.astype(int)
+    return table
 
 
 def fetch_nyt(fips: Union[int, float, str]) -> Tuple[str, str, np.ndarray,
                                                      np.ndarray]:
-    df = pd.read_csv(
-        'https://raw.githubusercontent.com/nytimes/covid-19-data/master/'
-        'us-counties.csv')
+    df = download.read(NYT_URL, pd.read_csv)
 
     fipscast = int(fips)
     fips_mask = df['fips'] == fipscast
@@ -133,26 +153,8 @@ def fetch_nyt(fips: Union[int, float, str]) -> Tuple[str, str, np.ndarray,
         raise ValueError(f'No data available for county fips {fipscast}.')
 
     # select only data for the county
-    df = df[fips_mask]
-
-    dates = np.unique(df['date'])  # ensures chronological order
-
-    cases = np.zeros(len(dates))
-    for k, d in enumerate(dates):
-        # aggregate the data of each date
-        c = df[df['date'] == d]['cases'].to_numpy()
-        c[np.isnan(c)] = 0
-        cases[k] = np.sum(c)  # accounts for multiple reports in the same day
-
-    # The NYT updates the database many times during a day. We want to rely
-    # only on complete daily data, therefore we discard any data uploaded in the
-    # same day of the query.
-    n_today = np.count_nonzero(dates == date.today())
-
-    dates = dates[: dates.size - n_today]
-    cases = cases[: cases.size - n_today]
-
-    dates = np.asarray([datetime.strptime(str(d), '%Y-%m-%d') for d in dates])
+    table = _aggregate_nyt(df[fips_mask])
+    dates, cases = region_series(table, fipscast)
 
     name = fips2name(fips)
 
@@ -160,6 +162,8 @@ def fetch_nyt(fips: Union[int, float, str]) -> Tuple[str, str, np.ndarray,
 
 
 class RegionData(AbstractRegionData):
+    __slots__ = ()
+
     @classmethod
     def fetch(cls, state: str = 'US', county: Union[str, int, float] = None):
         """Fetch data from Covid Tracking Project
@@ -182,3 +186,89 @@ class RegionData(AbstractRegionData):
             return cls(*fetch_nyt(county))
         else:
             return cls(*fetch_covid_tracking_project(state))
+
+    @classmethod
+    def fetch_many(cls, states: Iterable[str] = None,
+                   counties: Iterable[Union[str, int, float]] = None,
+                   errors: str = 'raise',
+                   frames: Dict[str, pd.DataFrame] = None,
+                   **kwargs) -> Dict[str, 'RegionData']:
+        """Fetch data of many regions at once.
+
+        Each source is downloaded once and aggregated for all the regions
+        with a single groupby. States are fetched from the Covid Tracking
+        Project, counties from the NYT database, as in `RegionData.fetch`.
+        The sources are downloaded concurrently.
+
+        Args:
+            states: iterable of str
+                State codes (e.g. `NY` or `AK`, `US` for the whole USA). If
+                both `states` and `counties` are None, all the states in
+                `opendemic.data.usa.REGIONS` are fetched.
+            counties: iterable of str or int or float
+                County fips codes (e.g. 01001).
+            errors: str
+                Either 'raise' or 'ignore'. If 'ignore', regions that are not
+                available or have no data are left out of the result instead
+                of raising. Default: 'raise'.
+            frames: dict
+                Sources already read, keyed by URL, e.g. by
+                `opendemic.data.download.read_all(sources())`. The missing
+                ones are read through the cache.
+            **kwargs:
+                Passed to `opendemic.data.download.fetch_all`, e.g.
+                `max_workers` or `timeout`.
+        Return:
+            dict mapping the code of each region (e.g. 'NY' or '01001') to its
+            opendemic.data.usa.RegionData instantiated object.
+        Raises:
+            ValueError: if a state is not available or if there are no data
+                for a county, unless `errors` is 'ignore'.
+        """
+        if errors not in ('raise', 'ignore'):
+            raise ValueError("`errors` must be either 'raise' or 'ignore'.")
+        strict = errors == 'raise'
+        if states is None and counties is None:
+            states = REGIONS
+        if states is not None:
+            states = [s.upper() for s in states]
+            if strict:
+                for s in states:
+                    _check_state(s)
+
+        readers = sources()
+        urls = [url for url, selected in
+                [(COVID_TRACKING_PROJECT_URL, states is not None),
+                 (NYT_URL, counties is not None)] if selected]
+        frames = dict(frames or {})
+        frames.update(download.read_all(
+            {url: readers[url] for url in urls if url not in frames},
+            **kwargs))
+        regions = {}
+
+        if states is not None:
+            table = _aggregate_covid_tracking_project(
+                frames[COVID_TRACKING_PROJECT_URL])
+            for s in states:
+                if s not in table.columns or s not in _CODE2NAME:
+                    if strict:
+                        raise ValueError(f'No data available for state {s}.')
+                    continue
+                regions[s] = cls(_CODE2NAME.get(s), s,
+                                 *region_series(table, s))
+
+        if counties is not None:
+            counties = [int(c) for c in counties]
+            table = _aggregate_nyt(frames[NYT_URL])
+            missing = [c for c in counties if c not in table.columns or
+                       not fips_is_known(c)]
+            if missing and strict:
+                raise ValueError(f'No data available for county fips '
+                                 f'{missing}.')
+            missing = set(missing)
+            counties = [c for c in counties if c not in missing]
+            for c, name in zip(counties, fips2names(counties)):
+                code = str(c).zfill(5)
+                regions[code] = cls(name, code, *region_series(table, c))
+
+        return regions
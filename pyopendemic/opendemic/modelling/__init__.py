@@ -1,12 +1,31 @@
 import logging as _logging
+from os import cpu_count as _cpu_count
+from typing import Callable as _Callable
 from typing import Iterable as _Iterable
 from typing import Tuple as _Tuple
+from typing import Union as _Union
 
 import numpy as _np
 from opendemic.data.core import AbstractRegionData as _RegionData
+from opendemic.modelling._pool import imap_regions as _imap_regions
+from opendemic.modelling._pool import map_regions as _map_regions
+from opendemic.modelling.cube import PosteriorCube
+from opendemic.modelling.cube import write_posterior_cube
+from opendemic.modelling.incremental import IncrementalRt
+from opendemic.modelling.store import RtStore
+from opendemic.modelling.streaming import SystromFilter
+from opendemic.modelling.systrom import adaptive_grid
+from opendemic.modelling.systrom import get_batch_summaries
+from opendemic.modelling.systrom import get_likelihood
+from opendemic.modelling.systrom import get_llhood
 from opendemic.modelling.systrom import get_posteriors
+from opendemic.modelling.systrom import get_posteriors_adaptive
+from opendemic.modelling.systrom import get_summaries
 from opendemic.modelling.systrom import high_density_interval
+from opendemic.modelling.systrom import high_density_intervals
 from opendemic.modelling.systrom import RT_RANGE
+from opendemic.modelling.systrom import RtGrid
+from opendemic.profiling import timed as _timed
 
 
 def compute_rt(new_cases: _np.ndarray, kwargsmodel: dict = dict(),
@@ -16,11 +35,16 @@ def compute_rt(new_cases: _np.ndarray, kwargsmodel: dict = dict(),
     """
     Compute the time series of Rt with the corresponding credible interval.
 
+    The full posteriors are never stored, see
+    `opendemic.modelling.systrom.get_summaries`.
+
     Args:
         new_cases: 1d np.ndarray
             Time series of the number of new cases for each day.
         kwargsmodel: dict
-            **kwargs to pass to the employed model.
+            **kwargs to pass to the employed model. If 'grid' is 'adaptive',
+            the model is run on a grid restricted to where the posterior has
+            mass, see `opendemic.modelling.systrom.adaptive_grid`.
         kwargshdi: dict
             **kwargs to pass to the function that computes the high density
             interval.
@@ -30,26 +54,141 @@ def compute_rt(new_cases: _np.ndarray, kwargsmodel: dict = dict(),
         - time series of lower boundary of high intensity interval;
         - time series of higher boundary of high intensity interval.
     """
-    post, _ = get_posteriors(new_cases, **kwargsmodel)
-    rt = _np.asarray([RT_RANGE[i] for i in _np.argmax(post, axis=1)])
-    low = _np.zeros(post.shape[0])
-    high = _np.zeros_like(low)
-    for i, pmf in enumerate(post):
-        hdi = high_density_interval(pmf, **kwargshdi)
-        low[i] = hdi[0]
-        high[i] = hdi[1]
-    return rt, low, high
+    kwargsmodel = dict(kwargsmodel)
+    if kwargsmodel.get('grid') == 'adaptive':
+        kwargsmodel.pop('grid')
+        kwargsmodel['grid'] = adaptive_grid(new_cases, **kwargsmodel)
+    summaries, _ = get_summaries(new_cases, **kwargsmodel, **kwargshdi)
+    return summaries['rt'], summaries['low'], summaries['high']
+
+
+def compute_rt_batch(new_cases: _np.ndarray, kwargsmodel: dict = dict(),
+                     kwargshdi: dict = dict(), mask: _np.ndarray = None
+                     ) -> _Tuple[_np.ndarray, _np.ndarray, _np.ndarray,
+                                 _np.ndarray]:
+    """
+    Compute the time series of Rt with the corresponding credible interval for
+    many regions at once.
+
+    Args:
+        new_cases: 2d np.ndarray
+            Number of new cases with one row per region and one column per
+            day. NaN entries are treated as missing.
+        kwargsmodel: dict
+            **kwargs to pass to the employed model.
+        kwargshdi: dict
+            **kwargs to pass to the function that computes the high density
+            interval.
+        mask: 2d np.ndarray
+            Boolean array, False where data are missing. The valid days of
+            each region must be contiguous. See
+            `opendemic.modelling.systrom.get_batch_summaries`.
+    Returns:
+        Tuple with 3 two-dimensional np.ndarray-s (NaN where data are missing)
+        and 1 one-dimensional np.ndarray:
+        - time series of Rt;
+        - time series of lower boundary of high intensity interval;
+        - time series of higher boundary of high intensity interval;
+        - log-likelihood of each region.
+    """
+    return get_batch_summaries(new_cases, mask=mask, **kwargsmodel,
+                               **kwargshdi)
+
+
+def _region_llhoods(args: _Tuple[_np.ndarray, _np.ndarray, str, str]
+                    ) -> _np.ndarray:
+    # Log-likelihood of one region for each sigma. The likelihood matrix does
+    # not depend on sigma, hence it is computed only once.
+    new_cases, sigmas, engine, likelihood = args
+    lik = get_likelihood(new_cases, likelihood)
+    return _np.asarray([get_llhood(lik, s, engine) for s in sigmas])
+
+
+def _region_rt(args: _Tuple[_np.ndarray, dict, dict]):
+    # errors are returned instead of raised, so that a region does not stop
+    # the others
+    new_cases, kwargsmodel, kwargshdi = args
+    try:
+        return compute_rt(new_cases, kwargsmodel, kwargshdi), None
+    except Exception as e:
+        return None, f'{type(e).__name__}: {e}'
 
 
+@_timed('modelling.compute_rt_many')
+def compute_rt_many(regions: _Iterable[_RegionData],
+                    kwargsmodel: dict = dict(), kwargshdi: dict = dict(),
+                    processes: int = None,
+                    callback: _Callable[[int, int, _RegionData, str],
+                                        None] = None
+                    ) -> _Tuple[dict, dict]:
+    """
+    Compute the time series of Rt of many regions with `compute_rt`, spreading
+    the regions across a pool of processes.
+
+    A region that fails does not stop the others: its error is returned
+    instead.
+
+    Args:
+        regions: iterable of RegionData objects
+            Regions to process. Their codes must be unique.
+        kwargsmodel: dict
+            **kwargs to pass to the employed model.
+        kwargshdi: dict
+            **kwargs to pass to the function that computes the high density
+            interval.
+        processes: int
+            Number of worker processes. If 1, everything runs in the calling
+            process. If None, the number of CPUs is used.
+        callback: callable
+            Called after each region as `callback(done, total, region,
+            error)`, with `error` None on success, e.g. to report progress.
+    Returns:
+        Tuple with 2 dictionaries keyed by the code of the regions:
+        - the (rt, low, high) tuples of `compute_rt` of the successful
+          regions;
+        - the error messages of the failed regions.
+    """
+    regions = list(regions)
+    tasks = [(r.new_cases, kwargsmodel, kwargshdi) for r in regions]
+    chunksize = max(1, len(tasks) // (4 * (processes or _cpu_count() or 1)))
+    results, errors = {}, {}
+    for i, (region, (rt, error)) in enumerate(zip(
+            regions, _imap_regions(_region_rt, tasks, processes, chunksize))):
+        if error is None:
+            results[region.code] = rt
+        else:
+            _logging.warning(f'{region.name}\t{error}')
+            errors[region.code] = error
+        if callback is not None:
+            callback(i + 1, len(regions), region, error)
+    return results, errors
+
+
+@_timed('modelling.sigma_update')
 def sigma_update(regions: _Iterable[_RegionData],
-                 sigmagrid: _Iterable[float] = None) -> float:
+                 sigmagrid: _Iterable[float] = None, processes: int = None,
+                 refine: int = 0, refine_points: int = 4,
+                 engine: str = 'banded', likelihood: str = 'pmf',
+                 full_output: bool = False) -> _Union[float,
+                                                      _Tuple[float, dict]]:
     """
     Compute the value of `sigma` that maximizes the likelihood of the Systrom
     model. See documentation of `opendemic.modelling.systrom.get_posteriors`
     for details.
 
-    The returned value will be the one showing maximal likelihood among the ones
-    in `sigmagrid`.
+    The total log-likelihood is the sum of the log-likelihoods of all the
+    regions. Regions are spread across a pool of processes, and each of them
+    computes the likelihood matrix of a region once and reuses it for all the
+    tested values of sigma.
+
+    Without refinement, the returned value will be the one showing maximal
+    likelihood among the ones in `sigmagrid`. Each refinement round tests
+    `refine_points` equally spaced values strictly between the neighbours of
+    the current optimum among the values tested so far, hence the search
+    never leaves the range of `sigmagrid`.
+
+    Regions whose log-likelihood is NaN (e.g. series with a zero followed by
+    a non-zero count) are ignored in the total.
 
     Args:
         regions: iterable of RegionData objects
@@ -58,18 +197,73 @@ def sigma_update(regions: _Iterable[_RegionData],
         sigmagrid: iterable of floats
             Grid of values of sigma that will be tested.
             Default: linspace(0.05, 1, 20)
+        processes: int
+            Number of worker processes. If 1, everything runs in the calling
+            process. If None, the number of CPUs is used.
+        refine: int
+            Number of refinement rounds after the grid search. Default: 0.
+        refine_points: int
+            Number of values of sigma tested in each refinement round.
+        engine: str
+            Implementation of the gaussian update of the prior. See
+            `opendemic.modelling.systrom.get_posteriors`.
+        likelihood: str
+            Either 'pmf' or 'log'. See
+            `opendemic.modelling.systrom.get_posteriors`.
+        full_output: bool
+            If True, return also a dictionary with the details of the search.
     Returns:
-        float whose value is the optimal sigma.
+        float whose value is the optimal sigma. If `full_output` is True, a
+        tuple with the optimal sigma and a dictionary with:
+        - 'sigmas': 1d np.ndarray with all the tested values of sigma, sorted;
+        - 'llhoods': 2d np.ndarray with the log-likelihood of each region
+          (rows) for each tested sigma (columns);
+        - 'total': 1d np.ndarray with the total log-likelihood for each tested
+          sigma;
+        - 'names': list with the names of the regions.
+    Raises:
+        ValueError: if `regions` is empty.
     """
     if sigmagrid is None:
         sigmagrid = _np.linspace(.05, 1, 20)
+    regions = list(regions)
+    if not regions:
+        raise ValueError('At least one region is required.')
+    names = [r.name for r in regions]
+
+    sigmas = _np.empty(0)
+    llhoods = _np.empty((len(regions), 0))
+    tosample = _np.unique(_np.asarray(sigmagrid, dtype=float))
+    for i in range(refine + 1):
+        tasks = [(r.new_cases, tosample, engine, likelihood) for r in regions]
+        new = _map_regions(_region_llhoods, tasks, processes)
+        for name, ll in zip(names, new):
+            for s, v in zip(tosample, ll):
+                _logging.info(f'{name}\tsigma: {s} log-likelihood: {v}')
+
+        sigmas = _np.concatenate([sigmas, tosample])
+        llhoods = _np.hstack([llhoods, _np.vstack(new)])
+        order = _np.argsort(sigmas)
+        sigmas = sigmas[order]
+        llhoods = llhoods[:, order]
+        total = _np.nansum(llhoods, axis=0)
+
+        best = int(total.argmax())
+        if i == refine:
+            break
+        # bracket around the current optimum
+        low = sigmas[max(best - 1, 0)]
+        high = sigmas[min(best + 1, sigmas.size - 1)]
+        tosample = _np.linspace(low, high, refine_points + 2)[1:-1]
+        tosample = _np.setdiff1d(tosample, sigmas)
+        if tosample.size == 0:
+            break
 
-    total_llhoods = _np.zeros_like(sigmagrid)
-    for r in regions:
-        for i, s in enumerate(sigmagrid):  # TODO: can be parallelized
-            post, llhood = get_posteriors(r.new_cases)
-            _logging.info(f'{r.name}\tsigma: {s} log-likelihood: {llhood}')
-            total_llhoods[i] = llhood
-    opt = sigmagrid[total_llhoods.argmax()]
+    for name in _np.asarray(names)[_np.isnan(llhoods).any(axis=1)]:
+        _logging.warning(f'{name}\tNaN log-likelihood, ignored.')
+    opt = sigmas[best]
     _logging.info(f'Optimal sigma: {opt}')
+    if full_output:
+        return opt, {'sigmas': sigmas, 'llhoods': llhoods, 'total': total,
+                     'names': names}
     return opt
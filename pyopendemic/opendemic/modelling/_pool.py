@@ -0,0 +1,16 @@
+# Map a function over the tasks of many regions, spreading them across a
+# pool of processes.
+from concurrent.futures import ProcessPoolExecutor
+
+
+def imap_regions(func, tasks: list, processes: int, chunksize: int = 1):
+    # results in the order of the tasks, as soon as they are available
+    if processes == 1 or len(tasks) <= 1:
+        yield from map(func, tasks)
+        return
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        yield from pool.map(func, tasks, chunksize=chunksize)
+
+
+def map_regions(func, tasks: list, processes: int) -> list:
+    return list(imap_regions(func, tasks, processes))
@@ -0,0 +1,298 @@
+# On-disk (regions x days x Rt grid) cube of the posteriors of the Systrom
+# model, so that notebooks and dashboards can plot densities or compute
+# custom credible levels without running the model again.
+#
+# The cube is memory-mapped, hence reading a region or a day touches only the
+# corresponding pages of the file. Two layouts are available:
+# - 'dense': a float32 .npy array of shape (regions, days, grid). Days in
+#   which a region has no data are rows of zeros, which the file system
+#   usually stores as holes;
+# - 'band': for each region and day only the band of the grid where the
+#   posterior is above `tol` times its maximum is stored, in a flat float32
+#   file, with an (offset, first, length) triplet per region and day. With
+#   the default grid the states take about half of the dense size, while the
+#   almost flat posteriors of the counties with few cases gain little.
+from __future__ import annotations
+
+import json
+import os
+from typing import Iterable, Tuple, Union
+
+import numpy as np
+
+from opendemic.data.core import AbstractRegionData
+from ._pool import imap_regions
+from .systrom import get_model
+from .systrom import get_posteriors
+from .systrom import high_density_intervals
+
+DENSE = 'dense'
+BAND = 'band'
+
+_META = 'meta.json'
+_INDEX = 'index.npz'
+_DENSE = 'posteriors.npy'
+_BAND_INDEX = 'band.npy'
+_BAND_VALUES = 'band.bin'
+
+
+def _region_posteriors(args: Tuple[np.ndarray, dict, dict]):
+    # posteriors in float32 and summaries of one region, or the error
+    new_cases, kwargsmodel, kwargshdi = args
+    try:
+        posteriors, _ = get_posteriors(new_cases, **kwargsmodel)
+        model = get_model(kwargsmodel.get('sigma', 0.25),
+                          kwargsmodel.get('engine', 'banded'),
+                          kwargsmodel.get('grid'))
+        rt_range = model.transition.rt_range
+        rt = rt_range[np.argmax(posteriors, axis=1)]
+        low, high = high_density_intervals(posteriors,
+                                           kwargshdi.get('p', 0.9), rt_range)
+        return ((rt, low, high), posteriors.astype(np.float32)), None
+    except Exception as e:
+        return None, f'{type(e).__name__}: {e}'
+
+
+def write_posterior_cube(directory: str,
+                         regions: Iterable[AbstractRegionData],
+                         kwargsmodel: dict = dict(), kwargshdi: dict = dict(),
+                         form: str = DENSE, tol: float = 1e-6,
+                         processes: int = 1) -> Tuple[dict, dict]:
+    """Run the model on many regions and write their posteriors to a cube.
+
+    The Rt summaries are computed from the same posteriors, hence the cube
+    costs no additional run of the model.
+
+    Args:
+        directory: str
+            Directory of the cube, created if missing. A cube already in it
+            is replaced.
+        regions: iterable of RegionData objects
+            Regions to process. Their codes must be unique.
+        kwargsmodel, kwargshdi: dict
+            See `opendemic.modelling.compute_rt`. The grid must be the same
+            for all the regions, hence 'adaptive' is not supported.
+        form: str
+            Either 'dense' or 'band'. See `opendemic.modelling.cube`.
+        tol: float
+            With 'band', relative threshold below which the tails of a
+            posterior are not stored.
+        processes: int
+            Number of worker processes, see
+            `opendemic.modelling.compute_rt_many`. Default: 1.
+    Return:
+        Tuple with 2 dictionaries keyed by the code of the regions, as
+        returned by `opendemic.modelling.compute_rt_many`: the (rt, low,
+        high) tuples of the successful regions and the error messages of
+        the failed ones. Failed regions are in the cube with no data.
+    Raises:
+        ValueError: if `form` is unknown or the grid is 'adaptive'.
+    """
+    if form not in (DENSE, BAND):
+        raise ValueError(f"`form` must be either '{DENSE}' or '{BAND}'.")
+    if isinstance(kwargsmodel.get('grid'), str):
+        raise ValueError('The posterior cube needs the same grid for all the '
+                         'regions.')
+    regions = list(regions)
+    model = get_model(kwargsmodel.get('sigma', 0.25),
+                      kwargsmodel.get('engine', 'banded'),
+                      kwargsmodel.get('grid'))
+    rt_range = model.transition.rt_range
+    dates = np.unique(np.concatenate(
+        [np.asarray(r.dates, dtype='datetime64[D]') for r in regions] or
+        [np.empty(0, 'datetime64[D]')]))
+    shape = (len(regions), dates.size, rt_range.size)
+
+    os.makedirs(directory, exist_ok=True)
+    meta_path = os.path.join(directory, _META)
+    if os.path.isfile(meta_path):
+        os.remove(meta_path)  # the cube is incomplete until the end
+    if form == DENSE:
+        cube = np.lib.format.open_memmap(os.path.join(directory, _DENSE),
+                                         mode='w+', dtype=np.float32,
+                                         shape=shape)
+    else:
+        band = np.zeros(shape[:2] + (3,), dtype=np.int64)
+        values = open(os.path.join(directory, _BAND_VALUES), 'wb')
+        offset = 0
+
+    tasks = [(r.new_cases, kwargsmodel, kwargshdi) for r in regions]
+    results, errors = {}, {}
+    try:
+        for i, (region, (out, error)) in enumerate(zip(
+                regions, imap_regions(_region_posteriors, tasks, processes))):
+            if error is not None:
+                errors[region.code] = error
+                continue
+            results[region.code], posteriors = out
+            days = np.searchsorted(
+                dates, np.asarray(region.dates, dtype='datetime64[D]'))
+            if form == DENSE:
+                cube[i, days] = posteriors
+                continue
+            for day, posterior in zip(days, posteriors):
+                above = np.flatnonzero(posterior > tol * posterior.max())
+                if above.size == 0 or not np.isfinite(posterior).all():
+                    # e.g. NaN-s after days without cases, kept as they are
+                    first, stop = 0, posterior.size
+                else:
+                    first, stop = above[0], above[-1] + 1
+                values.write(posterior[first:stop].tobytes())
+                band[i, day] = offset, first, stop - first
+                offset += stop - first
+    finally:
+        if form == DENSE:
+            cube.flush()
+            del cube
+        else:
+            values.close()
+    if form == BAND:
+        np.save(os.path.join(directory, _BAND_INDEX), band)
+
+    np.savez(os.path.join(directory, _INDEX),
+             codes=np.asarray([str(r.code) for r in regions]),
+             names=np.asarray([str(r.name) for r in regions]),
+             dates=dates, rt_range=rt_range)
+    meta = {'form': form, 'tol': tol,
+            'sigma': float(kwargsmodel.get('sigma', 0.25)),
+            'engine': str(kwargsmodel.get('engine', 'banded')),
+            'likelihood': kwargsmodel.get('likelihood', 'pmf')}
+    with open(meta_path, 'w') as f:
+        json.dump(meta, f)
+    return results, errors
+
+
+class PosteriorCube:
+    """Read-only view of a cube written by `write_posterior_cube`.
+
+        >>> cube = PosteriorCube('posteriors')
+        >>> dates, posteriors = cube.region('36103')
+        >>> cube.day('2020-04-15')  # (regions x grid) array
+    """
+
+    def __init__(self, directory: str):
+        """Open the cube in `directory`. Nothing but the index is read."""
+        with open(os.path.join(directory, _META)) as f:
+            self._meta = json.load(f)
+        with np.load(os.path.join(directory, _INDEX)) as index:
+            self._codes = index['codes']
+            self._names = index['names']
+            self._dates = index['dates']
+            self._rt_range = index['rt_range']
+        self._positions = {c: i for i, c in enumerate(self._codes.tolist())}
+        self._day_positions = {d: i for i, d in
+                               enumerate(self._dates.tolist())}
+        if self.form == DENSE:
+            self._cube = np.load(os.path.join(directory, _DENSE),
+                                 mmap_mode='r')
+        else:
+            self._band = np.load(os.path.join(directory, _BAND_INDEX),
+                                 mmap_mode='r')
+            path = os.path.join(directory, _BAND_VALUES)
+            self._values = np.memmap(path, dtype=np.float32, mode='r') \
+                if os.path.getsize(path) else np.empty(0, np.float32)
+
+    @property
+    def codes(self) -> np.ndarray:
+        """Codes of the regions, one per row of the cube."""
+        return self._codes
+
+    @property
+    def names(self) -> np.ndarray:
+        """Names of the regions."""
+        return self._names
+
+    @property
+    def dates(self) -> np.ndarray:
+        """Days (np.datetime64) of the cube, common to all the regions."""
+        return self._dates
+
+    @property
+    def rt_range(self) -> np.ndarray:
+        """Tested Rt-s, i.e. the last axis of the cube."""
+        return self._rt_range
+
+    @property
+    def form(self) -> str:
+        """Layout of the cube, 'dense' or 'band'."""
+        return self._meta['form']
+
+    @property
+    def meta(self) -> dict:
+        """Form and parameters of the model."""
+        return dict(self._meta)
+
+    @property
+    def shape(self) -> Tuple[int, int, int]:
+        """(regions, days, grid)"""
+        return self._codes.size, self._dates.size, self._rt_range.size
+
+    def __len__(self) -> int:
+        return self._codes.size
+
+    def __repr__(self) -> str:
+        return (f'PosteriorCube: {len(self)} regions, {self._dates.size} '
+                f'days, {self._rt_range.size} Rt-s ({self.form}).')
+
+    def index(self, code: Union[str, int]) -> int:
+        """Row of the region with the given code.
+
+        Raises:
+            KeyError: if no region has the given code.
+        """
+        return self._positions[str(code)]
+
+    def day_index(self, date) -> int:
+        """Position of a day, e.g. '2020-04-15' or a datetime.
+
+        Raises:
+            KeyError: if the day is not in the cube.
+        """
+        return self._day_positions[np.datetime64(date, 'D').item()]
+
+    def region(self, code: Union[str, int], start=None, end=None
+               ) -> Tuple[np.ndarray, np.ndarray]:
+        """Posteriors of a region on the days with data.
+
+        Args:
+            code: str
+                Code of the region.
+            start, end:
+                First and last day, included. If None, not limited.
+        Return:
+            Tuple with the days and the 2d array with one posterior per day.
+        """
+        i = self.index(code)
+        days = np.arange(self._dates.size)
+        if start is not None:
+            days = days[self._dates >= np.datetime64(start, 'D')]
+        if end is not None:
+            days = days[self._dates[days] <= np.datetime64(end, 'D')]
+        rows = self._rows(i, days)
+        has_data = rows.any(axis=1)
+        return self._dates[days[has_data]], rows[has_data]
+
+    def day(self, date) -> np.ndarray:
+        """Posteriors of all the regions on a day, one row per region. Rows
+        of regions with no data on that day are zeros."""
+        j = self.day_index(date)
+        if self.form == DENSE:
+            return np.array(self._cube[:, j])
+        out = np.zeros((len(self), self._rt_range.size), dtype=np.float32)
+        for i in range(len(self)):
+            self._decode(self._band[i, j], out[i])
+        return out
+
+    def _rows(self, i: int, days: np.ndarray) -> np.ndarray:
+        if self.form == DENSE:
+            return np.array(self._cube[i, days])
+        out = np.zeros((days.size, self._rt_range.size), dtype=np.float32)
+        band = np.asarray(self._band[i])
+        for k, j in enumerate(days):
+            self._decode(band[j], out[k])
+        return out
+
+    def _decode(self, entry: np.ndarray, out: np.ndarray):
+        offset, first, length = (int(v) for v in entry)
+        if length:
+            out[first:first + length] = self._values[offset:offset + length]
@@ -0,0 +1,286 @@
+# Incremental computation of Rt for a set of regions whose time series are
+# refreshed periodically, e.g. by a nightly job.
+#
+# The smoothing of the new cases (see `AbstractRegionData.new_cases`) changes
+# the last days of a series whenever a new day is appended, hence the filter
+# state is stored `lag` days before the end of the series, where the model
+# input is final. Later days are recomputed from that checkpoint.
+import hashlib
+import logging
+import os
+from typing import Callable, Dict, Iterable, Tuple, Union
+
+import numpy as np
+
+from opendemic.data.core import AbstractRegionData
+from opendemic.profiling import count
+from opendemic.profiling import timed
+from .streaming import SystromFilter
+from .systrom import _check_likelihood
+from .systrom import _CHUNK
+from .systrom import _iter_posteriors
+from .systrom import get_model
+from .systrom import high_density_intervals
+
+# Days between the end of a series and its checkpoint. The gaussian filter of
+# the new cases has a radius of 12 days, hence the days before the last 13
+# are not modified by appending a day.
+DEFAULT_LAG = 14
+
+NEW = 'new'
+UNCHANGED = 'unchanged'
+RESUMED = 'resumed'
+RECOMPUTED = 'recomputed'
+
+
+def input_hash(region: AbstractRegionData) -> str:
+    """Content hash of the dates and the cases of a region."""
+    h = hashlib.sha1()
+    h.update(np.asarray(region.dates).astype('datetime64[D]').tobytes())
+    h.update(np.asarray(region.cases, dtype=np.float32).tobytes())
+    return h.hexdigest()
+
+
+class IncrementalRt:
+    """Store of the Rt of many regions that recomputes only what changed.
+
+    For each region the directory holds the results of the last run, the
+    hash of its input, the model input (the smoothed new cases) and the state
+    of a `SystromFilter` at the checkpoint. When a region is updated:
+    - if its input hash did not change, the stored results are returned;
+    - if its new cases up to the checkpoint did not change, the filter is
+      resumed from the checkpoint and only the later days are recomputed;
+    - otherwise, e.g. the history was revised upstream or the parameters of
+      the model changed, the whole series is recomputed.
+
+        >>> job = IncrementalRt('rt-state')
+        >>> results, statuses, errors = job.update_many(regions)
+    """
+
+    def __init__(self, directory: str, sigma: float = 0.25,
+                 engine: str = 'banded', likelihood: str = 'pmf',
+                 p: float = 0.9, lag: int = DEFAULT_LAG):
+        """Initiate a store in `directory`, which is created if missing.
+
+        Args:
+            directory: str
+                Directory of the stored results and filter states.
+            sigma, engine, likelihood:
+                See `opendemic.modelling.systrom.get_posteriors`. Only engine
+                names are supported, since the filter state is saved.
+            p: float
+                Probability mass of the high density interval.
+            lag: int
+                Number of days between the end of a series and the day whose
+                filter state is stored.
+        """
+        if not isinstance(engine, str):
+            raise ValueError('Only engine names are supported.')
+        if lag < 0:
+            raise ValueError('`lag` must be non-negative.')
+        self._directory = directory
+        self._params = {'sigma': float(sigma), 'engine': engine,
+                        'likelihood': likelihood, 'p': float(p)}
+        self._lag = int(lag)
+        os.makedirs(directory, exist_ok=True)
+
+    @property
+    def directory(self) -> str:
+        """Directory of the store."""
+        return self._directory
+
+    def load(self, code: Union[str, int]) -> Union[Dict[str, np.ndarray],
+                                                   None]:
+        """Stored results of a region, None if the region is not stored.
+
+        Return:
+            dict with the arrays 'dates' (np.datetime64), 'rt', 'low' and
+            'high'.
+        """
+        state = self._load_state(code)
+        if state is None:
+            return None
+        return {k: state[k] for k in ('dates', 'rt', 'low', 'high')}
+
+    @timed('modelling.incremental')
+    def update(self, region: AbstractRegionData
+               ) -> Tuple[Tuple[np.ndarray, np.ndarray, np.ndarray], str]:
+        """Bring the results of a region up to date.
+
+        Args:
+            region: RegionData object
+                Current data of the region.
+        Return:
+            Tuple with the (rt, low, high) tuple, as returned by
+            `opendemic.modelling.compute_rt`, and the status of the region:
+            one of 'new', 'unchanged', 'resumed' or 'recomputed'.
+        """
+        digest = input_hash(region)
+        state = self._load_state(region.code)
+        if state is None:
+            status = NEW
+        elif str(state['hash']) == digest and self._same_params(state):
+            count(f'modelling.incremental.{UNCHANGED}')
+            return (state['rt'], state['low'], state['high']), UNCHANGED
+        elif self._can_resume(state, region):
+            status = RESUMED
+        else:
+            status = RECOMPUTED
+
+        out = None
+        if status == RESUMED:
+            out = self._resume(state, region)
+            if out is None:
+                status = RECOMPUTED
+        if out is None:
+            out = self._compute(region)
+        rt, low, high, checkpoint = out
+        self._save_state(region, digest, rt, low, high, checkpoint)
+        count(f'modelling.incremental.{status}')
+        logging.debug(f'{region.name}\t{status}')
+        return (rt, low, high), status
+
+    def update_many(self, regions: Iterable[AbstractRegionData],
+                    callback: Callable[[int, int, AbstractRegionData, str],
+                                       None] = None
+                    ) -> Tuple[dict, dict, dict]:
+        """Update many regions. A region that fails does not stop the
+        others.
+
+        Args:
+            regions: iterable of RegionData objects
+                Current data of the regions. Their codes must be unique.
+            callback: callable
+                Called after each region as `callback(done, total, region,
+                error)`, see `opendemic.modelling.compute_rt_many`.
+        Return:
+            Tuple with 3 dictionaries keyed by the code of the regions:
+            - the (rt, low, high) tuples of the successful regions;
+            - their statuses, see `update`;
+            - the error messages of the failed regions.
+        """
+        regions = list(regions)
+        results, statuses, errors = {}, {}, {}
+        for i, region in enumerate(regions):
+            error = None
+            try:
+                results[region.code], statuses[region.code] = \
+                    self.update(region)
+            except Exception as e:
+                error = f'{type(e).__name__}: {e}'
+                logging.warning(f'{region.name}\t{error}')
+                errors[region.code] = error
+            if callback is not None:
+                callback(i + 1, len(regions), region, error)
+        return results, statuses, errors
+
+    def _path(self, code: Union[str, int], suffix: str = '') -> str:
+        return os.path.join(self._directory, f'{code}{suffix}.npz')
+
+    def _load_state(self, code: Union[str, int]) -> Union[dict, None]:
+        path = self._path(code)
+        if not os.path.isfile(path):
+            return None
+        with np.load(path, allow_pickle=False) as state:
+            return dict(state)
+
+    def _same_params(self, state: dict) -> bool:
+        return all(state[k] == v for k, v in self._params.items())
+
+    def _can_resume(self, state: dict, region: AbstractRegionData) -> bool:
+        checkpoint = int(state['checkpoint'])
+        if not self._same_params(state) or checkpoint < 0 or \
+                region.npoints <= checkpoint + 1 or \
+                not os.path.isfile(self._path(region.code, '.filter')):
+            return False
+        # the model input up to the checkpoint must not be revised
+        stop = checkpoint + 1
+        dates = np.asarray(region.dates[:stop]).astype('datetime64[D]')
+        return np.array_equal(dates, state['dates'][:stop]) and \
+            np.array_equal(region.new_cases[:stop], state['new_cases'][:stop])
+
+    def _new_filter(self) -> SystromFilter:
+        return SystromFilter(**self._params)
+
+    def _compute(self, region: AbstractRegionData
+                 ) -> Tuple[np.ndarray, np.ndarray, np.ndarray, int]:
+        # a single pass of the filter gives both the summaries, a chunk of
+        # days at a time as in `get_summaries`, and the state at the
+        # checkpoint
+        new_cases = np.squeeze(region.new_cases)
+        if new_cases.ndim != 1:
+            raise ValueError('The time series must be a 1d array.')
+        checkpoint = region.npoints - 1 - self._lag
+        model = get_model(self._params['sigma'], self._params['engine'])
+        log = _check_likelihood(self._params['likelihood'])
+        rt_range = model.transition.rt_range
+        rt, low, high = (np.zeros(new_cases.size) for _ in range(3))
+
+        buffer = np.zeros((min(_CHUNK, new_cases.size), rt_range.size))
+        llhood = 0.0
+        for i, (posterior, posterior_den) in enumerate(
+                _iter_posteriors(new_cases, model, log)):
+            buffer[i % _CHUNK] = posterior
+            llhood += np.log(posterior_den, dtype=np.float64)
+            if i == checkpoint:
+                f = self._new_filter()._restore(posterior, new_cases[i],
+                                                llhood, i + 1)
+                self._save_filter(f, region.code)
+            if i % _CHUNK == _CHUNK - 1 or i == new_cases.size - 1:
+                start = i - i % _CHUNK
+                block = buffer[:i - start + 1]
+                rt[start:i + 1] = rt_range[np.argmax(block, axis=1)]
+                low[start:i + 1], high[start:i + 1] = high_density_intervals(
+                    block, self._params['p'], rt_range)
+        return rt, low, high, checkpoint
+
+    def _resume(self, state: dict, region: AbstractRegionData
+                ) -> Union[Tuple[np.ndarray, np.ndarray, np.ndarray, int],
+                           None]:
+        checkpoint = int(state['checkpoint'])
+        new_checkpoint = region.npoints - 1 - self._lag
+        f = SystromFilter.load(self._path(region.code, '.filter'))
+        if f.ndays != checkpoint + 1:
+            # e.g. a run interrupted after saving the filter
+            return None
+
+        posteriors = []
+        for t in range(checkpoint + 1, region.npoints):
+            f.update(region.new_cases[t])
+            posteriors.append(f.posterior)
+            if t == new_checkpoint:
+                self._save_filter(f, region.code)
+        checkpoint = max(checkpoint, new_checkpoint)
+
+        rt_range = get_model(self._params['sigma'],
+                             self._params['engine']).transition.rt_range
+        posteriors = np.vstack(posteriors)
+        low, high = high_density_intervals(posteriors, self._params['p'],
+                                           rt_range)
+        stop = int(state['checkpoint']) + 1
+        rt = np.concatenate([state['rt'][:stop],
+                             rt_range[np.argmax(posteriors, axis=1)]])
+        low = np.concatenate([state['low'][:stop], low])
+        high = np.concatenate([state['high'][:stop], high])
+        return rt, low, high, checkpoint
+
+    def _save_filter(self, f: SystromFilter, code: Union[str, int]):
+        path = self._path(code, '.filter')
+        tmp = f'{path}.{os.getpid()}.tmp'
+        with open(tmp, 'wb') as fobj:
+            f.save(fobj)
+        os.replace(tmp, path)
+
+    def _save_state(self, region: AbstractRegionData, digest: str,
+                    rt: np.ndarray, low: np.ndarray, high: np.ndarray,
+                    checkpoint: int):
+        path = self._path(region.code)
+        tmp = f'{path}.{os.getpid()}.tmp'
+        with open(tmp, 'wb') as fobj:
+            np.savez_compressed(
+                fobj, hash=digest, checkpoint=checkpoint,
+                dates=np.asarray(region.dates).astype('datetime64[D]'),
+                new_cases=region.new_cases, rt=rt, low=low, high=high,
+                **self._params)
+        # atomic, an interrupted run leaves the previous results
+        os.replace(tmp, path)
@@ -0,0 +1,281 @@
+# On-disk store of the Rt time series of many regions, e.g. the output of a
+# nightly `compute_rt_many` run.
+#
+# The results are partitioned by region and by month: each partition is an
+# uncompressed npz file with one array per column, at
+# `{directory}/{code}/{YYYY-MM}.npz`. A json index lists the partitions of
+# each region with their first and last day, hence a query opens only the
+# partitions that overlap the requested regions and dates.
+from __future__ import annotations
+
+import json
+import os
+from typing import Dict, Iterable, Tuple, Union
+
+import numpy as np
+
+from opendemic._lazy import lazy_import
+from opendemic.data.core import AbstractRegionData
+
+pd = lazy_import('pandas')
+
+COLUMNS = ('rt', 'low', 'high', 'cases', 'new_cases')
+
+_INDEX = 'index.json'
+_DTYPES = {'rt': np.float64, 'low': np.float64, 'high': np.float64,
+           'cases': np.float32, 'new_cases': np.float32}
+
+
+def _day(value) -> Union[np.datetime64, None]:
+    if value is None:
+        return None
+    return np.datetime64(value, 'D')
+
+
+def _atomic_write(path: str, write):
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open(tmp, 'wb') as f:
+        write(f)
+    os.replace(tmp, path)
+
+
+class RtStore:
+    """Partitioned store of the Rt of many regions with a region/date index.
+
+        >>> store = RtStore('rt-results')
+        >>> results, errors = compute_rt_many(regions)
+        >>> store.append_many(regions, results)
+        >>> store.read('36103', start='2020-04-01', end='2020-04-30')
+        >>> store.query(['36103', '01001'], start='2020-04-01')
+
+    Appending days that are already stored replaces them, hence a run can
+    append the whole recomputed series of a region. A single process is
+    expected to write at a time; readers always see complete partitions.
+    """
+
+    def __init__(self, directory: str):
+        """Open the store in `directory`, which is created if missing."""
+        self._directory = directory
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, _INDEX)
+        if os.path.isfile(path):
+            with open(path) as f:
+                self._index = json.load(f)['regions']
+        else:
+            self._index = {}
+
+    @property
+    def directory(self) -> str:
+        """Directory of the store."""
+        return self._directory
+
+    @property
+    def codes(self) -> list:
+        """Codes of the stored regions."""
+        return list(self._index)
+
+    def name(self, code: Union[str, int]) -> str:
+        """Name of a stored region."""
+        return self._entry(code)['name']
+
+    def date_range(self, code: Union[str, int]
+                   ) -> Tuple[np.datetime64, np.datetime64]:
+        """First and last stored day of a region."""
+        partitions = self._entry(code)['partitions']
+        months = sorted(partitions)
+        return (np.datetime64(partitions[months[0]][0]),
+                np.datetime64(partitions[months[-1]][1]))
+
+    def __contains__(self, code: Union[str, int]) -> bool:
+        return str(code) in self._index
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def __repr__(self) -> str:
+        return f'RtStore: {len(self)} regions in {self._directory}.'
+
+    def append(self, code: Union[str, int], dates: Iterable,
+               rt: np.ndarray, low: np.ndarray, high: np.ndarray,
+               cases: np.ndarray = None, new_cases: np.ndarray = None,
+               name: str = None):
+        """Store the Rt of a region.
+
+        Args:
+            code: str
+                Identification code of the region.
+            dates: array-like
+                Days of the values. Days already stored are replaced.
+            rt, low, high: np.ndarray
+                Output of `opendemic.modelling.compute_rt`.
+            cases, new_cases: np.ndarray
+                Input of the model, see `RegionData`. NaN if None.
+            name: str
+                Name of the region. If None, the stored name is kept, or the
+                code is used.
+        Raises:
+            ValueError: if the arrays do not have the length of `dates` or
+                the dates are not unique.
+        """
+        self._append(code, dates, rt, low, high, cases, new_cases, name)
+        self._flush()
+
+    def append_region(self, region: AbstractRegionData,
+                      rt: Tuple[np.ndarray, np.ndarray, np.ndarray]):
+        """Store the (rt, low, high) tuple computed for a RegionData."""
+        self.append(region.code, region.dates, *rt, cases=region.cases,
+                    new_cases=region.new_cases, name=region.name)
+
+    def append_many(self, regions: Iterable[AbstractRegionData],
+                    results: Dict[str, Tuple[np.ndarray, np.ndarray,
+                                             np.ndarray]]):
+        """Store the results of `compute_rt_many` (or of
+        `IncrementalRt.update_many`). Regions without results are skipped.
+        The index is written once at the end."""
+        for region in regions:
+            rt = results.get(region.code)
+            if rt is not None:
+                self._append(region.code, region.dates, *rt,
+                             cases=region.cases, new_cases=region.new_cases,
+                             name=region.name)
+        self._flush()
+
+    def read(self, code: Union[str, int], start=None, end=None,
+             columns: Iterable[str] = COLUMNS) -> Dict[str, np.ndarray]:
+        """Stored values of a region. Only the partitions that overlap the
+        requested days are read.
+
+        Args:
+            code: str
+                Identification code of the region.
+            start, end:
+                First and last day, included (e.g. '2020-04-01' or a
+                datetime). If None, the series is not limited.
+            columns: iterable of str
+                Columns to read, see `opendemic.modelling.store.COLUMNS`.
+        Return:
+            dict with the array 'date' (np.datetime64[D]) and one array per
+            column, sorted by date.
+        Raises:
+            KeyError: if the region is not stored.
+        """
+        columns = self._check_columns(columns)
+        start, end = _day(start), _day(end)
+        parts = []
+        for month in self._months(code, start, end):
+            with np.load(self._path(code, month)) as part:
+                parts.append({k: part[k] for k in ('date',) + columns})
+        if not parts:
+            return {k: np.empty(0, self._dtype(k))
+                    for k in ('date',) + columns}
+        out = {k: np.concatenate([p[k] for p in parts])
+               for k in ('date',) + columns}
+        mask = np.ones(out['date'].size, dtype=bool)
+        if start is not None:
+            mask &= out['date'] >= start
+        if end is not None:
+            mask &= out['date'] <= end
+        return {k: v[mask] for k, v in out.items()}
+
+    def query(self, codes: Iterable[Union[str, int]] = None, start=None,
+              end=None, columns: Iterable[str] = COLUMNS) -> pd.DataFrame:
+        """Stored values of many regions in long format.
+
+        Args:
+            codes: iterable of str
+                Codes of the regions. If None, all the stored regions.
+            start, end, columns:
+                See `read`.
+        Return:
+            pd.DataFrame with the columns 'date', 'code', 'name' and the
+            requested ones, one row per region and day.
+        Raises:
+            KeyError: if a region is not stored.
+        """
+        codes = self.codes if codes is None else [str(c) for c in codes]
+        columns = self._check_columns(columns)
+        frames = []
+        for code in codes:
+            values = self.read(code, start, end, columns)
+            frames.append(pd.DataFrame({
+                'date': values.pop('date'), 'code': code,
+                'name': self.name(code), **values}))
+        if not frames:
+            return pd.DataFrame(columns=['date', 'code', 'name', *columns])
+        return pd.concat(frames, ignore_index=True)
+
+    def _entry(self, code: Union[str, int]) -> dict:
+        try:
+            return self._index[str(code)]
+        except KeyError:
+            raise KeyError(f'Region {code} is not in the store.') from None
+
+    def _path(self, code: Union[str, int], month: str) -> str:
+        return os.path.join(self._directory, str(code), f'{month}.npz')
+
+    def _months(self, code: Union[str, int], start: np.datetime64,
+                end: np.datetime64) -> list:
+        # partitions that overlap [start, end]
+        partitions = self._entry(code)['partitions']
+        return [m for m in sorted(partitions)
+                if (start is None or np.datetime64(partitions[m][1]) >= start)
+                and (end is None or np.datetime64(partitions[m][0]) <= end)]
+
+    @staticmethod
+    def _dtype(column: str) -> np.dtype:
+        return np.dtype('datetime64[D]') if column == 'date' \
+            else np.dtype(_DTYPES[column])
+
+    @staticmethod
+    def _check_columns(columns: Iterable[str]) -> tuple:
+        columns = tuple(columns)
+        unknown = set(columns) - set(COLUMNS)
+        if unknown:
+            raise ValueError(f'Unknown columns {sorted(unknown)}. See '
+                             f'opendemic.modelling.store.COLUMNS.')
+        return columns
+
+    def _append(self, code, dates, rt, low, high, cases, new_cases, name):
+        code = str(code)
+        dates = np.asarray(dates, dtype='datetime64[D]')
+        n = dates.size
+        values = {'rt': rt, 'low': low, 'high': high, 'cases': cases,
+                  'new_cases': new_cases}
+        for k, v in values.items():
+            values[k] = np.full(n, np.nan, _DTYPES[k]) if v is None else \
+                np.asarray(v, dtype=_DTYPES[k])
+            if values[k].shape != (n,):
+                raise ValueError(f'`{k}` must have the length of `dates`.')
+        if np.unique(dates).size != n:
+            raise ValueError('Values of `dates` are not unique.')
+
+        entry = self._index.setdefault(code, {'name': code,
+                                              'partitions': {}})
+        if name is not None:
+            entry['name'] = str(name)
+        os.makedirs(os.path.join(self._directory, code), exist_ok=True)
+
+        months = dates.astype('datetime64[M]')
+        for month in np.unique(months):
+            rows = months == month
+            part = {'date': dates[rows],
+                    **{k: v[rows] for k, v in values.items()}}
+            key = str(month)
+            path = self._path(code, key)
+            if key in entry['partitions'] and os.path.isfile(path):
+                # the new values replace the stored ones of the same days
+                with np.load(path) as old:
+                    keep = ~np.isin(old['date'], part['date'])
+                    part = {k: np.concatenate([old[k][keep], v])
+                            for k, v in part.items()}
+            order = np.argsort(part['date'], kind='stable')
+            part = {k: v[order] for k, v in part.items()}
+            _atomic_write(path, lambda f: np.savez(f, **part))
+            entry['partitions'][key] = [str(part['date'][0]),
+                                        str(part['date'][-1]),
+                                        int(part['date'].size)]
+
+    def _flush(self):
+        content = json.dumps({'version': 1, 'regions': self._index})
+        _atomic_write(os.path.join(self._directory, _INDEX),
+                      lambda f: f.write(content.encode('utf-8')))
@@ -0,0 +1,189 @@
+from os import PathLike
+from typing import Iterable, Tuple, Union
+
+import numpy as np
+
+from .systrom import _check_likelihood
+from .systrom import _forward_step
+from .systrom import _normalized_likelihood
+from .systrom import get_model
+from .systrom import high_density_interval
+from .systrom import RtGrid
+
+
+class SystromFilter:
+    """Incremental version of the Systrom model.
+
+    The filter keeps only the posterior of the last day, hence adding a new
+    day costs one step of the forward filter instead of a run over the whole
+    history. Feeding the time series `ts` one day at a time yields the last
+    row of the posteriors and the log-likelihood returned by
+    `opendemic.modelling.systrom.get_posteriors(ts)`.
+
+    The state can be saved to disk and restored, e.g. by a daily job:
+
+        >>> f = SystromFilter.load('ny.npz')
+        >>> f.update(new_cases_today)
+        >>> f.save('ny.npz')
+    """
+
+    def __init__(self, sigma: float = 0.25, engine: str = 'banded',
+                 likelihood: str = 'pmf', p: float = 0.9,
+                 grid: RtGrid = None):
+        """Initiate a filter that did not see any data yet.
+
+        Args:
+            sigma: float
+                Scale parameter of the gaussian update of the prior
+                distribution.
+            engine: str
+                Implementation of the gaussian update of the prior. See
+                `opendemic.modelling.systrom.get_posteriors`.
+            likelihood: str
+                Either 'pmf' or 'log'. See
+                `opendemic.modelling.systrom.get_posteriors`.
+            p: float
+                Probability mass of the high density interval.
+            grid: RtGrid
+                Grid of tested Rt-s. Default:
+                `opendemic.modelling.systrom.DEFAULT_GRID`.
+        """
+        self._log = _check_likelihood(likelihood)
+        self._model = get_model(sigma, engine, grid)
+        self._sigma = float(sigma)
+        self._engine = engine
+        self._likelihood = likelihood
+        self._p = float(p)
+
+        self._posterior = None
+        self._last = None
+        self._llhood = 0.0
+        self._ndays = 0
+
+    @property
+    def hdi(self) -> Tuple[float, float]:
+        """High density interval of the current posterior."""
+        self._check_started()
+        return high_density_interval(self._posterior, self._p,
+                                     self._model.transition.rt_range)
+
+    @property
+    def last(self) -> float:
+        """Number of new cases of the last day."""
+        return self._last
+
+    @property
+    def llhood(self) -> float:
+        """Cumulative log-likelihood of the data seen so far."""
+        return self._llhood
+
+    @property
+    def ndays(self) -> int:
+        """Number of days seen so far."""
+        return self._ndays
+
+    @property
+    def posterior(self) -> np.ndarray:
+        """Posterior probability over the tested Rt-s at the last day."""
+        return self._posterior
+
+    @property
+    def rt(self) -> float:
+        """Maximum a posteriori Rt at the last day."""
+        self._check_started()
+        rt_range = self._model.transition.rt_range
+        return rt_range[np.argmax(self._posterior)]
+
+    @property
+    def grid(self) -> RtGrid:
+        """Grid of tested Rt-s."""
+        rt_range = self._model.transition.rt_range
+        return RtGrid(rt_range[0], rt_range[-1], rt_range.size)
+
+    @property
+    def sigma(self) -> float:
+        """Scale parameter of the gaussian update of the prior."""
+        return self._sigma
+
+    def update(self, new_cases: float) -> 'SystromFilter':
+        """Move the filter one day forward.
+
+        Args:
+            new_cases: float
+                Number of new cases of the new day.
+        Returns:
+            The filter itself.
+        """
+        new_cases = float(new_cases)
+        if self._posterior is None:
+            posterior = self._model.prior0.copy()
+        else:
+            likelihood = _normalized_likelihood(
+                self._last, new_cases, self._model.growth, log=self._log)
+            posterior, posterior_den = _forward_step(
+                self._posterior, likelihood, self._model.transition)
+            self._llhood += np.log(posterior_den)
+
+        self._posterior = posterior
+        self._last = new_cases
+        self._ndays += 1
+        return self
+
+    def update_many(self, new_cases: Iterable[float]) -> 'SystromFilter':
+        """Move the filter forward by one day per element of `new_cases`."""
+        for k in np.asarray(new_cases, dtype=float).ravel():
+            self.update(k)
+        return self
+
+    def save(self, path: Union[str, PathLike]):
+        """Save the state of the filter in a compressed `.npz` file.
+
+        Raises:
+            ValueError: if the filter was built with an engine instance
+                instead of an engine name.
+        """
+        if not isinstance(self._engine, str):
+            raise ValueError('Only filters built with an engine name can be '
+                             'saved.')
+        posterior = self._posterior
+        if posterior is None:
+            posterior = np.empty(0)
+        np.savez_compressed(
+            path, posterior=posterior, last=np.nan if self._last is None
+            else self._last, llhood=self._llhood, ndays=self._ndays,
+            sigma=self._sigma, engine=self._engine,
+            likelihood=self._likelihood, p=self._p, grid=np.asarray(self.grid)
+        )
+
+    @classmethod
+    def load(cls, path: Union[str, PathLike]) -> 'SystromFilter':
+        """Restore a filter saved with `SystromFilter.save`."""
+        with np.load(path, allow_pickle=False) as state:
+            f = cls(sigma=float(state['sigma']), engine=str(state['engine']),
+                    likelihood=str(state['likelihood']), p=float(state['p']),
+                    grid=tuple(state['grid']))
+            if int(state['ndays']) > 0:
+                f._restore(state['posterior'], float(state['last']),
+                           float(state['llhood']), int(state['ndays']))
+        return f
+
+    def _restore(self, posterior: np.ndarray, last: float, llhood: float,
+                 ndays: int) -> 'SystromFilter':
+        # state after `ndays` days, e.g. computed by a run of the model
+        self._posterior = posterior
+        self._last = float(last)
+        self._llhood = float(llhood)
+        self._ndays = int(ndays)
+        return self
+
+    def _check_started(self):
+        if self._posterior is None:
+            raise ValueError('The filter did not see any data yet.')
+
+    def __repr__(self) -> str:
+        if self._posterior is None:
+            return f'SystromFilter(sigma={self._sigma}, no data)'
+        low, high = self.hdi
+        return (f'SystromFilter(sigma={self._sigma}, days={self._ndays}, '
+                f'Rt={self.rt:.2f} [{low:.2f}, {high:.2f}], '
+                f'log-likelihood={self._llhood:.2f})')
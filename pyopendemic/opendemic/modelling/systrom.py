@@ -1,21 +1,255 @@
 # This is a numpy/scipy reimplementation of
 # https://github.com/k-sys/covid-19/blob/master/Realtime%20R0.ipynb
 # and is still an alpha version
-from typing import Tuple
+from __future__ import annotations
+
+from functools import lru_cache
+from typing import Dict, Iterable, Iterator, NamedTuple, Tuple, Union
 
 import numpy as np
-import scipy.stats as sps
+
+from opendemic._lazy import lazy_import
+from opendemic.profiling import count
+from opendemic.profiling import span
+from opendemic.profiling import timed
+from .transition import AbstractTransition
+from .transition import get_transition
+
+sps = lazy_import('scipy.stats')
+special = lazy_import('scipy.special')
 
 # The gamma parameter is defined as the reciprocal of the serial interval and
 # is required in order to define the likelihood
 _GAMMA = 1 / 7
 
 _RT_MAX = 12
-RT_RANGE = np.linspace(0, _RT_MAX, _RT_MAX * 100 + 1)
 
 
-def get_posteriors(ts: np.ndarray, sigma: float = 0.25) -> Tuple[np.ndarray,
-                                                                 float]:
+class RtGrid(NamedTuple):
+    """Uniform grid of tested Rt-s, i.e. `np.linspace(start, stop, num)`."""
+    start: float = 0.
+    stop: float = float(_RT_MAX)
+    num: int = _RT_MAX * 100 + 1
+
+    @classmethod
+    def from_resolution(cls, start: float = 0., stop: float = _RT_MAX,
+                        resolution: float = 0.01) -> 'RtGrid':
+        """Grid from `start` to `stop` (rounded up to a multiple of
+        `resolution`) spaced by `resolution`."""
+        if resolution <= 0:
+            raise ValueError('The resolution must be positive.')
+        num = int(np.ceil(round((stop - start) / resolution, 9))) + 1
+        return cls(float(start), float(start + (num - 1) * resolution), num)
+
+    @property
+    def resolution(self) -> float:
+        """Spacing of the grid."""
+        return (self.stop - self.start) / (self.num - 1)
+
+    @property
+    def values(self) -> np.ndarray:
+        """Tested Rt-s."""
+        return np.linspace(self.start, self.stop, self.num)
+
+
+DEFAULT_GRID = RtGrid()
+RT_RANGE = DEFAULT_GRID.values
+
+# Coarse grid of the first pass of `get_posteriors_adaptive`
+ADAPTIVE_COARSE_GRID = RtGrid(0., float(_RT_MAX), _RT_MAX * 10 + 1)
+
+# Maximum number of precomputed models kept in memory. A dense model on the
+# default grid takes ~11 MB, a banded one a few KB (~11 MB as well once it
+# ran a batch, see `opendemic.modelling.transition.BandedTransition`).
+MODEL_CACHE_SIZE = 32
+
+
+class Model(NamedTuple):
+    """Operators of the Systrom model that do not depend on the data.
+
+    Attributes:
+        transition: AbstractTransition
+            Update of the prior P(R(t) | R(t-1)).
+        growth: np.ndarray
+            exp(gamma * (Rt - 1)) for each tested Rt, i.e. the daily growth
+            factor of the expected number of new cases.
+        prior0: np.ndarray
+            Initial (uniform) prior.
+    """
+    transition: AbstractTransition
+    growth: np.ndarray
+    prior0: np.ndarray
+
+
+_LIKELIHOODS = ('pmf', 'log')
+
+
+def _normalized_likelihood(k_prev: np.ndarray, k: np.ndarray,
+                           growth: np.ndarray, log: bool = False
+                           ) -> np.ndarray:
+    # Poisson likelihood of observing k new cases given k_prev the day before,
+    # for each tested Rt (last axis), normalized over the tested Rt-s.
+    lam = k_prev * growth
+    if not log:
+        likelihood = sps.poisson.pmf(k, lam)
+        return likelihood / np.sum(likelihood, axis=-1, keepdims=True)
+    # The -log(k!) term of the log-pmf is constant along the Rt axis, hence
+    # it cancels out in the normalization.
+    loglikelihood = special.xlogy(k, lam) - lam
+    loglikelihood -= special.logsumexp(loglikelihood, axis=-1, keepdims=True)
+    return np.exp(loglikelihood)
+
+
+def _likelihood_matrix(ts: np.ndarray, growth: np.ndarray,
+                       log: bool = False) -> np.ndarray:
+    # one row per day, i.e. row i - 1 is P(ts[i] | R_t)
+    return _normalized_likelihood(ts[:-1, None], ts[1:, None], growth, log)
+
+
+def _forward_step(posterior: np.ndarray, likelihood: np.ndarray,
+                  transition: AbstractTransition) -> Tuple[np.ndarray, float]:
+    # one step of the brownian motion that defines the prior
+    prior = transition(posterior)
+
+    # compute P(k|R_t) P(R_t) for each R_t (numerator of posterior)
+    posterior_num = likelihood * prior
+
+    # compute P(k) with total probability law (denominator of posterior)
+    posterior_den = posterior_num.sum()
+
+    # one step forward
+    return posterior_num / posterior_den, posterior_den
+
+
+# Number of days processed at once when iterating over the posteriors. It
+# bounds the memory of the likelihood and of the buffered summaries.
+_CHUNK = 64
+
+# Maximum number of posteriors buffered by `get_batch_summaries` before they
+# are summarized, i.e. ~10 MB on the default grid.
+_BATCH_BUFFER_ROWS = 1024
+
+
+def _iter_posteriors(ts: np.ndarray, model: Model, log: bool
+                     ) -> Iterator[Tuple[np.ndarray, float]]:
+    # Yield the posterior of each day and its normalization P(k), i.e. the
+    # likelihood of the day (1 for the first day, whose posterior is the
+    # initial prior). The likelihood is computed a chunk of days at a time.
+    # The filter always runs in double precision and callers cast the stored
+    # posteriors, since k log(lam) - lam cancels most of its digits in single
+    # precision when the counts are large.
+    ts = ts.astype(np.float64)
+    growth = model.growth
+    posterior = model.prior0
+    yield posterior, 1.
+    for start in range(1, ts.size, _CHUNK):
+        stop = min(start + _CHUNK, ts.size)
+        # compute P(k|R_t) for each R_t
+        with span('modelling.likelihood'):
+            likelihood = _normalized_likelihood(ts[start - 1:stop - 1, None],
+                                                ts[start:stop, None], growth,
+                                                log)
+        count('modelling.days', stop - start)
+        for lik in likelihood:
+            posterior, posterior_den = _forward_step(posterior, lik,
+                                                     model.transition)
+            yield posterior, posterior_den
+
+
+def _check_likelihood(likelihood: str) -> bool:
+    if likelihood not in _LIKELIHOODS:
+        raise ValueError(f"'{likelihood}' is not an available likelihood. "
+                         f"Available likelihoods: {list(_LIKELIHOODS)}.")
+    return likelihood == 'log'
+
+
+@lru_cache(maxsize=MODEL_CACHE_SIZE)
+def _build_model(sigma: float, rt_start: float, rt_stop: float, rt_num: int,
+                 gamma: float, engine: str) -> Model:
+    rt_range = np.linspace(rt_start, rt_stop, rt_num)
+
+    # Determine the update of the prior P(R(t) | R(t-1))
+    transition = get_transition(engine, rt_range, sigma)
+    return _model(transition, gamma)
+
+
+def _model(transition: AbstractTransition, gamma: float) -> Model:
+    # the operators are built on the grid of the transition
+    rt_range = transition.rt_range
+    growth = np.exp(gamma * (rt_range - 1))
+
+    # Initial prior
+    prior0 = np.ones_like(rt_range)
+    prior0 /= len(prior0)
+    prior0 /= prior0.sum()
+
+    # the model is shared among callers, hence it must not be modified
+    growth.flags.writeable = False
+    prior0.flags.writeable = False
+    return Model(transition, growth, prior0)
+
+
+def _check_grid(grid: RtGrid) -> RtGrid:
+    if grid is None:
+        return DEFAULT_GRID
+    grid = RtGrid(float(grid[0]), float(grid[1]), int(grid[2]))
+    if grid.num < 2 or grid.stop <= grid.start:
+        raise ValueError('The Rt grid must have at least two points and '
+                         '`stop` must be larger than `start`.')
+    return grid
+
+
+def get_model(sigma: float = 0.25,
+              engine: Union[str, AbstractTransition] = 'banded',
+              grid: RtGrid = None) -> Model:
+    """
+    Get the data-independent operators of the model.
+
+    Models are memoized in a bounded LRU cache keyed by sigma, Rt grid, gamma
+    and engine, so that consecutive calls with the same parameters do not
+    rebuild them. Models built around an already instantiated transition
+    operator are not cached, and they use the grid of the operator.
+
+    Args:
+        sigma : float
+            Scale parameter of the gaussian update of the prior distribution.
+            With a transition instance, it must be the sigma of the instance.
+        engine : str or AbstractTransition
+            Implementation of the gaussian update of the prior. See
+            `get_posteriors`.
+        grid : RtGrid
+            Grid of tested Rt-s. Default: `DEFAULT_GRID`, or the grid of the
+            transition instance.
+    Returns:
+        Model instance. Its arrays are read-only.
+    Raises:
+        ValueError : if the engine is unknown, if the grid is invalid or if
+            sigma or the grid differ from the ones of a transition instance.
+    """
+    if isinstance(engine, AbstractTransition):
+        rt_range = engine.rt_range if grid is None else \
+            _check_grid(grid).values
+        return _model(get_transition(engine, rt_range, sigma), _GAMMA)
+    grid = _check_grid(grid)
+    return _build_model(float(sigma), *grid, _GAMMA, str(engine).lower())
+
+
+def model_cache_info():
+    """Statistics of the model cache as a `functools` CacheInfo namedtuple
+    (hits, misses, maxsize, currsize)."""
+    return _build_model.cache_info()
+
+
+def clear_model_cache():
+    """Remove all the precomputed models from the cache."""
+    _build_model.cache_clear()
+
+
+@timed('modelling.filter')
+def get_posteriors(ts: np.ndarray, sigma: float = 0.25,
+                   engine: Union[str, AbstractTransition] = 'banded',
+                   likelihood: str = 'pmf', dtype: type = np.float64,
+                   grid: RtGrid = None) -> Tuple[np.ndarray, float]:
     """
     Get the posterior probability for each time step and the log-likelihood of
     the representation.
@@ -26,80 +260,553 @@ def get_posteriors(ts: np.ndarray, sigma: float = 0.25) -> Tuple[np.ndarray,
             number of new cases in each time point.
         sigma : float
             Scale parameter of the gaussian update of the prior distribution.
+        engine : str or AbstractTransition
+            Implementation of the gaussian update of the prior. One of
+            'dense' (full N x N matrix, the reference), 'banded' (kernel
+            truncated at 8 sigmas, posteriors within ~1e-12 of 'dense') or
+            'convolution' (untruncated kernel applied via FFT, within the
+            FFT round-off of 'dense'). See
+            `opendemic.modelling.transition`. An instance is run on its own
+            grid and must have the given sigma. Default: 'banded'.
+        likelihood : str
+            How the Poisson likelihood is computed. With 'pmf' it is given by
+            `scipy.stats.poisson.pmf`. With 'log' it is evaluated in
+            log-space, which does not underflow for large counts. In both
+            cases, it is evaluated inside the filter a few days at a time,
+            so the N x T likelihood matrix is never materialized.
+            Default: 'pmf'.
+        dtype : type
+            Floating point type of the stored posteriors, e.g. np.float32
+            to halve their memory footprint. The likelihood, the filter and
+            the log-likelihood are always computed in double precision.
+            Default: np.float64.
+        grid : RtGrid
+            Grid of tested Rt-s, e.g. `RtGrid.from_resolution(0, 6, 0.05)`.
+            The cost of each step is proportional to the size of the grid
+            (to its square with the dense engine). Default: `DEFAULT_GRID`,
+            i.e. `opendemic.modelling.systrom.RT_RANGE`.
     Returns:
         tuple of length 2 with:
             * 2d numpy array with one row per time point and one column per
                 tested Rt. Each row of the matrix encodes the posterior
                 probability distribution at a specific timepoint. The array of
-                the tested Rt-s is defined as
-                `opendemic.modelling.systrom.RT_RANGE`.
+                the tested Rt-s is `grid.values`.
             * float with the log-likelihood of the model.
     Raises:
-        ValueError : if the passed time series is not one-dimensional.
+        ValueError : if the passed time series is not one-dimensional, if
+            the engine or the likelihood are unknown or if the grid is
+            invalid.
     """
     ts = np.squeeze(ts)
     if ts.ndim != 1:
         raise ValueError('The time series must be a 1d array.')
+    log = _check_likelihood(likelihood)
 
-    sigma = float(sigma)
+    model = get_model(sigma, engine, grid)
 
-    lam = ts[:-1] * np.exp(_GAMMA * (RT_RANGE[:, None] - 1))
+    # Compute posterior and log likelihood
+    posteriors = np.zeros((ts.size, model.prior0.size), dtype=dtype)
+    llhood = 0.0
+    for i, (posterior, posterior_den) in enumerate(
+            _iter_posteriors(ts, model, log)):
+        posteriors[i] = posterior
+        # update log likelihood
+        llhood += np.log(posterior_den, dtype=np.float64)
 
-    likelihood = sps.poisson.pmf(ts[1:], lam)
-    likelihood /= np.sum(likelihood, axis=0)
+    return posteriors, llhood
 
-    # Determine the update of the prior P(R(t) | R(t-1))
-    transition = sps.norm(loc=RT_RANGE, scale=sigma).pdf(RT_RANGE[:, None])
-    transition /= transition.sum(axis=0)
 
-    # Initial prior
-    prior0 = np.ones_like(RT_RANGE)
-    prior0 /= len(prior0)
-    prior0 /= prior0.sum()
+@timed('modelling.filter')
+def get_summaries(ts: np.ndarray, sigma: float = 0.25,
+                  engine: Union[str, AbstractTransition] = 'banded',
+                  likelihood: str = 'pmf', dtype: type = np.float64,
+                  grid: RtGrid = None, p: float = 0.9, mean: bool = False,
+                  quantiles: Iterable[float] = None
+                  ) -> Tuple[Dict[str, np.ndarray], float]:
+    """
+    Get summaries of the posterior probability for each time step and the
+    log-likelihood of the representation.
 
-    # Compute posterior and log likelihood
-    posteriors = np.zeros((ts.size, prior0.size))
-    posteriors[0] = prior0
+    The summaries are computed during the forward pass, a few days at a time,
+    hence the T x N matrix of the posteriors is never materialized and the
+    working memory does not depend on the length of the series. The results
+    are the same that would be computed on the output of `get_posteriors`.
+
+    Args:
+        ts, sigma, engine, likelihood, dtype, grid:
+            See `get_posteriors`.
+        p : float
+            Probability mass of the high density interval.
+        mean : bool
+            If True, compute also the posterior mean of Rt.
+        quantiles : iterable of floats
+            Quantiles of the posterior to compute, e.g. [0.025, 0.975]. The
+            quantile q is the first tested Rt at which the cumulative
+            probability is not lower than q.
+    Returns:
+        tuple of length 2 with:
+            * dictionary of numpy arrays with one element (row for
+                'quantiles') per time point:
+                - 'rt': maximum a posteriori Rt;
+                - 'low': lower boundary of the high density interval;
+                - 'high': higher boundary of the high density interval;
+                - 'mean': posterior mean, if `mean` is True;
+                - 'quantiles': 2d array with one column per quantile, if
+                  `quantiles` is specified.
+            * float with the log-likelihood of the model.
+    Raises:
+        ValueError : see `get_posteriors`.
+    """
+    ts = np.squeeze(ts)
+    if ts.ndim != 1:
+        raise ValueError('The time series must be a 1d array.')
+    log = _check_likelihood(likelihood)
+
+    model = get_model(sigma, engine, grid)
+    rt_range = model.transition.rt_range
 
+    summaries = {'rt': np.zeros(ts.size), 'low': np.zeros(ts.size),
+                 'high': np.zeros(ts.size)}
+    if mean:
+        summaries['mean'] = np.zeros(ts.size)
+    if quantiles is not None:
+        quantiles = np.asarray(quantiles, dtype=float).ravel()
+        summaries['quantiles'] = np.zeros((ts.size, quantiles.size))
+
+    def summarize(rows, buffer):
+        summaries['rt'][rows] = rt_range[np.argmax(buffer, axis=1)]
+        summaries['low'][rows], summaries['high'][rows] = \
+            high_density_intervals(buffer, p, rt_range)
+        if mean:
+            summaries['mean'][rows] = buffer @ rt_range
+        if quantiles is not None:
+            cumsum = np.cumsum(buffer, axis=1)
+            idx = (cumsum[:, :, None] < quantiles).sum(axis=1)
+            idx = np.minimum(idx, rt_range.size - 1)
+            summaries['quantiles'][rows] = rt_range[idx]
+
+    # the posteriors of the last few days, summarized when the buffer is full
+    buffer = np.zeros((min(_CHUNK, ts.size), rt_range.size), dtype=dtype)
     llhood = 0.0
+    for i, (posterior, posterior_den) in enumerate(
+            _iter_posteriors(ts, model, log)):
+        buffer[i % _CHUNK] = posterior
+        llhood += np.log(posterior_den, dtype=np.float64)
+        if i % _CHUNK == _CHUNK - 1 or i == ts.size - 1:
+            start = i - i % _CHUNK
+            summarize(slice(start, i + 1), buffer[:i - start + 1])
 
-    for i in range(1, ts.size):
-        # one step of the brownian motion that defines the prior
-        prior = transition @ posteriors[i - 1]
+    return summaries, llhood
 
-        # compute P(k|R_t) P(R_t) for each R_t (numerator of posterior)
-        posterior_num = likelihood[:, i - 1] * prior
 
-        # compute P(k) with total probability law (denominator of posterior)
-        posterior_den = posterior_num.sum()
+@timed('modelling.adaptive_grid')
+def adaptive_grid(ts: np.ndarray, sigma: float = 0.25,
+                  engine: Union[str, AbstractTransition] = 'banded',
+                  likelihood: str = 'pmf', dtype: type = np.float64,
+                  coarse: RtGrid = ADAPTIVE_COARSE_GRID,
+                  resolution: float = 0.01, tail: float = 1e-6) -> RtGrid:
+    """
+    Get a grid restricted to where the posterior has mass.
 
-        # one step forward
-        posteriors[i] = posterior_num / posterior_den
+    A first pass on the `coarse` grid finds the range of Rt-s outside which
+    the posteriors of all the days but the first hold less than `tail`
+    probability. The returned grid is spaced by `resolution` and covers that
+    range, enlarged by one coarse step on each side.
 
-        # update log likelihood
-        llhood += np.log(posterior_den)
+    Args:
+        ts : np.ndarray
+            One dimensional array representation of the time series of the
+            number of new cases in each time point.
+        sigma, engine, likelihood, dtype:
+            See `get_posteriors`.
+        coarse : RtGrid
+            Grid of the first pass. It also bounds the refined grid.
+        resolution : float
+            Spacing of the refined grid.
+        tail : float
+            Probability mass that can be neglected on each side.
+    Returns:
+        RtGrid instance.
+    """
+    coarse = _check_grid(coarse)
+    summaries, _ = get_summaries(ts, sigma, engine, likelihood, dtype, coarse,
+                                 quantiles=[tail, 1 - tail])
+    bounds = summaries['quantiles'][1:]
+    if bounds.size == 0 or not np.all(np.isfinite(bounds)):
+        low, high = coarse.start, coarse.stop
+    else:
+        low, high = bounds[:, 0].min(), bounds[:, 1].max()
+    low = max(low - coarse.resolution, coarse.start)
+    high = min(high + coarse.resolution, coarse.stop)
 
-    return posteriors, llhood
+    start = coarse.start + np.floor((low - coarse.start) / resolution) * \
+        resolution
+    return RtGrid.from_resolution(start, high, resolution)
+
+
+def get_posteriors_adaptive(ts: np.ndarray, sigma: float = 0.25,
+                            engine: Union[str, AbstractTransition] = 'banded',
+                            likelihood: str = 'pmf',
+                            dtype: type = np.float64, **kwargs
+                            ) -> Tuple[np.ndarray, float, RtGrid]:
+    """
+    Get the posteriors on a grid restricted to where the posterior has mass.
+
+    The grid is found with `adaptive_grid`, then `get_posteriors` is run on
+    it. Since the initial prior is uniform over the refined grid, results
+    differ slightly from the ones on the full grid, mostly in the first days.
+
+    Args:
+        ts, sigma, engine, likelihood, dtype:
+            See `get_posteriors`.
+        **kwargs:
+            Passed to `adaptive_grid`, i.e. `coarse`, `resolution` and `tail`.
+    Returns:
+        tuple of length 3 with the posteriors and the log-likelihood on the
+        refined grid (see `get_posteriors`) and the refined RtGrid.
+    """
+    grid = adaptive_grid(ts, sigma, engine, likelihood, dtype, **kwargs)
+    post, llhood = get_posteriors(ts, sigma, engine, likelihood, dtype, grid)
+    return post, llhood, grid
+
+
+@timed('modelling.likelihood')
+def get_likelihood(ts: np.ndarray, likelihood: str = 'pmf',
+                   dtype: type = np.float64, grid: RtGrid = None
+                   ) -> np.ndarray:
+    """
+    Get the likelihood of each day of the time series, normalized over the
+    tested Rt-s.
+
+    The likelihood does not depend on sigma, hence it can be computed once and
+    passed to `get_llhood` for as many values of sigma as needed.
+
+    Args:
+        ts : np.ndarray
+            One dimensional array representation of the time series of the
+            number of new cases in each time point.
+        likelihood : str
+            Either 'pmf' or 'log'. See `get_posteriors`.
+        dtype : type
+            Floating point type of the result. The likelihood is computed
+            in double precision and then cast.
+        grid : RtGrid
+            Grid of tested Rt-s. Default: `DEFAULT_GRID`.
+    Returns:
+        2d numpy array with one row per time point but the first, and one
+        column per tested Rt.
+    Raises:
+        ValueError : if the passed time series is not one-dimensional or if
+            the likelihood is unknown.
+    """
+    ts = np.squeeze(ts)
+    if ts.ndim != 1:
+        raise ValueError('The time series must be a 1d array.')
+    log = _check_likelihood(likelihood)
+    grid = _check_grid(grid)
+    growth = np.exp(_GAMMA * (grid.values - 1))
+    return _likelihood_matrix(ts.astype(np.float64), growth,
+                              log).astype(dtype)
+
+
+@timed('modelling.filter')
+def get_llhood(likelihood: np.ndarray, sigma: float = 0.25,
+               engine: Union[str, AbstractTransition] = 'banded',
+               grid: RtGrid = None) -> float:
+    """
+    Get the log-likelihood of the model from a precomputed likelihood.
+
+    It is the same value returned by `get_posteriors`, but only the posterior
+    of the current day is kept in memory.
+
+    Args:
+        likelihood : np.ndarray
+            Likelihood returned by `get_likelihood`.
+        sigma : float
+            Scale parameter of the gaussian update of the prior distribution.
+        engine : str or AbstractTransition
+            Implementation of the gaussian update of the prior. See
+            `get_posteriors`.
+        grid : RtGrid
+            Grid of tested Rt-s, the same passed to `get_likelihood`.
+    Returns:
+        float with the log-likelihood of the model.
+    """
+    model = get_model(sigma, engine, grid)
+    posterior = model.prior0
+    llhood = 0.0
+    count('modelling.days', len(likelihood))
+    for lik in likelihood:
+        posterior, posterior_den = _forward_step(posterior, lik,
+                                                 model.transition)
+        llhood += np.log(posterior_den, dtype=np.float64)
+    return llhood
+
+
+@timed('modelling.filter')
+def get_batch_summaries(ts: np.ndarray, sigma: float = 0.25,
+                        engine: Union[str, AbstractTransition] = 'banded',
+                        mask: np.ndarray = None, p: float = 0.9,
+                        likelihood: str = 'pmf', dtype: type = np.float64,
+                        grid: RtGrid = None
+                        ) -> Tuple[np.ndarray, np.ndarray, np.ndarray,
+                                   np.ndarray]:
+    """
+    Run the model on many time series at once and summarize the posteriors.
+
+    The forward filter is run for all the regions together, hence each step
+    is a matrix-matrix operation instead of one matrix-vector operation per
+    region. The full posteriors are never stored.
+
+    Each row of `ts` is the time series of a region. Series with different
+    lengths or start dates are encoded by masking the missing entries: the
+    valid entries of each row must be contiguous, and the first valid entry
+    of a row plays the role of `ts[0]` in `get_posteriors`. Any result
+    computed on the valid entries of a row is the same that `get_posteriors`
+    returns on that series alone.
+
+    Args:
+        ts : np.ndarray
+            Two dimensional array with one row per region and one column per
+            time point, holding the number of new cases. NaN entries are
+            treated as missing.
+        sigma : float
+            Scale parameter of the gaussian update of the prior distribution.
+        engine : str or AbstractTransition
+            Implementation of the gaussian update of the prior. See
+            `get_posteriors`.
+        mask : np.ndarray
+            Boolean array with the same shape of `ts`, False where data are
+            missing. If None, only NaN entries are missing.
+        p : float
+            Probability mass of the high density interval.
+        likelihood : str
+            How the Poisson likelihood is computed, either 'pmf' or 'log'.
+            See `get_posteriors`.
+        dtype : type
+            Floating point type of the posteriors. See `get_posteriors`.
+        grid : RtGrid
+            Grid of tested Rt-s. Default: `DEFAULT_GRID`.
+    Returns:
+        tuple of length 4 with:
+            * 2d numpy array with the maximum a posteriori Rt for each region
+                and time point;
+            * 2d numpy array with the lower boundary of the high density
+                interval;
+            * 2d numpy array with the higher boundary of the high density
+                interval;
+            * 1d numpy array with the log-likelihood of each region.
+        Missing entries of the 2d arrays are NaN.
+    Raises:
+        ValueError : if the passed time series are not a 2d array, if the
+            mask has a different shape, if the valid entries of a region are
+            not contiguous or if the engine or the likelihood are unknown.
+    """
+    ts = np.asarray(ts, dtype=float)
+    if ts.ndim != 2:
+        raise ValueError('The time series must be a 2d array with one row per '
+                         'region.')
+
+    valid = np.isfinite(ts)
+    if mask is not None:
+        mask = np.asarray(mask, dtype=bool)
+        if mask.shape != ts.shape:
+            raise ValueError('`mask` and `ts` must have the same shape.')
+        valid &= mask
+
+    nregions, npoints = ts.shape
+    starts = np.argmax(valid, axis=1)
+    stops = starts + np.count_nonzero(valid, axis=1)
+    days = np.arange(npoints)
+    contiguous = (days >= starts[:, None]) & (days < stops[:, None])
+    if np.any(contiguous != valid):
+        raise ValueError('The valid entries of each region must be '
+                         'contiguous.')
+    ts = np.where(valid, ts, 0)
+    log = _check_likelihood(likelihood)
+
+    model = get_model(sigma, engine, grid)
+    rt_range = model.transition.rt_range
+
+    # only the buffered posteriors are stored in `dtype`, see
+    # `_iter_posteriors`
+    posteriors = np.tile(model.prior0, (nregions, 1))
+    llhood = np.zeros(nregions)
+    rt = np.full(ts.shape, np.nan)
+    low = np.full(ts.shape, np.nan)
+    high = np.full(ts.shape, np.nan)
 
+    def summarize(start, stop):
+        # one row per valid region and day, in the order of np.nonzero
+        here = valid[:, start:stop].T
+        days, regions = np.nonzero(here)
+        days += start
+        block = buffer[:stop - start][here]
+        rt[regions, days] = rt_range[np.argmax(block, axis=1)]
+        low[regions, days], high[regions, days] = high_density_intervals(
+            block, p, rt_range)
 
-def high_density_interval(pmf, p=0.9):
-    # TODO: write docstring
+    # the posteriors of the last few days, summarized in bulk when the buffer
+    # is full
+    ndays = int(np.clip(_BATCH_BUFFER_ROWS // max(nregions, 1), 1, _CHUNK))
+    buffer = np.zeros((min(ndays, npoints), nregions, rt_range.size),
+                      dtype=dtype)
+    for i in range(npoints):
+        if i > 0:
+            # regions with data both at the previous and at the current day
+            active = np.flatnonzero(valid[:, i - 1] & valid[:, i])
+        else:
+            active = np.empty(0, dtype=int)
+
+        if active.size:
+            prior = model.transition(posteriors[active])
+            with span('modelling.likelihood'):
+                lik = _normalized_likelihood(ts[active, i - 1, None],
+                                             ts[active, i, None],
+                                             model.growth, log=log)
+            count('modelling.days', active.size)
+            posterior_num = lik * prior
+            posterior_den = posterior_num.sum(axis=1)
+            posteriors[active] = posterior_num / posterior_den[:, None]
+            llhood[active] += np.log(posterior_den, dtype=np.float64)
+
+        buffer[i % ndays] = posteriors
+        if i % ndays == ndays - 1 or i == npoints - 1:
+            summarize(i - i % ndays, i + 1)
+
+    return rt, low, high, llhood
+
+
+def high_density_interval(pmf, p=0.9, rt_range=None):
+    """
+    Compute the high density interval of a probability mass function over
+    the tested Rt-s.
+
+    Args:
+        pmf : np.ndarray
+            One dimensional probability mass function.
+        p : float
+            Probability mass of the interval.
+        rt_range : np.ndarray
+            Tested Rt-s, e.g. `RtGrid.values`. Default:
+            `opendemic.modelling.systrom.RT_RANGE`.
+    Returns:
+        tuple of length 2 with the lower and higher boundary of the shortest
+        interval whose probability mass is higher than `p`.
+    Raises:
+        ValueError : if `pmf` is not one-dimensional or if its size does not
+            match the one of `rt_range`.
+    """
     pmf = np.squeeze(pmf)
     if pmf.ndim != 1:
         raise ValueError('Credible region can be computed only for 1d'
                          'probability mass vectors.')
-    cumsum = np.cumsum(pmf)
+    low, high = high_density_intervals(pmf[None], p, rt_range)
+    return low[0], high[0]
+
 
-    # total probability mass for each low, high
-    total_p = cumsum - cumsum[:, None]
+# Number of rows processed at once by `high_density_intervals`, it bounds the
+# size of the temporary arrays.
+_HDI_CHUNK = 64
 
-    # find where the total mass is higher than the wanted probability
-    lows, highs = (total_p > p).nonzero()
 
-    # find range with highest density (hence smallest range)
-    best = (highs - lows).argmin()
+@timed('modelling.hdi')
+def high_density_intervals(pmfs: np.ndarray, p: float = 0.9,
+                           rt_range: np.ndarray = None
+                           ) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Compute the high density interval of each row of `pmfs`.
 
-    low = RT_RANGE[lows[best]]
-    high = RT_RANGE[highs[best]]
+    The result is the same of calling `high_density_interval` on each row,
+    but no N x N temporary is built: for each candidate lower boundary the
+    first higher boundary enclosing a mass larger than `p` is found with a
+    vectorized bisection over the cumulative sum, which costs O(N log N) per
+    row.
 
+    Args:
+        pmfs : np.ndarray
+            Two dimensional array with one probability mass function over
+            the tested Rt-s per row, e.g. the posteriors returned by
+            `get_posteriors`.
+        p : float
+            Probability mass of the intervals.
+        rt_range : np.ndarray
+            Tested Rt-s, e.g. `RtGrid.values`. Default:
+            `opendemic.modelling.systrom.RT_RANGE`.
+    Returns:
+        tuple of length 2 with the 1d arrays of lower and higher boundaries.
+        Rows for which no interval exists (e.g. rows with NaN) get NaN.
+    Raises:
+        ValueError : if `pmfs` is not two-dimensional or if the number of its
+            columns does not match the size of `rt_range`.
+    """
+    pmfs = np.asarray(pmfs)
+    if pmfs.ndim != 2:
+        raise ValueError('`pmfs` must be a 2d array with one probability mass '
+                         'function per row.')
+    rt_range = RT_RANGE if rt_range is None else np.asarray(rt_range)
+    nrows, npoints = pmfs.shape
+    if rt_range.size != npoints:
+        raise ValueError('The probability mass functions and the Rt grid must '
+                         'have the same size.')
+    low = np.full(nrows, np.nan)
+    high = np.full(nrows, np.nan)
+    for start in range(0, nrows, _HDI_CHUNK):
+        rows = slice(start, start + _HDI_CHUNK)
+        lows, highs = _hdi_indices(np.cumsum(pmfs[rows], axis=1), p)
+        found = highs < npoints
+        low[rows][found] = rt_range[lows[found]]
+        high[rows][found] = rt_range[highs[found]]
     return low, high
+
+
+def _hdi_indices(cumsum: np.ndarray, p: float) -> Tuple[np.ndarray,
+                                                        np.ndarray]:
+    # For each row and each lower index l, find the smallest h such that
+    # cumsum[h] - cumsum[l] > p. The mass enclosed is non-decreasing in h,
+    # hence bisection applies: the solution always lies in (lo, hi], where
+    # hi == npoints stands for "no solution".
+    nrows, npoints = cumsum.shape
+    lo = np.broadcast_to(np.arange(npoints), cumsum.shape).copy()
+    hi = np.full(cumsum.shape, npoints)
+    # The solution is where cumsum crosses cumsum[l] + p, which searchsorted
+    # finds up to the round-off of the sum. All the rows are searched at
+    # once: shifted by an offset per row, they form a single sorted array.
+    # A bracket a few ulps wide around the crossing leaves a few steps of
+    # bisection to get the exact solution. Rows with NaN-s are left to the
+    # full bisection.
+    finite = np.all(np.isfinite(cumsum), axis=1)
+    shifted = np.where(finite[:, None], cumsum, 0.)
+    span = 2 * np.abs(shifted).max(initial=0.) + 1
+    offsets = np.arange(nrows)[:, None] * span
+    shifted = (shifted + offsets).ravel()
+    margin = 4 * np.finfo(cumsum.dtype).eps * \
+        max(1., abs(p), np.abs(shifted).max(initial=0.))
+    target = shifted + p
+    first = np.arange(nrows)[:, None] * npoints
+    bracket_lo = np.searchsorted(shifted, target - margin, side='right')
+    bracket_hi = np.searchsorted(shifted, target + margin, side='right')
+    bracket_lo = bracket_lo.reshape(cumsum.shape) - first - 1
+    bracket_hi = bracket_hi.reshape(cumsum.shape) - first
+    lo = np.where(finite[:, None],
+                  np.clip(bracket_lo, lo, npoints - 1), lo)
+    hi = np.where(finite[:, None], np.minimum(bracket_hi, npoints), hi)
+    lo = lo.ravel()
+    hi = hi.ravel()
+    flat = cumsum.ravel()
+    open_ = np.flatnonzero(hi - lo > 1)
+    while open_.size:
+        mid = (lo[open_] + hi[open_]) // 2
+        row_start = open_ - open_ % npoints
+        mass = flat[row_start + np.minimum(mid, npoints - 1)]
+        above = (mass - flat[open_]) > p
+        hi[open_[above]] = mid[above]
+        lo[open_[~above]] = mid[~above]
+        open_ = open_[hi[open_] - lo[open_] > 1]
+    lo = lo.reshape(cumsum.shape)
+    hi = hi.reshape(cumsum.shape)
+
+    # shortest interval, ties are resolved in favour of the lowest boundary
+    width = np.where(hi < npoints, hi - np.arange(npoints), npoints + 1)
+    best = np.argmin(width, axis=1)
+    return best, hi[np.arange(nrows), best]
@@ -0,0 +1,209 @@
+# Lightweight timing spans and counters around the stages of the pipeline,
+# e.g. download, parsing, smoothing, likelihood, forward filter and HDI.
+#
+# Profiling is disabled by default: `span` then returns a shared no-op
+# context manager and `count` returns immediately, hence the instrumented
+# code pays one function call and one flag check per stage. Spans wrap whole
+# stages, never single days of the filter.
+#
+# The self time of the 'modelling.filter' stage (i.e. without the nested
+# likelihood and HDI stages) is the time spent in the forward filter.
+#
+# Only the calling process is profiled, the stages that run in a pool of
+# worker processes are not recorded.
+import json
+import logging
+import os
+import threading
+import time
+from functools import wraps
+from typing import Callable, Dict
+
+_ENABLED = False
+_CALLBACK = None
+_TRACE = None
+_LOCK = threading.Lock()
+_LOCAL = threading.local()
+
+# name -> [calls, total seconds, seconds spent in nested spans]
+_SPANS = {}
+_COUNTERS = {}
+
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    __slots__ = ('name', 'start', 'children')
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        stack = _stack()
+        stack.append(self)
+        self.children = 0.
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.start
+        stack = _stack()
+        stack.pop()
+        if stack:
+            stack[-1].children += elapsed
+        with _LOCK:
+            stats = _SPANS.setdefault(self.name, [0, 0., 0.])
+            stats[0] += 1
+            stats[1] += elapsed
+            stats[2] += self.children
+            if _TRACE is not None:
+                _TRACE.append({'name': self.name, 'ph': 'X',
+                               'ts': self.start * 1e6, 'dur': elapsed * 1e6,
+                               'pid': os.getpid(),
+                               'tid': threading.get_ident()})
+        if _CALLBACK is not None:
+            _CALLBACK(self.name, elapsed)
+        else:
+            logging.debug(f'{self.name}: {elapsed * 1e3:.3f} ms')
+        return False
+
+
+def _stack() -> list:
+    stack = getattr(_LOCAL, 'stack', None)
+    if stack is None:
+        stack = _LOCAL.stack = []
+    return stack
+
+
+def enable(callback: Callable[[str, float], None] = None,
+           trace: bool = False):
+    """Start recording spans and counters.
+
+    Args:
+        callback: callable
+            Called as `callback(name, seconds)` at the end of each span. If
+            None, each span is logged with `logging.debug`.
+        trace: bool
+            If True, keep every span to be written by `write_trace`.
+    """
+    global _ENABLED, _CALLBACK, _TRACE
+    _CALLBACK = callback
+    _TRACE = [] if trace else None
+    _ENABLED = True
+
+
+def disable():
+    """Stop recording. The statistics collected so far are kept."""
+    global _ENABLED, _CALLBACK
+    _ENABLED = False
+    _CALLBACK = None
+
+
+def is_enabled() -> bool:
+    """Whether spans and counters are being recorded."""
+    return _ENABLED
+
+
+def reset():
+    """Forget the statistics and the trace collected so far."""
+    global _TRACE
+    with _LOCK:
+        _SPANS.clear()
+        _COUNTERS.clear()
+        if _TRACE is not None:
+            _TRACE = []
+
+
+def span(name: str):
+    """Context manager that times a stage of the pipeline.
+
+        >>> with span('modelling.hdi'):
+        ...     low, high = high_density_intervals(posteriors)
+
+    Spans can be nested: the time of the inner spans is reported as part of
+    the total time of the outer span but not of its self time.
+    """
+    if not _ENABLED:
+        return _NULL_SPAN
+    return _Span(name)
+
+
+def timed(name: str) -> Callable:
+    """Decorator that runs the whole function in a span."""
+    def decorator(func: Callable) -> Callable:
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _ENABLED:
+                return func(*args, **kwargs)
+            with _Span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def count(name: str, n: int = 1):
+    """Add `n` to the counter `name`, e.g. the number of days filtered."""
+    if not _ENABLED:
+        return
+    with _LOCK:
+        _COUNTERS[name] = _COUNTERS.get(name, 0) + n
+
+
+def stats() -> Dict[str, Dict[str, float]]:
+    """Statistics of the spans recorded so far.
+
+    Return:
+        dict mapping the name of each span to a dict with the number of
+        'calls', the 'total' seconds and the 'self' seconds, i.e. the total
+        minus the time of the nested spans.
+    """
+    with _LOCK:
+        return {name: {'calls': s[0], 'total': s[1], 'self': s[1] - s[2]}
+                for name, s in _SPANS.items()}
+
+
+def counters() -> Dict[str, int]:
+    """Counters recorded so far."""
+    with _LOCK:
+        return dict(_COUNTERS)
+
+
+def report() -> str:
+    """Table with the statistics of the spans, the slowest first, and the
+    counters."""
+    spans = sorted(stats().items(), key=lambda s: -s[1]['self'])
+    total = sum(s['self'] for _, s in spans) or 1.
+    lines = [f'{"stage":<32} {"calls":>8} {"total [s]":>10} '
+             f'{"self [s]":>10} {"self %":>7}']
+    for name, s in spans:
+        lines.append(f'{name:<32} {s["calls"]:>8} {s["total"]:>10.3f} '
+                     f'{s["self"]:>10.3f} {100 * s["self"] / total:>6.1f}%')
+    for name, n in sorted(counters().items()):
+        lines.append(f'{name:<32} {n:>8}')
+    return '\n'.join(lines)
+
+
+def write_trace(path: str):
+    """Write the spans in the Trace Event Format (JSON), which can be opened
+    with chrome://tracing or https://ui.perfetto.dev, together with the
+    statistics and the counters.
+
+    Raises:
+        ValueError: if profiling was not enabled with `trace=True`.
+    """
+    if _TRACE is None:
+        raise ValueError('Profiling was not enabled with `trace=True`.')
+    with _LOCK:
+        events = list(_TRACE)
+    with open(path, 'w') as f:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms',
+                   'stats': stats(), 'counters': counters()}, f)
@@ -0,0 +1,310 @@
+# Embedded HTTP service that answers Rt queries for dashboards, e.g.
+#
+#     GET /rt?region=36103&from=2020-04-01&to=2020-04-30
+#
+# The data of the regions are loaded once. The Rt of a region is read from a
+# results store (see `opendemic.modelling.RtStore`) if available, computed
+# otherwise, and kept in an in-memory LRU cache. Computations run in a
+# bounded pool of threads and concurrent requests for a region that is being
+# computed wait for the same computation.
+#
+# Run from the pyopendemic folder with
+#
+#     python -m opendemic.service --panel ../data/time_series_cases.csv
+from __future__ import annotations
+
+import argparse
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Mapping, Union
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+
+from opendemic.data.core import AbstractRegionData
+from opendemic.modelling import compute_rt
+from opendemic.modelling.store import RtStore
+
+Loader = Callable[[str], AbstractRegionData]
+
+
+class RtService:
+    """Rt of many regions served from an in-memory cache.
+
+        >>> service = RtService(panel.aggregate(), store=RtStore('results'))
+        >>> server = service.start(port=8000)
+        >>> ...
+        >>> service.stop()
+    """
+
+    def __init__(self, regions: Union[Mapping[str, AbstractRegionData],
+                                      Loader],
+                 store: RtStore = None, kwargsmodel: dict = dict(),
+                 kwargshdi: dict = dict(), cache_size: int = 1024,
+                 max_workers: int = 4):
+        """Initiate a service.
+
+        Args:
+            regions: dict or callable
+                RegionData objects keyed by code, or a function that returns
+                the RegionData of a code (e.g. a fetch) and raises KeyError
+                or ValueError if the region is unknown.
+            store: RtStore
+                Precomputed results, read before computing a region.
+            kwargsmodel, kwargshdi: dict
+                See `opendemic.modelling.compute_rt`.
+            cache_size: int
+                Maximum number of regions kept in memory. The least recently
+                used region is evicted first.
+            max_workers: int
+                Maximum number of regions computed at the same time.
+        """
+        if cache_size < 1:
+            raise ValueError('`cache_size` must be positive.')
+        self._regions = regions
+        self._store = store
+        self._kwargsmodel = dict(kwargsmodel)
+        self._kwargshdi = dict(kwargshdi)
+        self._cache_size = int(cache_size)
+        self._cache = OrderedDict()
+        self._in_flight = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers,
+                                            thread_name_prefix='rt')
+        self._stats = {'requests': 0, 'hits': 0, 'misses': 0,
+                       'deduplicated': 0, 'store_reads': 0, 'computed': 0,
+                       'errors': 0, 'evictions': 0, 'latency_total': 0.,
+                       'latency_max': 0.}
+        self._server = None
+
+    def get(self, code: Union[str, int]) -> Dict[str, np.ndarray]:
+        """Rt of a region, from the cache if available.
+
+        Return:
+            dict with 'name' and the arrays 'dates' (np.datetime64), 'rt',
+            'low' and 'high'.
+        Raises:
+            KeyError: if the region is unknown.
+            Exception: raised by the computation of the region.
+        """
+        code = str(code)
+        start = time.perf_counter()
+        try:
+            with self._lock:
+                self._stats['requests'] += 1
+                entry = self._cache.get(code)
+                if entry is not None:
+                    self._cache.move_to_end(code)
+                    self._stats['hits'] += 1
+                    return entry
+                self._stats['misses'] += 1
+                future = self._in_flight.get(code)
+                if future is None:
+                    future = Future()
+                    self._in_flight[code] = future
+                    owner = True
+                else:
+                    self._stats['deduplicated'] += 1
+                    owner = False
+            if owner:
+                self._executor.submit(self._resolve, code, future)
+            return future.result()
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self._stats['latency_total'] += elapsed
+                self._stats['latency_max'] = max(self._stats['latency_max'],
+                                                 elapsed)
+
+    def stats(self) -> dict:
+        """Counters of the service: requests, cache hits and misses, hit
+        rate, requests that waited for a computation already in flight,
+        reads of the store, computations, errors, evictions and latency in
+        milliseconds."""
+        with self._lock:
+            s = dict(self._stats)
+            s['cached'] = len(self._cache)
+            s['in_flight'] = len(self._in_flight)
+        total = s.pop('latency_total')
+        s['hit_rate'] = s['hits'] / s['requests'] if s['requests'] else 0.
+        s['latency_mean_ms'] = 1e3 * total / s['requests'] \
+            if s['requests'] else 0.
+        s['latency_max_ms'] = 1e3 * s.pop('latency_max')
+        return s
+
+    def codes(self) -> list:
+        """Codes of the regions known in advance, i.e. those of `regions`
+        if it is a dict and those of the store."""
+        codes = list(self._regions) if isinstance(self._regions, Mapping) \
+            else []
+        if self._store is not None:
+            known = set(codes)
+            codes += [c for c in self._store.codes if c not in known]
+        return codes
+
+    def start(self, host: str = '127.0.0.1', port: int = 0
+              ) -> ThreadingHTTPServer:
+        """Serve the HTTP API in a background thread. With port 0 a free
+        port is chosen, see `server.server_address`."""
+        if self._server is not None:
+            raise ValueError('The service is already running.')
+        self._server = ThreadingHTTPServer((host, port), _handler(self))
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever,
+                         daemon=True).start()
+        logging.info(f'Serving Rt on {host}:{self._server.server_port}.')
+        return self._server
+
+    def stop(self):
+        """Stop the HTTP server, if any, and the workers."""
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+        self._executor.shutdown(wait=False)
+
+    def _resolve(self, code: str, future: Future):
+        try:
+            entry = self._load(code)
+        except BaseException as e:
+            with self._lock:
+                self._stats['errors'] += 1
+                del self._in_flight[code]
+            future.set_exception(e)
+            return
+        with self._lock:
+            self._cache[code] = entry
+            while len(self._cache) > self._cache_size:
+                self._cache.popitem(last=False)
+                self._stats['evictions'] += 1
+            del self._in_flight[code]
+        future.set_result(entry)
+
+    def _load(self, code: str) -> dict:
+        if self._store is not None and code in self._store:
+            values = self._store.read(code, columns=['rt', 'low', 'high'])
+            with self._lock:
+                self._stats['store_reads'] += 1
+            return {'name': self._store.name(code), 'dates': values['date'],
+                    'rt': values['rt'], 'low': values['low'],
+                    'high': values['high']}
+        if isinstance(self._regions, Mapping):
+            region = self._regions[code]
+        else:
+            try:
+                region = self._regions(code)
+            except ValueError as e:
+                raise KeyError(str(e)) from e
+        rt, low, high = compute_rt(region.new_cases, self._kwargsmodel,
+                                   self._kwargshdi)
+        with self._lock:
+            self._stats['computed'] += 1
+        return {'name': region.name, 'dates': np.asarray(region.dates),
+                'rt': rt, 'low': low, 'high': high}
+
+
+def _floats(values: np.ndarray) -> list:
+    # NaN is not valid json
+    return [None if np.isnan(v) else float(v) for v in values]
+
+
+def _handler(service: RtService) -> type:
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlsplit(self.path)
+            query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+            if url.path == '/rt':
+                self._rt(query)
+            elif url.path == '/stats':
+                self._send(200, service.stats())
+            elif url.path == '/regions':
+                self._send(200, {'regions': service.codes()})
+            else:
+                self._send(404, {'error': f'Unknown path {url.path}.'})
+
+        def _rt(self, query: dict):
+            if 'region' not in query:
+                self._send(400, {'error': 'Missing parameter `region`.'})
+                return
+            try:
+                start = np.datetime64(query.get('from', 'NaT'), 'D')
+                end = np.datetime64(query.get('to', 'NaT'), 'D')
+            except ValueError as e:
+                self._send(400, {'error': f'Invalid date: {e}'})
+                return
+            try:
+                entry = service.get(query['region'])
+            except KeyError:
+                self._send(404, {'error': f"Unknown region "
+                                          f"{query['region']}."})
+                return
+            except Exception as e:
+                self._send(500, {'error': f'{type(e).__name__}: {e}'})
+                return
+            mask = np.ones(entry['dates'].size, dtype=bool)
+            if not np.isnat(start):
+                mask &= entry['dates'] >= start
+            if not np.isnat(end):
+                mask &= entry['dates'] <= end
+            self._send(200, {
+                'region': query['region'], 'name': entry['name'],
+                'dates': entry['dates'][mask].astype(str).tolist(),
+                'rt': _floats(entry['rt'][mask]),
+                'low': _floats(entry['low'][mask]),
+                'high': _floats(entry['high'][mask])})
+
+        def _send(self, status: int, content: dict):
+            body = json.dumps(content).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            logging.debug(format % args)
+
+    return Handler
+
+
+def main():
+    from opendemic.data import RegionPanel
+
+    parser = argparse.ArgumentParser(description='Serve the Rt of the '
+                                                 'regions of a JHU panel.')
+    parser.add_argument('--panel', required=True, metavar='<path>',
+                        help='JHU time series csv of the counties. The '
+                             'states and the whole USA are aggregated from '
+                             'the counties.')
+    parser.add_argument('--store', metavar='<dir>',
+                        help='Results store with precomputed Rt.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--cache-size', type=int, default=1024)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--sigma', type=float, default=0.25)
+    parser.add_argument('--hdi', type=float, default=0.9)
+    args = parser.parse_args()
+
+    panel = RegionPanel.load_jhu(args.panel)
+    regions = {r.code: r for r in panel.regions()}
+    regions.update(panel.aggregate())
+    store = RtStore(args.store) if args.store is not None else None
+    service = RtService(regions, store, {'sigma': args.sigma},
+                        {'p': args.hdi}, args.cache_size, args.workers)
+    server = service.start(args.host, args.port)
+    print(f'Serving Rt on http://{args.host}:{server.server_port}/rt',
+          flush=True)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        service.stop()
+
+
+if __name__ == '__main__':
+    main()
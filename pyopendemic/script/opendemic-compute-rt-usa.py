@@ -1,4 +1,5 @@
 import argparse
+import sys
 from os import path
 
 import opendemic as od
@@ -24,6 +25,72 @@ parser.add_argument(
          'NY.'
 )
 
+parser.add_argument(
+    '--all-states',
+    action='store_true',
+    help='Compute Rt for all the states. Can be combined with '
+         '`--all-counties` and `--regions-file`.'
+)
+
+parser.add_argument(
+    '--all-counties',
+    action='store_true',
+    help='Compute Rt for all the counties.'
+)
+
+parser.add_argument(
+    '--regions-file',
+    type=str,
+    metavar='<path>',
+    help='Path of a text file with one region per line, either a state code '
+         '(e.g. AK) or a five-digits FIPS code of a county (e.g. 36103).'
+)
+
+parser.add_argument(
+    '--processes',
+    type=int,
+    metavar='[1, ... ]',
+    help='Number of worker processes used with more than one region. '
+         'Default: number of CPUs.'
+)
+
+parser.add_argument(
+    '--incremental',
+    type=str,
+    metavar='<dir>',
+    help='Directory where the results of the regions are kept between runs, '
+         'used with more than one region. Regions whose data did not change '
+         'are not recomputed, and regions that only gained new days are '
+         'resumed from the stored filter state.'
+)
+
+parser.add_argument(
+    '--store',
+    type=str,
+    metavar='<dir>',
+    help='Directory of a results store where the Rt of the regions is '
+         'appended, used with more than one region. It can be queried by '
+         'region and date range with `opendemic.modelling.RtStore`.'
+)
+
+parser.add_argument(
+    '--posteriors',
+    type=str,
+    metavar='<dir>',
+    help='Directory where the full posteriors of the regions are saved as a '
+         'memory-mapped cube, used with more than one region and without '
+         '`--incremental`. It can be read with '
+         '`opendemic.modelling.PosteriorCube`.'
+)
+
+parser.add_argument(
+    '--posteriors-form',
+    choices=['dense', 'band'],
+    default='dense',
+    help='Layout of the posterior cube: dense float32 or only the band of '
+         'each posterior above 1e-6 times its maximum. Default: dense.'
+)
+
 parser.add_argument(
     '--sigma',
     type=float,
@@ -49,34 +116,160 @@ parser.add_argument(
          'specified, it prints to stdout.'
 )
 
+parser.add_argument(
+    '--profile',
+    action='store_true',
+    help='If specified, a breakdown of the time spent in each stage (download, '
+         'parsing, smoothing, likelihood, filter, HDI) is printed to stderr. '
+         'Stages that run in worker processes are not recorded, use '
+         '`--processes 1` for a complete breakdown.'
+)
+
+parser.add_argument(
+    '--trace',
+    type=str,
+    metavar='<path>',
+    help='Path where a machine-readable trace of the stages is saved, in the '
+         'Trace Event Format (JSON) of chrome://tracing. Implies `--profile`.'
+)
+
 parser.add_argument(
     '-f',
     action='store_true',
     help='If specified, the output file will be overwritten.'
 )
 
-args = parser.parse_args()
-if args.state is None and args.county is None:
-    args = parser.parse_args(['-h'])
 
-if args.csv is not None:
-    if path.isfile(args.csv) and not args.f:
-        raise FileExistsError('The specified output path is an existing file. '
-                              'To overwrite it, add the `-f` argument.')
+def read_regions_file(filename):
+    states, counties = [], []
+    with open(filename) as f:
+        for line in f:
+            code = line.strip()
+            if not code or code.startswith('#'):
+                continue
+            if code.isdigit():
+                counties.append(int(code))
+            else:
+                states.append(code.upper())
+    return states, counties
+
+
+def progress(done, total, region, error):
+    status = 'failed' if error is not None else 'done'
+    print(f'\r[{done}/{total}] {region.code} {status}'.ljust(40), end='',
+          file=sys.stderr, flush=True)
+    if done == total:
+        print(file=sys.stderr)
+
+
+def compute_batch(args):
+    states, counties = [], []
+    if args.regions_file is not None:
+        states, counties = read_regions_file(args.regions_file)
+    if args.all_states:
+        states = od.data.ALLOWED_REGIONS_USA + states
+    # missing data are failures only for explicitly requested regions
+    requested = states + [str(c).zfill(5) for c in counties]
+    if args.all_counties:
+        counties += od.data.county_codes().tolist()
+    states = list(dict.fromkeys(states))
+    counties = list(dict.fromkeys(counties))
+
+    # each source is fetched once for all the regions
+    regions = {}
+    if states or counties:
+        regions = od.data.USARegionData.fetch_many(
+            states=states or None, counties=counties or None,
+            errors='ignore')
+    failures = {code: 'no data available' for code in requested
+                if code not in regions}
+
+    if args.posteriors is not None:
+        results, errors = od.modelling.write_posterior_cube(
+            args.posteriors, regions.values(), {'sigma': args.sigma},
+            {'p': args.hdi}, form=args.posteriors_form,
+            processes=args.processes)
+    elif args.incremental is None:
+        results, errors = od.modelling.compute_rt_many(
+            regions.values(), {'sigma': args.sigma}, {'p': args.hdi},
+            processes=args.processes, callback=progress)
+    else:
+        job = od.modelling.IncrementalRt(args.incremental, sigma=args.sigma,
+                                         p=args.hdi)
+        results, statuses, errors = job.update_many(regions.values(),
+                                                    callback=progress)
+        counts = pd.Series(statuses, dtype=str).value_counts()
+        print(', '.join(f'{n} {s}' for s, n in counts.items()),
+              file=sys.stderr)
+    failures.update(errors)
+    if args.store is not None:
+        od.modelling.RtStore(args.store).append_many(regions.values(),
+                                                     results)
+
+    frames = []
+    for code, (rt, low, high) in results.items():
+        data = regions[code]
+        frames.append(pd.DataFrame({
+            'date': data.dates, 'code': code, 'name': data.name,
+            'cases': data.cases, 'new_cases': data.new_cases, 'rt': rt,
+            'low': low, 'high': high}))
+    for code, error in failures.items():
+        print(f'{code}: {error}', file=sys.stderr)
+    print(f'{len(results)} regions done, {len(failures)} failed.',
+          file=sys.stderr)
+    if not frames:
+        return pd.DataFrame(columns=['date', 'code', 'name', 'cases',
+                                     'new_cases', 'rt', 'low', 'high'])
+    return pd.concat(frames, ignore_index=True)
+
+
+def compute_single(args):
+    data = od.data.USARegionData.fetch(state=args.state, county=args.county)
+
+    rt, low, high = od.modelling.compute_rt(data.new_cases,
+                                            {'sigma': args.sigma},
+                                            {'p': args.hdi})
+
+    return pd.DataFrame({'cases': data.cases, 'new_cases': data.new_cases,
+                         'rt': rt, 'low': low, 'high': high},
+                        index=data.dates)
+
+
+def main():
+    args = parser.parse_args()
+    batch = args.all_states or args.all_counties or \
+        args.regions_file is not None
+    if args.state is None and args.county is None and not batch:
+        args = parser.parse_args(['-h'])
+
+    if args.csv is not None:
+        if path.isfile(args.csv) and not args.f:
+            raise FileExistsError('The specified output path is an existing '
+                                  'file. To overwrite it, add the `-f` '
+                                  'argument.')
+
+    if args.posteriors is not None and args.incremental is not None:
+        parser.error('`--posteriors` cannot be used with `--incremental`.')
+
+    if args.sigma < 0:
+        raise ValueError('Sigma must be between 0 and 1.')
+
+    profile = args.profile or args.trace is not None
+    if profile:
+        od.profiling.enable(trace=args.trace is not None)
 
-if args.sigma < 0:
-    raise ValueError('Sigma must be between 0 and 1.')
+    df = compute_batch(args) if batch else compute_single(args)
 
-data = od.data.USARegionData.fetch(state=args.state, county=args.county)
+    if profile:
+        print(od.profiling.report(), file=sys.stderr)
+        if args.trace is not None:
+            od.profiling.write_trace(args.trace)
 
-rt, low, high = od.modelling.compute_rt(data.new_cases,
-                                        {'sigma': args.sigma},
-                                        {'p': args.hdi})
+    if args.csv is None:
+        print(df)
+    else:
+        df.to_csv(args.csv, index=not batch)
 
-df = pd.DataFrame({'cases': data.cases, 'new_cases': data.new_cases, 'rt': rt,
-                   'low': low, 'high': high}, index=data.dates)
 
-if args.csv is None:
-    print(df)
-else:
-    df.to_csv(args.csv)
+if __name__ == '__main__':
+    main()
@@ -3,7 +3,8 @@ from setuptools import setup
 setup(
     name='pyopendemic',
     version='0.0a2',
-    packages=['opendemic', 'opendemic.data'],
+    packages=['opendemic', 'opendemic.data', 'opendemic.modelling'],
+    package_data={'opendemic.data': ['fips.csv']},
     url='https://www.opendemic.org/',
     license='MIT',
     author='Opendemic.org',
@@ -0,0 +1,132 @@
+import os
+import shutil
+from contextlib import contextmanager
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+from unittest.mock import patch
+
+import numpy as np
+import pandas as pd
+
+import opendemic.data as odd
+from opendemic.data import cache
+from opendemic.data import download
+from opendemic.data import italy
+from opendemic.data import usa
+
+FIXTURES = Path(__file__).parent / 'fixtures'
+
+
+class TestCache(TestCase):
+    """Test the local cache of the remote sources."""
+
+    def setUp(self):
+        self.tmp = TemporaryDirectory()
+        self.previous = cache.configure(
+            directory=os.path.join(self.tmp.name, 'cache'), ttl=3600,
+            offline=False, enabled=True)
+        self.source = os.path.join(self.tmp.name, 'source.csv')
+        shutil.copy(FIXTURES / 'fips.csv', self.source)
+        self.url = Path(self.source).as_uri()
+
+    def tearDown(self):
+        cache.configure(**self.previous)
+        self.tmp.cleanup()
+
+    def _read(self):
+        return download.read(self.url, pd.read_csv)
+
+    def test_served_from_cache(self):
+        df = self._read()
+        os.remove(self.source)
+        self.assertTrue(self._read().equals(df))
+
+    def test_ttl(self):
+        self._read()
+        with open(self.source, 'a') as f:
+            f.write('2000,Alaska,\n')
+        cache.configure(ttl=0)
+        self.assertEqual(len(self._read()), 6)
+
+    def test_offline(self):
+        cache.configure(offline=True)
+        with self.assertRaises(cache.CacheMiss):
+            self._read()
+        cache.configure(offline=False)
+        self._read()
+        cache.configure(offline=True, ttl=0)
+        os.remove(self.source)
+        self.assertEqual(len(self._read()), 5)
+
+    def test_clear(self):
+        self._read()
+        cache.clear(self.url)
+        os.remove(self.source)
+        with self.assertRaises(Exception):
+            self._read()
+
+    def test_fetch_from_fixtures(self):
+        with self._fixtures():
+            ny = odd.USARegionData.fetch(state='NY')
+            self.assertEqual(ny.name, 'New York')
+            county = odd.USARegionData.fetch(county=36103)
+            self.assertEqual(county.name, 'Suffolk, NY')
+            self.assertEqual(county.code, '36103')
+            lombardia = odd.ItalyRegionData.fetch('Lombardia')
+            self.assertEqual(lombardia.code, '3')
+            # the sources are now served from the cache only
+            cache.configure(offline=True)
+            odd.USARegionData.fetch(state='AK')
+            odd.ItalyRegionData.fetch('Italia')
+
+    def test_fetch_many(self):
+        with self._fixtures():
+            many = odd.USARegionData.fetch_many(states=['NY', 'ak', 'US'],
+                                                counties=[36103, '01001'])
+            self.assertEqual(list(many), ['NY', 'AK', 'US', '36103', '01001'])
+            for code, r in many.items():
+                if len(code) == 2:
+                    single = odd.USARegionData.fetch(state=code)
+                else:
+                    single = odd.USARegionData.fetch(county=code)
+                self._assert_same_region(r, single)
+
+            with self.assertRaises(ValueError):
+                odd.USARegionData.fetch_many(counties=[36103, 99999])
+            many = odd.USARegionData.fetch_many(
+                states=['NY', 'ZZ', 'TX'], counties=[36103, 99999, 1003],
+                errors='ignore')
+            self.assertEqual(list(many), ['NY', '36103'])
+
+            many = odd.ItalyRegionData.fetch_many(['Lazio', 'Italia'])
+            for name, r in many.items():
+                self._assert_same_region(r, odd.ItalyRegionData.fetch(name))
+
+            with self.assertRaises(ValueError):
+                odd.ItalyRegionData.fetch_many(['Toscana'])
+
+    def _assert_same_region(self, r, single):
+        self.assertEqual(r.name, single.name)
+        self.assertEqual(r.code, single.code)
+        np.testing.assert_array_equal(r.dates, single.dates)
+        np.testing.assert_array_equal(r.cases, single.cases)
+        np.testing.assert_array_equal(r.new_cases, single.new_cases)
+
+    @contextmanager
+    def _fixtures(self):
+        urls = [
+            (usa, 'COVID_TRACKING_PROJECT_URL',
+             'covidtracking_states_daily.json'),
+            (usa, 'NYT_URL', 'nyt_us_counties.csv'),
+            (italy, 'PROTEZIONE_CIVILE_URL', 'dpc_covid19_ita_regioni.csv'),
+        ]
+        patches = [patch.object(m, a, (FIXTURES / f).as_uri())
+                   for m, a, f in urls]
+        for p in patches:
+            p.start()
+        try:
+            yield
+        finally:
+            for p in patches:
+                p.stop()
@@ -0,0 +1,132 @@
+import functools
+import gzip
+import os
+import threading
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+from unittest.mock import patch
+
+import numpy as np
+
+import opendemic.data as odd
+from opendemic.data import cache
+from opendemic.data import download
+from opendemic.data import italy
+from opendemic.data import usa
+
+FIXTURES = Path(__file__).parent / 'fixtures'
+
+
+class _Handler(SimpleHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive
+
+    def setup(self):
+        super().setup()
+        self.server.connections += 1
+
+    def do_GET(self):
+        with self.server.lock:
+            failures = self.server.failures.get(self.path, 0)
+            self.server.failures[self.path] = max(failures - 1, 0)
+        if failures:
+            self.send_response(503)
+            self.send_header('Content-Length', '0')
+            self.send_header('Retry-After', '0')
+            self.end_headers()
+            return
+        if self.path.endswith('.gz'):
+            body = gzip.compress((FIXTURES / self.path[1:-3]).read_bytes())
+            self.send_response(200)
+            self.send_header('Content-Encoding', 'gzip')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        super().do_GET()
+
+    def log_message(self, *args):
+        pass
+
+
+class TestDownload(TestCase):
+    """Test the concurrent download against a local HTTP server."""
+
+    @classmethod
+    def setUpClass(cls):
+        handler = functools.partial(_Handler, directory=str(FIXTURES))
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        cls.server.daemon_threads = True
+        cls.server.lock = threading.Lock()
+        cls.thread = threading.Thread(target=cls.server.serve_forever,
+                                      daemon=True)
+        cls.thread.start()
+        cls.base = f'http://127.0.0.1:{cls.server.server_address[1]}'
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        self.server.connections = 0
+        self.server.failures = {}
+        self.tmp = TemporaryDirectory()
+        self.previous = cache.configure(
+            directory=os.path.join(self.tmp.name, 'cache'), ttl=3600,
+            offline=False, enabled=True)
+
+    def tearDown(self):
+        cache.configure(**self.previous)
+        self.tmp.cleanup()
+
+    def test_fetch_all_reuses_connections(self):
+        names = [f.name for f in FIXTURES.iterdir()] * 3
+        urls = [f'{self.base}/{n}?copy={i}' for i, n in enumerate(names)]
+        contents = download.fetch_all(urls, max_workers=2)
+        self.assertEqual(list(contents), urls)
+        for url, name in zip(urls, names):
+            self.assertEqual(contents[url], (FIXTURES / name).read_bytes())
+        self.assertLessEqual(self.server.connections, 2)
+
+    def test_gzip(self):
+        self.assertEqual(download.fetch(f'{self.base}/fips.csv.gz'),
+                         (FIXTURES / 'fips.csv').read_bytes())
+
+    def test_retries(self):
+        self.server.failures['/fips.csv'] = 2
+        url = f'{self.base}/fips.csv'
+        self.assertEqual(download.fetch(url, backoff=0),
+                         (FIXTURES / 'fips.csv').read_bytes())
+        self.server.failures['/fips.csv'] = 2
+        with self.assertRaises(download.DownloadError):
+            download.fetch(url, retries=1, backoff=0)
+        with self.assertRaises(download.DownloadError):
+            download.fetch(f'{self.base}/missing.csv', backoff=0)
+
+    def test_fetch_many_over_http(self):
+        urls = [
+            (usa, 'COVID_TRACKING_PROJECT_URL',
+             'covidtracking_states_daily.json'),
+            (usa, 'NYT_URL', 'nyt_us_counties.csv'),
+            (italy, 'PROTEZIONE_CIVILE_URL', 'dpc_covid19_ita_regioni.csv'),
+        ]
+        patches = [patch.object(m, a, f'{self.base}/{f}') for m, a, f in urls]
+        for p in patches:
+            p.start()
+        try:
+            frames = download.read_all({**usa.sources(), **italy.sources()})
+            many = odd.USARegionData.fetch_many(
+                states=['NY', 'US'], counties=[36103], frames=frames)
+            lazio = odd.ItalyRegionData.fetch_many(['Lazio'], frames=frames)
+            # served from the cache
+            cache.configure(offline=True)
+            ny = odd.USARegionData.fetch(state='NY')
+            np.testing.assert_array_equal(many['NY'].cases, ny.cases)
+            self.assertEqual(many['36103'].name, 'Suffolk, NY')
+            np.testing.assert_array_equal(
+                lazio['Lazio'].cases, odd.ItalyRegionData.fetch('Lazio').cases)
+        finally:
+            for p in patches:
+                p.stop()
@@ -0,0 +1,98 @@
+import os
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+import numpy as np
+
+from opendemic.data import RegionPanel
+from opendemic.data import USARegionData
+
+FIXTURES = Path(__file__).parent / 'fixtures'
+JHU_CASES = FIXTURES / 'jhu_time_series_cases.csv'
+
+
+class TestRegionPanel(TestCase):
+    """Test the columnar loader of the JHU time series."""
+
+    def setUp(self):
+        self.panel = RegionPanel.from_jhu_csv(JHU_CASES)
+
+    def test_from_jhu_csv(self):
+        panel = self.panel
+        self.assertEqual(len(panel), 5)
+        self.assertEqual(panel.values.shape, (5, 75))
+        self.assertEqual(panel.values.dtype, np.float32)
+        self.assertTrue(panel.values.flags.c_contiguous)
+        self.assertEqual(str(panel.dates[0]), '2020-01-22')
+        self.assertEqual(panel.codes.tolist(),
+                         ['00066', '01001', '06037', '36047', '36103'])
+        self.assertTrue(panel.meta['Population'].isna().all())
+
+    def test_region_is_view(self):
+        region = self.panel.region(36103)
+        self.assertIsInstance(region, USARegionData)
+        self.assertEqual(region.name, 'Suffolk, New York')
+        self.assertTrue(np.shares_memory(region.cases, self.panel.values))
+        expected = USARegionData(region.name, region.code, self.panel.dates,
+                                 self.panel.values[4].copy())
+        np.testing.assert_array_equal(region.new_cases, expected.new_cases)
+        self.assertEqual(self.panel.region('1001').code, '01001')
+        with self.assertRaises(KeyError):
+            self.panel.region('99999')
+
+    def test_memmap(self):
+        with TemporaryDirectory() as tmp:
+            directory = os.path.join(tmp, 'panel')
+            self.panel.to_memmap(directory)
+            panel = RegionPanel.open(directory)
+            self.assertIsInstance(panel.values, np.memmap)
+            np.testing.assert_array_equal(panel.values, self.panel.values)
+            self.assertEqual(list(panel.dates), list(self.panel.dates))
+            self.assertEqual(panel.codes.tolist(), self.panel.codes.tolist())
+            self.assertTrue(np.shares_memory(panel[1].cases, panel.values))
+            del panel
+
+    def test_load_jhu(self):
+        with TemporaryDirectory() as tmp:
+            directory = os.path.join(tmp, 'panel')
+            panel = RegionPanel.load_jhu(str(JHU_CASES), directory)
+            self.assertTrue(os.path.isfile(os.path.join(directory,
+                                                        'values.npy')))
+            self.assertEqual([r.code for r in panel],
+                             self.panel.codes.tolist())
+            del panel
+
+    def test_regions(self):
+        regions = self.panel.regions()
+        for i, region in enumerate(regions):
+            expected = self.panel[i]
+            self.assertEqual(region.code, expected.code)
+            np.testing.assert_array_equal(region.cases, expected.cases)
+            np.testing.assert_array_equal(region.new_cases,
+                                          expected.new_cases)
+            np.testing.assert_array_equal(region.dates, expected.dates)
+            self.assertTrue(np.shares_memory(region.cases,
+                                             self.panel.values))
+
+    def test_aggregate(self):
+        values = self.panel.values
+        levels = self.panel.aggregate(groups={'NYC': [36047, '36103']})
+        self.assertEqual(list(levels), ['AL', 'CA', 'GU', 'NY', 'US', 'NYC'])
+        self.assertEqual(levels['NY'].name, 'New York')
+        self.assertEqual(levels['US'].name, 'United States of America')
+        for code, rows in [('NY', [3, 4]), ('NYC', [3, 4]), ('GU', [0]),
+                           ('US', range(5))]:
+            expected = USARegionData(code, code, self.panel.dates,
+                                     values[list(rows)].sum(axis=0))
+            np.testing.assert_array_equal(levels[code].cases, expected.cases)
+            np.testing.assert_array_equal(levels[code].new_cases,
+                                          expected.new_cases)
+
+        matrix, codes, _ = self.panel.aggregation_matrix(['national'])
+        self.assertEqual(matrix.shape, (1, 5))
+        self.assertEqual(codes.tolist(), ['US'])
+        with self.assertRaises(ValueError):
+            self.panel.aggregate(['county'])
+        with self.assertRaises(ValueError):
+            self.panel.aggregate(groups={'X': [99999]})
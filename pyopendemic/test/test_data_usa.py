@@ -1,5 +1,8 @@
+from datetime import datetime, timedelta
 from unittest import TestCase
 
+import numpy as np
+
 import opendemic.data as odd
 
 
@@ -10,3 +13,65 @@ class TestRegionData(TestCase):
         """Test if the .fetch(...) method is implemented."""
         odd.USARegionData.fetch(state='NY')
         odd.USARegionData.fetch(county=1001)
+
+    def test_from_arrays(self):
+        """Test that the batch constructor matches the constructor."""
+        rng = np.random.default_rng(0)
+        rates = rng.uniform(0, 40, (50, 1)) * np.linspace(0, 2, 60)
+        cases = np.cumsum(rng.poisson(rates), axis=1).astype(np.float32)
+        cases[3, 5] = np.nan
+        dates = np.arange(60)
+        codes = [str(i) for i in range(50)]
+        regions = odd.USARegionData.from_arrays(codes, codes, dates, cases)
+        for code, row, region in zip(codes, cases, regions):
+            expected = odd.USARegionData(code, code, dates, row)
+            self.assertEqual(region.code, code)
+            np.testing.assert_array_equal(region.cases, expected.cases)
+            np.testing.assert_array_equal(region.new_cases,
+                                          expected.new_cases)
+            np.testing.assert_array_equal(region.dates, expected.dates)
+        with self.assertRaises(ValueError):
+            odd.USARegionData.from_arrays(codes, codes, dates[1:], cases)
+
+    def test_compact(self):
+        """Test the slots, the dates and the read-only zero-copy arrays."""
+        dates = [datetime(2020, 3, 1, 18) + timedelta(days=d)
+                 for d in range(30)]
+        region = odd.USARegionData('R', 'R', dates, np.arange(30.) * 20)
+        self.assertFalse(hasattr(region, '__dict__'))
+        self.assertEqual(region.dates.dtype, np.dtype('datetime64[D]'))
+        self.assertEqual(str(region.dates[0]), '2020-03-01')
+        for array in (region.dates, region.cases, region.new_cases):
+            self.assertFalse(array.flags.writeable)
+        df = region.asdf
+        self.assertIs(region.asdf, df)
+        self.assertTrue(np.shares_memory(df['cases'].to_numpy(),
+                                         region.cases))
+        with self.assertRaises(ValueError):
+            df.iloc[0, 0] = 1.
+        df = df.copy()
+        df.iloc[0, 0] = 1.
+
+
+class TestFips(TestCase):
+    """Test the offline FIPS index."""
+
+    def test_lookup(self):
+        self.assertEqual(odd.fips2name(36103), 'Suffolk, NY')
+        self.assertEqual(odd.fips2name('01001'), 'Autauga, AL')
+        self.assertEqual(odd.fips2state(36103.), 'NY')
+        self.assertEqual(odd.name2fips('suffolk', 'ny'), 36103)
+        self.assertEqual(odd.name2fips('New York', 'NY'), 36061)
+
+    def test_batch(self):
+        names = odd.fips2names([36103, 1001, 36000])
+        self.assertEqual(names.tolist(),
+                         ['Suffolk, NY', 'Autauga, AL', 'New York, NY'])
+
+    def test_raises(self):
+        with self.assertRaises(ValueError):
+            odd.fips2name(99999)
+        with self.assertRaises(ValueError):
+            odd.fips2names([36103, 99999])
+        with self.assertRaises(ValueError):
+            odd.name2fips('Atlantis', 'NY')
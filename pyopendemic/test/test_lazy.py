@@ -0,0 +1,28 @@
+import os
+import subprocess
+import sys
+from unittest import TestCase
+
+from opendemic._lazy import lazy_import
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class TestLazyImport(TestCase):
+    def test_import_opendemic_is_light(self):
+        # a fresh interpreter, the test runner may have imported them already
+        code = ('import sys, opendemic, opendemic.modelling; '
+                'print(*sorted(m for m in ("pandas", "scipy.stats", '
+                '"scipy.ndimage", "scipy.signal", "scipy.special") '
+                'if m in sys.modules))')
+        out = subprocess.run([sys.executable, '-c', code], cwd=_ROOT,
+                             capture_output=True, text=True, check=True)
+        self.assertEqual(out.stdout.strip(), '')
+
+    def test_lazy_module(self):
+        sys.modules.pop('colorsys', None)
+        module = lazy_import('colorsys')
+        self.assertNotIn('colorsys', sys.modules)
+        self.assertEqual(module.rgb_to_hsv(1., 0., 0.), (0., 1., 1.))
+        self.assertIn('colorsys', sys.modules)
+        self.assertIs(lazy_import('os'), os)
@@ -0,0 +1,228 @@
+from datetime import datetime, timedelta
+from os import path
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+import numpy as np
+
+import opendemic.modelling as odm
+from opendemic.data import USARegionData
+from opendemic.modelling import systrom
+from opendemic.modelling.incremental import DEFAULT_LAG
+
+
+def _synthetic_region(name, scale=50, npoints=60, seed=0):
+    rng = np.random.default_rng(seed)
+    t = np.arange(npoints)
+    lam = scale * np.exp(0.06 * t - 0.0008 * t ** 2)
+    new_cases = rng.poisson(lam)
+    dates = [datetime(2020, 3, 1) + timedelta(days=int(d)) for d in t]
+    return USARegionData(name, name, dates, np.cumsum(new_cases) + 20)
+
+
+class TestComputeRt(TestCase):
+    def test_exports(self):
+        self.assertIs(odm.high_density_interval,
+                      systrom.high_density_interval)
+        self.assertIs(odm.RT_RANGE, systrom.RT_RANGE)
+
+    def test_grid(self):
+        new_cases = _synthetic_region('R').new_cases
+        rt, low, high = odm.compute_rt(new_cases)
+        grid = odm.RtGrid.from_resolution(0, 6, 0.05)
+        for g in [grid, 'adaptive']:
+            rt_g, low_g, high_g = odm.compute_rt(new_cases, {'grid': g})
+            np.testing.assert_allclose(rt_g[10:], rt[10:], atol=0.051)
+            self.assertTrue(np.all(low_g <= rt_g) and np.all(rt_g <= high_g))
+
+    def test_many(self):
+        regions = [_synthetic_region(f'R{i}', seed=i) for i in range(3)]
+        # a single day is not a time series, hence the model fails
+        regions.append(USARegionData('Z', 'Z', regions[0].dates[:1], [20.]))
+        calls = []
+        for processes in [1, 2]:
+            results, errors = odm.compute_rt_many(
+                regions, processes=processes,
+                callback=lambda *args: calls.append(args[:2]))
+            self.assertEqual(list(results), ['R0', 'R1', 'R2'])
+            self.assertEqual(list(errors), ['Z'])
+            for r in regions[:3]:
+                for a, b in zip(results[r.code], odm.compute_rt(r.new_cases)):
+                    np.testing.assert_array_equal(a, b)
+        self.assertEqual(calls, [(i, 4) for i in range(1, 5)] * 2)
+
+
+class TestIncrementalRt(TestCase):
+    def setUp(self):
+        self.tmp = TemporaryDirectory()
+        self.full = _synthetic_region('R', npoints=80)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def _region(self, npoints, cases=None):
+        cases = self.full.cases if cases is None else cases
+        return USARegionData('R', 'R', self.full.dates[:npoints],
+                             cases[:npoints])
+
+    def test_statuses(self):
+        job = odm.IncrementalRt(self.tmp.name)
+        self.assertEqual(job.update(self._region(50))[1], 'new')
+        # the state at the checkpoint is the one of a filter fed day by day
+        f = odm.SystromFilter.load(path.join(self.tmp.name, 'R.filter.npz'))
+        expected = odm.SystromFilter().update_many(
+            self._region(50).new_cases[:50 - DEFAULT_LAG])
+        self.assertEqual(f.ndays, expected.ndays)
+        self.assertEqual(f.last, expected.last)
+        self.assertAlmostEqual(f.llhood, expected.llhood, places=10)
+        np.testing.assert_allclose(f.posterior, expected.posterior,
+                                   rtol=0, atol=1e-14)
+        self.assertEqual(job.update(self._region(50))[1], 'unchanged')
+        for npoints in range(51, 81):
+            region = self._region(npoints)
+            rt, status = job.update(region)
+            self.assertEqual(status, 'resumed')
+            for a, b in zip(rt, odm.compute_rt(region.new_cases)):
+                np.testing.assert_allclose(a, b, rtol=0, atol=1e-12)
+
+        # a revision of the history forces a full recomputation
+        cases = self.full.cases.copy()
+        cases[5:] += 100
+        region = self._region(80, cases)
+        rt, status = job.update(region)
+        self.assertEqual(status, 'recomputed')
+        np.testing.assert_array_equal(rt[0],
+                                      odm.compute_rt(region.new_cases)[0])
+        np.testing.assert_array_equal(job.load('R')['rt'], rt[0])
+
+        # so does a change of the parameters
+        job = odm.IncrementalRt(self.tmp.name, sigma=0.3)
+        self.assertEqual(job.update(region)[1], 'recomputed')
+
+    def test_update_many(self):
+        job = odm.IncrementalRt(self.tmp.name)
+        bad = USARegionData('Z', 'Z', self.full.dates[:1], [20.])
+        results, statuses, errors = job.update_many([self._region(60), bad])
+        self.assertEqual(list(results), ['R'])
+        self.assertEqual(statuses, {'R': 'new'})
+        self.assertEqual(list(errors), ['Z'])
+
+
+class TestRtStore(TestCase):
+    def setUp(self):
+        self.tmp = TemporaryDirectory()
+        self.regions = [_synthetic_region(f'R{i}', seed=i) for i in range(3)]
+        self.results, _ = odm.compute_rt_many(self.regions, processes=1)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_append_and_read(self):
+        store = odm.RtStore(self.tmp.name)
+        store.append_many(self.regions, self.results)
+        # reopened from the index
+        store = odm.RtStore(self.tmp.name)
+        self.assertEqual(store.codes, ['R0', 'R1', 'R2'])
+        r = self.regions[1]
+        values = store.read('R1')
+        np.testing.assert_array_equal(values['date'], r.dates)
+        np.testing.assert_array_equal(values['rt'], self.results['R1'][0])
+        np.testing.assert_array_equal(values['new_cases'], r.new_cases)
+
+        values = store.read('R1', start='2020-03-20', end='2020-04-05',
+                            columns=['low'])
+        self.assertEqual(list(values), ['date', 'low'])
+        self.assertEqual(str(values['date'][0]), '2020-03-20')
+        self.assertEqual(str(values['date'][-1]), '2020-04-05')
+        self.assertEqual(values['date'].size, 17)
+
+        df = store.query(['R0', 'R2'], start='2020-04-01')
+        self.assertEqual(list(df.columns[:3]), ['date', 'code', 'name'])
+        self.assertEqual(df['code'].unique().tolist(), ['R0', 'R2'])
+        self.assertTrue((df['date'] >= '2020-04-01').all())
+        with self.assertRaises(KeyError):
+            store.read('R9')
+
+    def test_replace_days(self):
+        store = odm.RtStore(self.tmp.name)
+        r = self.regions[0]
+        rt, low, high = self.results['R0']
+        store.append('R0', r.dates[:40], rt[:40], low[:40], high[:40])
+        store.append('R0', r.dates[30:], rt[30:] + 1, low[30:], high[30:])
+        values = store.read('R0', columns=['rt', 'cases'])
+        np.testing.assert_array_equal(values['date'], r.dates)
+        np.testing.assert_array_equal(values['rt'][:30], rt[:30])
+        np.testing.assert_array_equal(values['rt'][30:], rt[30:] + 1)
+        self.assertTrue(np.isnan(values['cases']).all())
+        self.assertEqual(store.date_range('R0'), (r.dates[0], r.dates[-1]))
+
+
+class TestSigmaUpdate(TestCase):
+    def setUp(self):
+        self.regions = [_synthetic_region(f'R{i}', seed=i) for i in range(3)]
+        self.grid = np.linspace(0.1, 0.5, 5)
+
+    def test_total_is_sum_over_regions(self):
+        opt, info = odm.sigma_update(self.regions, self.grid, processes=1,
+                                     full_output=True)
+        expected = np.zeros(self.grid.size)
+        for r in self.regions:
+            for i, s in enumerate(self.grid):
+                expected[i] += systrom.get_posteriors(r.new_cases, s)[1]
+        np.testing.assert_allclose(info['total'], expected)
+        self.assertEqual(opt, self.grid[expected.argmax()])
+        self.assertEqual(info['llhoods'].shape, (3, 5))
+
+    def test_pool_matches_serial(self):
+        serial = odm.sigma_update(self.regions, self.grid, processes=1,
+                                  refine=1, full_output=True)
+        pool = odm.sigma_update(self.regions, self.grid, processes=2,
+                                refine=1, full_output=True)
+        self.assertEqual(serial[0], pool[0])
+        np.testing.assert_array_equal(serial[1]['total'], pool[1]['total'])
+
+    def test_refine(self):
+        opt, info = odm.sigma_update(self.regions, self.grid, processes=1,
+                                     refine=2, full_output=True)
+        self.assertGreater(info['sigmas'].size, self.grid.size)
+        self.assertGreaterEqual(info['total'].max(), info['total'][
+            np.isin(info['sigmas'], self.grid)].max())
+        self.assertTrue(self.grid[0] <= opt <= self.grid[-1])
+
+
+class TestPosteriorCube(TestCase):
+    def setUp(self):
+        self.tmp = TemporaryDirectory()
+        self.regions = [_synthetic_region(f'R{i}', seed=i, npoints=40 + i)
+                        for i in range(3)]
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_forms(self):
+        for form in ['dense', 'band']:
+            directory = f'{self.tmp.name}/{form}'
+            results, errors = odm.write_posterior_cube(
+                directory, self.regions, form=form, tol=1e-12)
+            self.assertEqual(errors, {})
+            cube = odm.PosteriorCube(directory)
+            self.assertEqual(cube.shape, (3, 42, 1201))
+            for r in self.regions:
+                for a, b in zip(results[r.code], odm.compute_rt(r.new_cases)):
+                    np.testing.assert_array_equal(a, b)
+                posteriors, _ = systrom.get_posteriors(r.new_cases)
+                dates, stored = cube.region(r.code)
+                np.testing.assert_array_equal(dates, r.dates)
+                np.testing.assert_allclose(stored, posteriors, atol=1e-7)
+                dates, stored = cube.region(r.code, start=r.dates[10],
+                                            end=r.dates[19])
+                np.testing.assert_array_equal(dates, r.dates[10:20])
+                np.testing.assert_allclose(stored, posteriors[10:20],
+                                           atol=1e-7)
+            day = cube.day(self.regions[2].dates[-1])
+            self.assertFalse(day[:2].any())
+            np.testing.assert_allclose(day[2], posteriors[-1], atol=1e-7)
+
+        with self.assertRaises(ValueError):
+            odm.write_posterior_cube(self.tmp.name, self.regions,
+                                     {'grid': 'adaptive'})
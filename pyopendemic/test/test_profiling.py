@@ -0,0 +1,57 @@
+import json
+import os
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+import numpy as np
+
+from opendemic import profiling
+from opendemic.modelling import systrom
+
+
+class TestProfiling(TestCase):
+    def setUp(self):
+        profiling.reset()
+
+    def tearDown(self):
+        profiling.disable()
+        profiling.reset()
+
+    def test_disabled(self):
+        with profiling.span('a'):
+            profiling.count('b')
+        self.assertEqual(profiling.stats(), {})
+        self.assertEqual(profiling.counters(), {})
+
+    def test_nested_spans(self):
+        calls = []
+        profiling.enable(callback=lambda name, s: calls.append(name))
+        with profiling.span('outer'):
+            with profiling.span('inner'):
+                profiling.count('n', 3)
+            profiling.count('n')
+        stats = profiling.stats()
+        self.assertEqual(calls, ['inner', 'outer'])
+        self.assertEqual(stats['outer']['calls'], 1)
+        self.assertAlmostEqual(stats['outer']['self'],
+                               stats['outer']['total'] -
+                               stats['inner']['total'])
+        self.assertEqual(profiling.counters(), {'n': 4})
+        self.assertIn('outer', profiling.report())
+
+    def test_stages(self):
+        profiling.enable(trace=True)
+        ts = np.round(np.linspace(20, 200, 80))
+        systrom.get_summaries(ts)
+        stats = profiling.stats()
+        for stage in ['modelling.filter', 'modelling.likelihood',
+                      'modelling.hdi']:
+            self.assertIn(stage, stats)
+        self.assertEqual(profiling.counters()['modelling.days'], 79)
+        with TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'trace.json')
+            profiling.write_trace(path)
+            with open(path) as f:
+                trace = json.load(f)
+        self.assertEqual(len(trace['traceEvents']),
+                         sum(s['calls'] for s in stats.values()))
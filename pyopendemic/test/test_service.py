@@ -0,0 +1,112 @@
+import json
+import threading
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+from urllib.error import HTTPError
+from urllib.request import urlopen
+
+import numpy as np
+
+import opendemic.modelling as odm
+from opendemic.data import USARegionData
+from opendemic.service import RtService
+
+
+def _region(code, seed):
+    rng = np.random.default_rng(seed)
+    t = np.arange(40)
+    cases = np.cumsum(rng.poisson(50 * np.exp(0.05 * t))) + 20
+    return USARegionData(f'Region {code}', code,
+                         np.datetime64('2020-03-01') + t, cases)
+
+
+class TestRtService(TestCase):
+    def setUp(self):
+        self.regions = {c: _region(c, i) for i, c in enumerate('ABC')}
+
+    def test_cache_and_eviction(self):
+        service = RtService(self.regions, cache_size=2)
+        try:
+            a = service.get('A')
+            for a_, b_ in zip((a['rt'], a['low'], a['high']),
+                              odm.compute_rt(self.regions['A'].new_cases)):
+                np.testing.assert_array_equal(a_, b_)
+            self.assertIs(service.get('A'), a)
+            service.get('B')
+            service.get('C')  # evicts A
+            service.get('A')
+            with self.assertRaises(KeyError):
+                service.get('Z')
+            stats = service.stats()
+        finally:
+            service.stop()
+        self.assertEqual(stats['requests'], 6)
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['computed'], 4)
+        self.assertEqual(stats['evictions'], 2)
+        self.assertEqual(stats['errors'], 1)
+        self.assertAlmostEqual(stats['hit_rate'], 1 / 6)
+
+    def test_deduplication(self):
+        release = threading.Event()
+        calls = []
+
+        def loader(code):
+            calls.append(code)
+            release.wait(5)
+            return self.regions[code]
+
+        service = RtService(loader)
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(
+            service.get('B'))) for _ in range(5)]
+        try:
+            for t in threads:
+                t.start()
+            while service.stats()['deduplicated'] < 4:
+                threading.Event().wait(0.01)
+            release.set()
+            for t in threads:
+                t.join()
+        finally:
+            release.set()
+            service.stop()
+        self.assertEqual(calls, ['B'])
+        self.assertEqual(len(results), 5)
+        self.assertTrue(all(r is results[0] for r in results))
+
+    def test_http(self):
+        with TemporaryDirectory() as tmp:
+            store = odm.RtStore(tmp)
+            store.append_region(self.regions['C'], odm.compute_rt(
+                self.regions['C'].new_cases))
+            service = RtService({'A': self.regions['A']}, store=store)
+            server = service.start()
+            base = f'http://127.0.0.1:{server.server_port}'
+            try:
+                with urlopen(f'{base}/rt?region=A&from=2020-03-20'
+                             f'&to=2020-03-25') as response:
+                    out = json.load(response)
+                self.assertEqual(out['name'], 'Region A')
+                self.assertEqual(out['dates'][0], '2020-03-20')
+                self.assertEqual(len(out['rt']), 6)
+                with urlopen(f'{base}/rt?region=C') as response:
+                    out = json.load(response)
+                self.assertEqual(len(out['rt']),
+                                 self.regions['C'].npoints)
+                for url, status in [('/rt?region=Z', 404), ('/rt', 400),
+                                    ('/rt?region=A&from=x', 400),
+                                    ('/nothing', 404)]:
+                    with self.assertRaises(HTTPError) as e:
+                        urlopen(base + url)
+                    self.assertEqual(e.exception.code, status)
+                    e.exception.close()
+                with urlopen(f'{base}/regions') as response:
+                    self.assertEqual(json.load(response)['regions'],
+                                     ['A', 'C'])
+                with urlopen(f'{base}/stats') as response:
+                    stats = json.load(response)
+            finally:
+                service.stop()
+        self.assertEqual(stats['store_reads'], 1)
+        self.assertEqual(stats['computed'], 1)
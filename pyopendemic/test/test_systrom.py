@@ -1,5 +1,20 @@
+from os import path
+from tempfile import TemporaryDirectory
 from unittest import TestCase
+
+import numpy as np
+
+from opendemic.modelling import streaming
 from opendemic.modelling import systrom
+from opendemic.modelling import transition
+
+
+def _synthetic_series(scale=300, npoints=90, seed=0):
+    rng = np.random.default_rng(seed)
+    t = np.arange(npoints)
+    lam = scale * np.exp(0.05 * t - 0.0006 * t ** 2)
+    ts = np.round(lam + rng.normal(0, 1, t.size) * np.sqrt(lam))
+    return ts.clip(1)
 
 
 class TestPosteriors(TestCase):
@@ -7,8 +22,259 @@ class TestPosteriors(TestCase):
         with self.assertRaises(ValueError):
             systrom.get_posteriors([[1, 2], [3, 4]])
 
+    def test_raises_unknown_engine(self):
+        with self.assertRaises(ValueError):
+            systrom.get_posteriors(_synthetic_series(), engine='sparse')
+
+    def test_engines_match_dense(self):
+        ts = _synthetic_series()
+        dense, llhood = systrom.get_posteriors(ts, engine='dense')
+        for engine in transition.ENGINES:
+            post, ll = systrom.get_posteriors(ts, engine=engine)
+            np.testing.assert_allclose(post, dense, rtol=0, atol=1e-12)
+            self.assertAlmostEqual(ll, llhood, places=8)
+
+    def test_engine_instance(self):
+        ts = _synthetic_series()
+        grid = systrom.RtGrid.from_resolution(0, 6, 0.01)
+        engine = transition.BandedTransition(grid.values, 0.5)
+        post, llhood = systrom.get_posteriors(ts, sigma=0.5, engine=engine)
+        expected, ll = systrom.get_posteriors(ts, sigma=0.5, grid=grid)
+        np.testing.assert_array_equal(post, expected)
+        self.assertEqual(llhood, ll)
+        with self.assertRaises(ValueError):
+            systrom.get_posteriors(ts, sigma=0.1, engine=engine)
+        with self.assertRaises(ValueError):
+            systrom.get_posteriors(ts, sigma=0.5, engine=engine,
+                                   grid=systrom.DEFAULT_GRID)
+
+    def test_log_likelihood_matches_pmf(self):
+        ts = _synthetic_series()
+        post, llhood = systrom.get_posteriors(ts)
+        post_log, llhood_log = systrom.get_posteriors(ts, likelihood='log')
+        np.testing.assert_allclose(post_log, post, rtol=0, atol=1e-10)
+        self.assertAlmostEqual(llhood_log, llhood, places=6)
+
+    def test_log_likelihood_large_counts(self):
+        # the Poisson pmf underflows on the whole Rt grid for such counts
+        ts = _synthetic_series(scale=1e10)
+        post, llhood = systrom.get_posteriors(ts, likelihood='log')
+        self.assertTrue(np.all(np.isfinite(post)))
+        self.assertTrue(np.isfinite(llhood))
+
+    def test_float32(self):
+        ts = _synthetic_series()
+        post, llhood = systrom.get_posteriors(ts, likelihood='log')
+        post32, llhood32 = systrom.get_posteriors(ts, likelihood='log',
+                                                  dtype=np.float32)
+        self.assertEqual(post32.dtype, np.float32)
+        np.testing.assert_allclose(post32, post, rtol=0, atol=1e-4)
+        self.assertAlmostEqual(llhood32, llhood, delta=1e-3 * abs(llhood))
+
+    def test_float32_large_counts(self):
+        # only the stored posteriors are rounded to single precision
+        ts = _synthetic_series(scale=1e5)
+        post, llhood = systrom.get_posteriors(ts, likelihood='log')
+        post32, llhood32 = systrom.get_posteriors(ts, likelihood='log',
+                                                  dtype=np.float32)
+        np.testing.assert_allclose(post32, post, rtol=1e-6, atol=1e-30)
+        self.assertAlmostEqual(llhood32, llhood, places=8)
+        rt32, low32, high32, ll32 = systrom.get_batch_summaries(
+            ts[None], likelihood='log', dtype=np.float32)
+        rt, _, _, ll = systrom.get_batch_summaries(ts[None], likelihood='log')
+        np.testing.assert_array_equal(rt32, rt)
+        np.testing.assert_allclose(ll32, ll, rtol=1e-12)
+
+    def test_raises_unknown_likelihood(self):
+        with self.assertRaises(ValueError):
+            systrom.get_posteriors(_synthetic_series(), likelihood='normal')
+
+
+class TestSummaries(TestCase):
+    def test_matches_posteriors(self):
+        # longer than a chunk of days to test the buffering
+        ts = _synthetic_series(npoints=150)
+        grid = systrom.RtGrid.from_resolution(0, 8, 0.02)
+        post, llhood = systrom.get_posteriors(ts, grid=grid)
+        summaries, ll = systrom.get_summaries(ts, grid=grid, p=0.8,
+                                              mean=True,
+                                              quantiles=[0.05, 0.5, 0.95])
+        self.assertAlmostEqual(ll, llhood, places=10)
+        rt_range = grid.values
+        np.testing.assert_array_equal(summaries['rt'],
+                                      rt_range[post.argmax(axis=1)])
+        low, high = systrom.high_density_intervals(post, 0.8, rt_range)
+        np.testing.assert_array_equal(summaries['low'], low)
+        np.testing.assert_array_equal(summaries['high'], high)
+        np.testing.assert_allclose(summaries['mean'], post @ rt_range)
+        cumsum = np.cumsum(post, axis=1)
+        for j, q in enumerate([0.05, 0.5, 0.95]):
+            idx = np.argmax(cumsum >= q, axis=1)
+            np.testing.assert_array_equal(summaries['quantiles'][:, j],
+                                          rt_range[idx])
+
+
+class TestGrid(TestCase):
+    def test_from_resolution(self):
+        grid = systrom.RtGrid.from_resolution(0, 6, 0.05)
+        self.assertEqual(grid.num, 121)
+        np.testing.assert_allclose(np.diff(grid.values), 0.05)
+        self.assertEqual(systrom.DEFAULT_GRID.values.tolist(),
+                         systrom.RT_RANGE.tolist())
+
+    def test_custom_grid(self):
+        ts = _synthetic_series()
+        grid = systrom.RtGrid.from_resolution(0, 6, 0.02)
+        post, _ = systrom.get_posteriors(ts, grid=grid)
+        self.assertEqual(post.shape, (ts.size, grid.num))
+        with self.assertRaises(ValueError):
+            systrom.high_density_intervals(post)
+        low, high = systrom.high_density_intervals(post, rt_range=grid.values)
+        self.assertTrue(np.all(low <= high))
+
+    def test_adaptive(self):
+        ts = _synthetic_series()
+        post, llhood, grid = systrom.get_posteriors_adaptive(ts)
+        self.assertLess(grid.num, systrom.RT_RANGE.size)
+        self.assertAlmostEqual(grid.resolution, 0.01)
+        self.assertEqual(post.shape, (ts.size, grid.num))
+        full, _ = systrom.get_posteriors(ts)
+        np.testing.assert_allclose(grid.values[post[10:].argmax(axis=1)],
+                                   systrom.RT_RANGE[full[10:].argmax(axis=1)],
+                                   atol=0.011)
+
+
+class TestBatch(TestCase):
+    def test_matches_single_series(self):
+        series = [_synthetic_series(npoints=30, seed=s) for s in range(3)]
+        ts = np.full((3, 40), np.nan)
+        ts[0, :30] = series[0]
+        ts[1, 10:] = series[1]
+        ts[2, 5:25] = series[2][:20]
+        rt, low, high, llhood = systrom.get_batch_summaries(ts)
+        for r in range(3):
+            valid = np.isfinite(ts[r])
+            post, ll = systrom.get_posteriors(ts[r, valid])
+            self.assertAlmostEqual(llhood[r], ll, places=8)
+            np.testing.assert_array_equal(
+                rt[r, valid], systrom.RT_RANGE[post.argmax(axis=1)])
+            hdi = np.asarray([systrom.high_density_interval(p) for p in post])
+            np.testing.assert_array_equal(low[r, valid], hdi[:, 0])
+            np.testing.assert_array_equal(high[r, valid], hdi[:, 1])
+            self.assertTrue(np.all(np.isnan(rt[r, ~valid])))
+
+    def test_banded_batch_operator(self):
+        # batches are multiplied by a dense matrix, or a sparse one on large
+        # grids, single pmfs are convolved
+        for num in (1201, transition.DENSE_BATCH_MAX_POINTS + 1):
+            rt_range = np.linspace(0, 12, num)
+            engine = transition.BandedTransition(rt_range, 0.25)
+            pmfs = np.random.default_rng(0).random((5, num))
+            pmfs /= pmfs.sum(axis=1, keepdims=True)
+            rows = np.vstack([engine.apply(pmf) for pmf in pmfs])
+            np.testing.assert_allclose(engine.apply(pmfs), rows, rtol=1e-12)
+            np.testing.assert_allclose(engine.matrix @ pmfs[0], rows[0],
+                                       rtol=1e-12)
+
+    def test_raises_non_contiguous(self):
+        mask = np.ones((2, 10), dtype=bool)
+        mask[1, 5] = False
+        with self.assertRaises(ValueError):
+            systrom.get_batch_summaries(np.ones((2, 10)), mask=mask)
+
+
+class TestFilter(TestCase):
+    def test_matches_posteriors(self):
+        ts = _synthetic_series(npoints=40)
+        post, llhood = systrom.get_posteriors(ts)
+        f = streaming.SystromFilter().update_many(ts[:30])
+        f.update_many(ts[30:])
+        self.assertEqual(f.ndays, ts.size)
+        np.testing.assert_allclose(f.posterior, post[-1], rtol=0, atol=1e-12)
+        self.assertAlmostEqual(f.llhood, llhood, places=8)
+        self.assertEqual(f.rt, systrom.RT_RANGE[post[-1].argmax()])
+        self.assertEqual(f.hdi, systrom.high_density_interval(post[-1]))
+
+    def test_save_load(self):
+        ts = _synthetic_series(npoints=40)
+        grid = systrom.RtGrid.from_resolution(0, 8, 0.02)
+        f = streaming.SystromFilter(sigma=0.3, grid=grid)
+        f.update_many(ts[:30])
+        with TemporaryDirectory() as tmp:
+            fname = path.join(tmp, 'state.npz')
+            f.save(fname)
+            g = streaming.SystromFilter.load(fname)
+        self.assertEqual(g.sigma, 0.3)
+        self.assertEqual(g.grid, grid)
+        self.assertEqual(g.ndays, 30)
+        g.update_many(ts[30:])
+        f.update_many(ts[30:])
+        np.testing.assert_array_equal(g.posterior, f.posterior)
+        self.assertEqual(g.llhood, f.llhood)
+
+    def test_raises_without_data(self):
+        with self.assertRaises(ValueError):
+            streaming.SystromFilter().rt
+
+
+class TestModelCache(TestCase):
+    def setUp(self):
+        systrom.clear_model_cache()
+
+    def tearDown(self):
+        systrom.clear_model_cache()
+
+    def test_model_is_reused(self):
+        model = systrom.get_model(0.25, 'dense')
+        self.assertIs(systrom.get_model(0.25, 'DENSE'), model)
+        self.assertIsNot(systrom.get_model(0.3, 'dense'), model)
+        info = systrom.model_cache_info()
+        self.assertEqual(info.hits, 1)
+        self.assertEqual(info.currsize, 2)
+
+    def test_clear(self):
+        systrom.get_posteriors(_synthetic_series(npoints=10))
+        self.assertEqual(systrom.model_cache_info().currsize, 1)
+        systrom.clear_model_cache()
+        self.assertEqual(systrom.model_cache_info().currsize, 0)
+
+    def test_model_is_read_only(self):
+        model = systrom.get_model()
+        with self.assertRaises(ValueError):
+            model.growth[0] = 0
+
 
 class TestHDI(TestCase):
     def test_raises(self):
         with self.assertRaises(ValueError):
             systrom.high_density_interval([[1, 2], [3, 4]])
+        with self.assertRaises(ValueError):
+            systrom.high_density_intervals([1, 2])
+
+    def test_matches_brute_force(self):
+        post, _ = systrom.get_posteriors(_synthetic_series(npoints=40))
+        rng = np.random.default_rng(1)
+        pmfs = rng.random((5, systrom.RT_RANGE.size)) ** 8
+        pmfs /= pmfs.sum(axis=1, keepdims=True)
+        pmfs = np.concatenate([post, pmfs])
+        for p in [0.5, 0.9, 0.99]:
+            low, high = systrom.high_density_intervals(pmfs, p)
+            for i, pmf in enumerate(pmfs):
+                cumsum = np.cumsum(pmf)
+                lows, highs = ((cumsum - cumsum[:, None]) > p).nonzero()
+                best = (highs - lows).argmin()
+                self.assertEqual(low[i], systrom.RT_RANGE[lows[best]])
+                self.assertEqual(high[i], systrom.RT_RANGE[highs[best]])
+
+    def test_nan_rows_and_float32(self):
+        post, _ = systrom.get_posteriors(_synthetic_series(npoints=40))
+        pmfs = post.astype(np.float32)
+        pmfs[3, 500:] = np.nan
+        low, high = systrom.high_density_intervals(pmfs)
+        self.assertTrue(np.isnan(low[3]) and np.isnan(high[3]))
+        for i in [0, 1, 2, 4, 39]:
+            cumsum = np.cumsum(pmfs[i])
+            lows, highs = ((cumsum - cumsum[:, None]) > 0.9).nonzero()
+            best = (highs - lows).argmin()
+            self.assertEqual(low[i], systrom.RT_RANGE[lows[best]])
+            self.assertEqual(high[i], systrom.RT_RANGE[highs[best]])